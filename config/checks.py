@@ -0,0 +1,42 @@
+"""
+System checks of the deployment settings.
+
+OTP codes, pending registrations, throttle buckets, the token blacklist,
+lot cache versions and replica pins all live in the default cache, live
+availability is published through ``LIVE_BROKER``, and the
+app runs several worker processes (config/gunicorn.conf.py). A per-process
+cache or broker would give every worker its own copy of them, so outside
+DEBUG both have to be shared, which in practice means setting REDIS_URL.
+These are deployment checks (``check --deploy``), which gunicorn runs before
+starting any worker.
+"""
+from django.conf import settings
+from django.core import checks
+
+LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+LOCAL_BROKERS = ("parking.live.LocalBroker",)
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if settings.DEBUG:
+        return []
+    errors = []
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend in LOCAL_CACHES:
+        errors.append(checks.Error(
+            f"The default cache ({backend}) is local to each worker process.",
+            hint="Set REDIS_URL so every worker shares OTPs, throttles, the token blacklist and the lot cache.",
+            id="config.E001",
+        ))
+    broker = getattr(settings, "LIVE_BROKER", {}).get("BACKEND", "parking.live.LocalBroker")
+    if broker in LOCAL_BROKERS:
+        errors.append(checks.Error(
+            f"The live availability broker ({broker}) only reaches its own worker process.",
+            hint="Set REDIS_URL so live streams hear about changes made by every worker.",
+            id="config.E002",
+        ))
+    return errors
@@ -0,0 +1,48 @@
+"""
+gunicorn settings for running the ASGI app on uvicorn workers:
+
+    gunicorn -c config/gunicorn.conf.py config.asgi:application
+
+Workers share their Prometheus metrics through PROMETHEUS_MULTIPROC_DIR
+(see config/metrics.py), which is emptied on start and cleaned up as
+workers exit. A worker that exits writes the sensor readings it still
+buffers (see parking/sensors.py). The Django deployment checks run before any worker starts, so
+a deployment without a shared cache (see config/checks.py) refuses to start.
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+MANAGE_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "manage.py")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+
+def on_starting(server):
+    # in a process of its own, so the master doesn't load Django or touch the metrics directory;
+    # a failed check raises CalledProcessError, which stops gunicorn
+    env = {key: value for key, value in os.environ.items() if key != "PROMETHEUS_MULTIPROC_DIR"}
+    subprocess.run([sys.executable, MANAGE_PY, "check", "--deploy"], env=env, check=True)
+
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        # values left over from a previous run would be added to this one's
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def worker_exit(server, worker):
+    # runs in the worker, once it stopped serving; a worker that failed to boot has no Django to flush
+    from django.apps import apps
+    if apps.ready:
+        from parking.sensors import flush_on_exit
+        flush_on_exit()
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,115 @@
+"""
+Prometheus metrics, served at ``/metrics``.
+
+Every request is timed by `MetricsMiddleware` into a latency histogram per
+route (the URL name) and status, alongside the number and total time of the
+queries it ran (collected by config/middleware.py) and a gauge of requests
+in flight. The business counters below are incremented where the events
+happen.
+
+Updating a metric only touches memory in the current process. When several
+worker processes serve the app, set ``PROMETHEUS_MULTIPROC_DIR`` to an empty
+directory shared by the workers: each process then keeps its values in a
+memory-mapped file there and ``/metrics`` adds up every worker's file. The
+gunicorn config (config/gunicorn.conf.py) clears the directory on start and
+removes the files of workers that exit.
+"""
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time taken to answer a request",
+    ["method", "route", "status"],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10),
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "Database queries run by a request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_duration_seconds", "Time a request spent in database queries", ["route"],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+)
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being served", multiprocess_mode="livesum")
+
+BOOKINGS_CREATED = Counter("bookings_created_total", "Bookings created", ["channel"])
+BOOKING_CONFLICTS = Counter("booking_conflicts_total", "Bookings rejected because the spot was taken", ["channel"])
+PAYMENT_INITIATIONS = Counter("payment_initiations_total", "Payment checkouts by outcome", ["outcome"])
+WEBHOOKS_PROCESSED = Counter("payment_webhooks_total", "Payment provider callbacks by outcome", ["outcome"])
+OTPS_SENT = Counter("otps_sent_total", "OTP messages queued for delivery")
+SMS_DELIVERIES = Counter("sms_deliveries_total", "SMS jobs processed by the worker, by resulting status",
+                         ["status"])
+
+SENSOR_EVENTS = Counter("sensor_events_total", "Occupancy sensor events received, by outcome", ["outcome"])
+SENSOR_SPOT_UPDATES = Counter("sensor_spot_updates_total", "Spots whose occupancy flipped on a sensor reading")
+
+PROVIDER_EVENTS = Counter("external_provider_events_total", "Calls to external providers by event",
+                          ["provider", "event"])
+PROVIDER_IN_FLIGHT = Gauge("external_provider_in_flight", "Calls waiting on an external provider", ["provider"],
+                           multiprocess_mode="livesum")
+# 0 closed, 1 half open, 2 open; the worst state across workers
+PROVIDER_CIRCUIT = Gauge("external_provider_circuit_state", "Circuit breaker state of an external provider",
+                         ["provider"], multiprocess_mode="max")
+
+
+def route_of(request):
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match else "unmatched"
+
+
+def observe(request, response, elapsed):
+    route = route_of(request)
+    REQUEST_LATENCY.labels(request.method, route, response.status_code).observe(elapsed)
+    stats = getattr(request, "query_stats", None)
+    if stats is not None:
+        REQUEST_QUERIES.labels(route).observe(stats.count)
+        REQUEST_DB_TIME.labels(route).observe(stats.duration)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with IN_FLIGHT.track_inprogress():
+            response = self.get_response(request)
+        observe(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with IN_FLIGHT.track_inprogress():
+            response = await self.get_response(request)
+        observe(request, response, time.perf_counter() - started)
+        return response
+
+
+def registry():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        combined = CollectorRegistry()
+        multiprocess.MultiProcessCollector(combined)
+        return combined
+    return REGISTRY
+
+
+def metrics_view(request):
+    """the metrics of every worker, in the Prometheus text format"""
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
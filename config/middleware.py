@@ -0,0 +1,186 @@
+"""
+Per-request database instrumentation.
+
+`QueryInstrumentationMiddleware` counts the queries of every request, their
+total time and the statements that ran more than once (usually an N+1), and
+reports them in a ``Server-Timing`` header and a JSON log record on this
+module's logger (DEBUG, or WARNING when the view is over budget).
+
+Queries are recorded by a wrapper installed on every database connection,
+which reports to the current request through a context variable, so the
+queries that async views run in worker threads are counted too.
+
+Views declare how many queries a request may take with a ``query_budget``
+attribute: an int, or a dict by viewset action (by lower-case method on
+other views). Plain function views use
+the `query_budget` decorator. Going over budget is logged as a warning, or
+raises `QueryBudgetExceeded` when ``settings.QUERY_BUDGET_STRICT`` is on,
+which the test runner does (see config/test_runner.py).
+"""
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+DUPLICATES_REPORTED = 3
+
+_current = ContextVar("query_stats", default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def duplicates(self, top=DUPLICATES_REPORTED):
+        return [(sql, count) for sql, count in self.statements.most_common(top) if count > 1]
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.duration += time.perf_counter() - started
+        stats.statements[sql] += 1
+
+
+@contextmanager
+def uncounted():
+    """queries run inside are left out of the current request's stats"""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def instrument(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(instrument)
+
+
+def query_budget(limit):
+    """declares the query budget of a function view"""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def view_setting(view, method, name):
+    """
+    The `name` attribute declared by `view` (or its DRF view class) for a
+    request with `method`. Dict values are looked up by viewset action, or by
+    lower-case method on other views.
+    """
+    # async views that hand some methods to a DRF view (parking/async_views.py)
+    if getattr(view, "sync_view", None) is not None:
+        if method not in view.async_methods or getattr(view, name, None) is None:
+            view = view.sync_view
+
+    value = getattr(view, name, None)
+    if value is None:
+        value = getattr(getattr(view, "cls", None), name, None)
+    if isinstance(value, dict):
+        actions = getattr(view, "actions", None)
+        value = value.get(actions.get(method.lower()) if actions else method.lower())
+    return value
+
+
+def budget_for(request):
+    """the query budget declared by the view that served `request`, if any"""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return None
+    return view_setting(match.func, request.method, "query_budget")
+
+
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, started = self.start()
+        request.query_stats = stats
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats, token, started = self.start()
+        request.query_stats = stats
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, started)
+
+    @staticmethod
+    def start():
+        # connections opened before this module was imported missed connection_created
+        for connection in connections.all(initialized_only=True):
+            instrument(connection)
+        stats = QueryStats()
+        return stats, _current.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, started):
+        elapsed = time.perf_counter() - started
+        response["Server-Timing"] = (
+            f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries", '
+            f'app;dur={elapsed * 1000:.1f}'
+        )
+
+        budget = budget_for(request)
+        match = getattr(request, "resolver_match", None)
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": match.view_name if match else None,
+            "status": response.status_code,
+            "queries": stats.count,
+            "db_ms": round(stats.duration * 1000, 2),
+            "duration_ms": round(elapsed * 1000, 2),
+            "budget": budget,
+            "duplicates": [{"sql": sql[:300], "count": count} for sql, count in stats.duplicates()],
+        }
+        if budget is not None and stats.count > budget:
+            if getattr(settings, "QUERY_BUDGET_STRICT", False):
+                raise QueryBudgetExceeded(
+                    f"{request.method} {request.path} ran {stats.count} queries, budget is {budget}: "
+                    f"{json.dumps(record['duplicates'])}"
+                )
+            logger.warning("query budget exceeded %s", json.dumps(record))
+        else:
+            logger.debug("request queries %s", json.dumps(record))
+        return response
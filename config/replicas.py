@@ -0,0 +1,202 @@
+"""
+Read replicas.
+
+`ReplicaRouter` sends every write to ``default`` and the reads of a request
+to the replica that `ReplicaMiddleware` picked for it. A replica is only
+picked for GET/HEAD requests to views that declare ``replica_reads`` (True,
+or a dict by action like ``query_budget``), so everything else, including
+background jobs and management commands, keeps reading from the primary.
+
+Replicas lag behind the primary, so after a successful write a client is
+pinned to the primary for ``REPLICA_PIN_SECONDS``: their next reads see what
+they just wrote (a new booking shows up in their own list right away). The
+pin is keyed on the request's credentials, so it follows the client
+whichever worker serves them, as long as the cache is shared (Redis).
+Responses that hand out new credentials (registration, login) pin those
+with `pin_credentials`, since a new user may not have reached the replicas
+yet.
+
+Replicas are listed in ``settings.REPLICA_DATABASES``. Each one is checked at
+most every ``REPLICA_HEALTH_INTERVAL`` seconds; one that doesn't answer, or on
+PostgreSQL lags more than ``REPLICA_MAX_LAG`` seconds behind, is skipped
+until the next check, and with no healthy replica reads go to the primary.
+"""
+import hashlib
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+from .middleware import uncounted, view_setting
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD")
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+_routing = ContextVar("replica_routing", default=None)
+
+
+class Routing:
+    """where the reads of the current request go, filled in once its view is known"""
+    __slots__ = ("alias",)
+
+    def __init__(self):
+        self.alias = None
+
+
+@contextmanager
+def primary_reads():
+    """reads inside go to the primary whatever the current request picked"""
+    token = _routing.set(None)
+    try:
+        yield
+    finally:
+        _routing.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        return routing.alias if routing is not None else None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def replica_lag(alias):
+    """
+    Seconds the replica is behind the primary, None when the backend can't
+    tell. Raises DatabaseError if the replica doesn't answer.
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor != "postgresql":
+            cursor.execute("SELECT 1")
+            return None
+        cursor.execute("SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())")
+        lag = cursor.fetchone()[0]
+    return float(lag) if lag is not None else None
+
+
+def check_replica(alias):
+    try:
+        with uncounted():
+            lag = replica_lag(alias)
+    except DatabaseError as e:
+        logger.warning("replica %s is unavailable: %s", alias, e)
+        return False
+    max_lag = getattr(settings, "REPLICA_MAX_LAG", 30)
+    if lag is not None and lag > max_lag:
+        logger.warning("replica %s is %.1fs behind the primary", alias, lag)
+        return False
+    return True
+
+
+def is_healthy(alias, now=None):
+    now = now or time.monotonic()
+    with _health_lock:
+        healthy, checked_at = _health.get(alias, (None, None))
+    if checked_at is None or now - checked_at >= getattr(settings, "REPLICA_HEALTH_INTERVAL", 10):
+        healthy = check_replica(alias)
+        with _health_lock:
+            _health[alias] = (healthy, now)
+    return healthy
+
+
+def reset_health():
+    """forgets every health check, mostly useful in tests"""
+    with _health_lock:
+        _health.clear()
+
+
+def choose_replica():
+    healthy = [alias for alias in getattr(settings, "REPLICA_DATABASES", []) if is_healthy(alias)]
+    return random.choice(healthy) if healthy else None
+
+
+def pin_key(request):
+    credentials = request.headers.get("Authorization") or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return _credentials_key(credentials)
+
+
+def _credentials_key(credentials):
+    return "replica:pin:" + hashlib.sha256(credentials.encode()).hexdigest()[:32]
+
+
+def pin_credentials(credentials):
+    """pins the client presenting `credentials` (an Authorization header or a session key)"""
+    cache.set(_credentials_key(credentials), 1, getattr(settings, "REPLICA_PIN_SECONDS", 5))
+
+
+def pin_to_primary(request):
+    key = pin_key(request)
+    if key:
+        cache.set(key, 1, getattr(settings, "REPLICA_PIN_SECONDS", 5))
+
+
+def is_pinned(request):
+    key = pin_key(request)
+    return key is not None and cache.get(key) is not None
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.finish(request, response)
+
+    @staticmethod
+    def start(request):
+        request.replica_routing = Routing()
+        return _routing.set(request.replica_routing)
+
+    @staticmethod
+    def finish(request, response):
+        if request.method in WRITE_METHODS and response.status_code < 400:
+            pin_to_primary(request)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (getattr(settings, "REPLICA_DATABASES", None) and request.method in SAFE_METHODS
+                and view_setting(view_func, request.method, "replica_reads") and not is_pinned(request)):
+            request.replica_routing.alias = choose_replica()
+        return None
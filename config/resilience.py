@@ -0,0 +1,381 @@
+"""
+Failure isolation for calls to external providers (payment gateway, SMS).
+
+Every provider gets its own timeouts, a retry budget with jittered backoff, a
+circuit breaker that fails fast while the provider is down, a bulkhead
+that caps how many workers can be stuck waiting on it at once and an
+optional request rate limit. Providers are
+configured through ``settings.EXTERNAL_PROVIDERS`` and looked up by name:
+
+    sms = get_provider("notify_africa")
+    response = sms.request("POST", url, json=payload)
+
+Async views go through `acall`/`arequest` with an httpx client instead, which
+apply the same policies without blocking the event loop.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import httpx
+import requests
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderUnavailable(Exception):
+    """raised instead of calling a provider that is known to be unhealthy"""
+
+
+class CircuitOpen(ProviderUnavailable):
+    pass
+
+
+class BulkheadFull(ProviderUnavailable):
+    pass
+
+
+class RetryableResponse(Exception):
+    """a 5xx/429 response, treated like a transport error for retries"""
+
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} from {response.url}")
+        self.response = response
+
+
+# errors that mean the provider itself is unhealthy
+PROVIDER_FAILURES = (requests.ConnectionError, requests.Timeout, httpx.TransportError, RetryableResponse)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+    LEVELS = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        """whether calls are refused without a probe being due, checked before waiting for a slot"""
+        with self.lock:
+            return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self.probing:
+                # let exactly one trial call through
+                self.probing = True
+                return True
+            return False
+
+    def abandon(self):
+        """the admitted call ended without an outcome (cancelled), let the next one probe"""
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.probing = False
+                return True
+            return False
+
+
+class RetryBudget:
+    """
+    Limits retries to a fraction of normal traffic so that retries cannot
+    multiply load on a provider that is already struggling. Each call deposits
+    `ratio` tokens and each retry spends one.
+    """
+
+    def __init__(self, ratio=0.2, min_tokens=3, max_tokens=50):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = float(min_tokens)
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class RateLimiter:
+    """thread safe limiter that spaces calls out to at most `rate` per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """claims the next slot and returns how many seconds to wait for it"""
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        return max(wait, 0)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+class ResilientProvider:
+    def __init__(self, name, timeout=(3.05, 10), max_attempts=3, backoff_base=0.2, backoff_cap=2.0,
+                 retry_ratio=0.2, failure_threshold=5, reset_timeout=30, max_concurrent=10,
+                 acquire_timeout=0.1, rate_limit=None):
+        self.name = name
+        self.timeout = tuple(timeout) if isinstance(timeout, (list, tuple)) else timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.acquire_timeout = acquire_timeout
+        self.max_concurrent = max_concurrent
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.budget = RetryBudget(retry_ratio)
+        self.bulkhead = threading.BoundedSemaphore(max_concurrent)
+        self.limiter = RateLimiter(rate_limit)
+        self.in_flight = 0
+        self.counters = {"calls": 0, "successes": 0, "failures": 0, "retries": 0,
+                         "short_circuited": 0, "rejected": 0, "circuit_opened": 0}
+        self.lock = threading.Lock()
+
+    def _count(self, key, delta=1):
+        with self.lock:
+            self.counters[key] += delta
+        metrics.PROVIDER_EVENTS.labels(self.name, key).inc(delta)
+
+    def backoff(self, attempt):
+        """full jitter: uniform between 0 and the capped exponential delay"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def call(self, func, *args, retry_on=PROVIDER_FAILURES, **kwargs):
+        """
+        Runs `func(*args, **kwargs)` under this provider's policies.
+        Transport errors and 5xx responses count against the breaker, but only
+        those in `retry_on` are retried; pass a narrower tuple for calls that
+        are not safe to repeat. Anything else passes straight up.
+        """
+        self._count("calls")
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            self._fail_fast()
+            self.limiter.acquire()
+            self._admit(self.bulkhead.acquire(timeout=self.acquire_timeout))
+            try:
+                result = func(*args, **kwargs)
+            except PROVIDER_FAILURES as exc:
+                attempt += 1
+                if not self._failed(exc, attempt, retry_on):
+                    raise
+            except Exception:
+                # the provider answered, it just didn't like the request
+                self.breaker.record_success()
+                self._report_state()
+                raise
+            except BaseException:
+                # interrupted
+                self.breaker.abandon()
+                raise
+            else:
+                self._succeeded()
+                return result
+            finally:
+                self._leave()
+
+            time.sleep(self.backoff(attempt))
+
+    async def acall(self, func, *args, retry_on=PROVIDER_FAILURES, **kwargs):
+        """
+        `call` for coroutine functions. Waits on the rate limiter with
+        asyncio.sleep and never blocks on the bulkhead: when it is full the
+        call is rejected straight away.
+        """
+        self._count("calls")
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            self._fail_fast()
+            wait = self.limiter.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            self._admit(self.bulkhead.acquire(blocking=False))
+            try:
+                result = await func(*args, **kwargs)
+            except PROVIDER_FAILURES as exc:
+                attempt += 1
+                if not self._failed(exc, attempt, retry_on):
+                    raise
+            except Exception:
+                self.breaker.record_success()
+                self._report_state()
+                raise
+            except BaseException:
+                # cancelled
+                self.breaker.abandon()
+                raise
+            else:
+                self._succeeded()
+                return result
+            finally:
+                self._leave()
+
+            await asyncio.sleep(self.backoff(attempt))
+
+    def _short_circuit(self):
+        self._count("short_circuited")
+        raise CircuitOpen(f"{self.name} circuit is open")
+
+    def _fail_fast(self):
+        if self.breaker.is_open():
+            self._report_state()
+            self._short_circuit()
+
+    def _admit(self, acquired):
+        """
+        Takes the bulkhead slot, then asks the breaker. The half-open probe is
+        only let through once it holds a slot, so nothing between being
+        admitted and the call can leave the breaker waiting on a probe that
+        never ran.
+        """
+        self._enter(acquired)
+        allowed = self.breaker.allow()
+        self._report_state()
+        if not allowed:
+            self._leave()
+            self._short_circuit()
+
+    def _enter(self, acquired):
+        if not acquired:
+            self._count("rejected")
+            raise BulkheadFull(f"too many in-flight calls to {self.name}")
+        self._count_in_flight(1)
+
+    def _leave(self):
+        self._count_in_flight(-1)
+        self.bulkhead.release()
+
+    def _succeeded(self):
+        self.breaker.record_success()
+        self._report_state()
+        self._count("successes")
+
+    def _report_state(self):
+        metrics.PROVIDER_CIRCUIT.labels(self.name).set(self.breaker.LEVELS[self.breaker.state])
+
+    def _failed(self, exc, attempt, retry_on):
+        """records a provider failure and returns whether the call should be retried"""
+        if self.breaker.record_failure():
+            self._report_state()
+            self._count("circuit_opened")
+            logger.warning("circuit for %s opened after %r", self.name, exc)
+        self._count("failures")
+        if not isinstance(exc, retry_on) or attempt >= self.max_attempts or not self.budget.withdraw():
+            return False
+        self._count("retries")
+        return True
+
+    def _count_in_flight(self, delta):
+        with self.lock:
+            self.in_flight += delta
+        metrics.PROVIDER_IN_FLIGHT.labels(self.name).inc(delta)
+
+    def request(self, method, url, session=None, retry_on=PROVIDER_FAILURES, **kwargs):
+        """
+        `requests` call with this provider's timeout applied. 5xx and 429
+        responses count as failures; other responses are returned as-is.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        sender = session or requests
+
+        def send():
+            response = sender.request(method, url, **kwargs)
+            if response.status_code >= 500 or response.status_code == 429:
+                raise RetryableResponse(response)
+            return response
+
+        return self.call(send, retry_on=retry_on)
+
+    async def arequest(self, client, method, url, retry_on=PROVIDER_FAILURES, **kwargs):
+        """`request` for an `httpx.AsyncClient`"""
+        kwargs.setdefault("timeout", httpx.Timeout(self.timeout[1], connect=self.timeout[0])
+                          if isinstance(self.timeout, tuple) else self.timeout)
+
+        async def send():
+            response = await client.request(method, url, **kwargs)
+            if response.status_code >= 500 or response.status_code == 429:
+                raise RetryableResponse(response)
+            return response
+
+        return await self.acall(send, retry_on=retry_on)
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "provider": self.name,
+                "state": self.breaker.state,
+                "consecutive_failures": self.breaker.failures,
+                "in_flight": self.in_flight,
+                "max_concurrent": self.max_concurrent,
+                "retry_tokens": round(self.budget.tokens, 2),
+                **self.counters,
+            }
+
+
+_providers = {}
+_registry_lock = threading.Lock()
+
+
+def get_provider(name):
+    """returns the shared provider for `name`, configured from EXTERNAL_PROVIDERS"""
+    with _registry_lock:
+        if name not in _providers:
+            options = getattr(settings, "EXTERNAL_PROVIDERS", {}).get(name, {})
+            _providers[name] = ResilientProvider(name, **options)
+        return _providers[name]
+
+
+def reset_providers():
+    """drops all provider state, mostly useful in tests"""
+    with _registry_lock:
+        _providers.clear()
+
+
+def provider_metrics():
+    with _registry_lock:
+        providers = list(_providers.values())
+    return [provider.metrics() for provider in providers]
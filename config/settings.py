@@ -48,6 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.metrics.MetricsMiddleware',
+    'config.middleware.QueryInstrumentationMiddleware',
+    'config.replicas.ReplicaMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -91,11 +94,49 @@ if not DEBUG:
             'PORT': os.getenv('DATABASE_PORT'),
         }
     }
+    # read replicas of the primary, comma separated hosts (see config/replicas.py)
+    for i, host in enumerate(filter(None, os.getenv('DATABASE_REPLICA_HOSTS', '').split(',')), start=1):
+        DATABASES[f'replica_{i}'] = {**DATABASES['default'], 'HOST': host.strip()}
 else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+        },
+        # stand-in replica, only read from when listed in REPLICA_DATABASES (as the tests do)
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.replica.sqlite3',
+        },
+    }
+
+# covering indexes (Index.include) only exist on PostgreSQL, SQLite builds them without the extra columns
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
+DATABASE_ROUTERS = ['config.replicas.ReplicaRouter']
+# aliases the read-only endpoints may read from
+REPLICA_DATABASES = [alias for alias in DATABASES if alias.startswith('replica_')]
+# seconds a client reads from the primary after writing, so they see their own writes
+REPLICA_PIN_SECONDS = 5
+# seconds between health checks of a replica, and the lag beyond which it is skipped
+REPLICA_HEALTH_INTERVAL = 10
+REPLICA_MAX_LAG = 30
+
+# Cache
+# Redis when REDIS_URL is set (shared by all workers), per-process memory otherwise,
+# which the deployment checks refuse outside DEBUG (see config/checks.py)
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'egesha',
         }
     }
 
@@ -149,13 +190,20 @@ AUTH_USER_MODEL = 'users.Person'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.RoleJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly',
     ],
 }
 
+# Token buckets for the unauthenticated auth endpoints (users/throttles.py),
+# keyed by client IP and phone number. capacity is the allowed burst,
+# per_minute the steady refill rate.
+TOKEN_BUCKET_THROTTLES = {
+    'otp': {'capacity': 3, 'per_minute': 1},
+    'login': {'capacity': 10, 'per_minute': 5},
+}
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),
@@ -189,8 +237,8 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=5),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 
-    "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_OBTAIN_SERIALIZER": "users.serializers.RoleTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "users.serializers.RoleTokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
@@ -203,4 +251,88 @@ AZAMPAY_CONFIG = {
     "CLIENT_SECRET": os.getenv("AZAMPAY_CLIENT_SECRET"),
     "PROVIDER": "Azampesa",
     "ENVIRONMENT": True,
-}
\ No newline at end of file
+}
+# Per-provider timeouts, retries, circuit breaker and bulkhead limits,
+# see config/resilience.py. Timeouts are (connect, read) in seconds.
+EXTERNAL_PROVIDERS = {
+    "azampay": {
+        "timeout": (3.05, 15),
+        "max_attempts": 2,
+        "failure_threshold": 5,
+        "reset_timeout": 30,
+        "max_concurrent": 10,
+    },
+    "notify_africa": {
+        "timeout": (3.05, 5),
+        "max_attempts": 3,
+        "failure_threshold": 5,
+        "reset_timeout": 30,
+        "max_concurrent": 20,
+        "rate_limit": 10,  # requests per second
+    },
+}
+
+# write issued/used OTPs to the users.OTP table (in the background) for auditing
+OTP_AUDIT_TRAIL = os.getenv("OTP_AUDIT_TRAIL", "False").lower() == "true"
+
+SMS_API_URL = os.getenv("SMS_API_URL", "https://api.notify.africa/v2/send-sms")
+# recipients the gateway accepts in a single send-sms request
+SMS_MAX_RECIPIENTS = 100
+
+# retention (minutes past expiry), batch size and pause (seconds) for each
+# target of the purge_expired command, see parking/purge.py
+PURGE_POLICIES = {
+    "otps": {"retention": 60 * 24, "batch_size": 1000, "pause": 0.1},
+    "sessions": {"retention": 0, "batch_size": 1000, "pause": 0.1},
+    "pending_bookings": {"retention": 60 * 24, "batch_size": 500, "pause": 0.2},
+    # also how old a delta sync token may get, see parking/sync.py
+    "tombstones": {"retention": 60 * 24 * 30, "batch_size": 1000, "pause": 0.1},
+    # longer than any notification sweep window, so a dedupe_key can't be queued twice
+    "sms_jobs": {"retention": 60 * 24, "batch_size": 1000, "pause": 0.1},
+}
+
+# seconds a cached lot payload is served before it is recomputed (see
+# parking/lot_cache.py), how long a stale one may still be served while that
+# happens, and how long readers wait for another worker to fill the cache
+LOT_CACHE_TTL = 300
+LOT_CACHE_GRACE = 60
+LOT_CACHE_WAIT = 1.0
+
+# bearer token of the occupancy sensor gateways (parking/sensors.py); ingestion
+# is refused while it is unset. Readings are written every SENSOR_FLUSH_INTERVAL
+# seconds (0 writes them in the request), or as soon as more than
+# SENSOR_MAX_PENDING spots are waiting
+SENSOR_TOKEN = os.getenv('SENSOR_TOKEN', '')
+SENSOR_FLUSH_INTERVAL = 1.0
+SENSOR_MAX_PENDING = 10000
+
+# where lot changes are published for the live availability streams (see
+# parking/live.py): Redis pub/sub reaches every process, the local broker only
+# the one the change was made in. Streams send a keepalive comment every
+# LIVE_HEARTBEAT seconds and start over from a snapshot when more than
+# LIVE_QUEUE_SIZE events are waiting for a slow client
+if os.getenv('REDIS_URL'):
+    LIVE_BROKER = {'BACKEND': 'parking.live.RedisBroker', 'LOCATION': os.getenv('REDIS_URL')}
+else:
+    LIVE_BROKER = {'BACKEND': 'parking.live.LocalBroker'}
+LIVE_HEARTBEAT = 15
+LIVE_QUEUE_SIZE = 100
+LIVE_MAX_LOTS = 20
+
+# changes per page of the delta sync (parking/sync.py), and how old a change
+# must be before it is served: longer than a write transaction may take to
+# commit after saving, plus the clock skew between app servers
+SYNC_PAGE_SIZE = 500
+SYNC_SETTLE = 5
+
+# finished bookings older than `age` days are moved to the archive tables by
+# the archive_bookings command, see parking/archive.py
+ARCHIVE_POLICY = {"age": 90, "batch_size": 1000, "pause": 0.1}
+
+# per-view query budgets (config/middleware.py) are only logged when exceeded,
+# the test runner turns this on so that tests fail instead
+QUERY_BUDGET_STRICT = False
+TEST_RUNNER = 'config.test_runner.TestRunner'
+
+# when set, /metrics only answers requests carrying "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
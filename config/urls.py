@@ -1,11 +1,13 @@
 from django.contrib import admin
 from django.urls import path,include
 from rest_framework_simplejwt.views import TokenObtainPairView,TokenRefreshView
+from .metrics import metrics_view
 
 urlpatterns = [
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('admin/', admin.site.urls),
     path('api/auth/', include('users.urls')),
-    path('api/parking/', include('parking.urls'),)
+    path('api/parking/', include('parking.urls'),),
+    path('metrics', metrics_view, name='metrics'),
 ]
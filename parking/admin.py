@@ -6,4 +6,9 @@ admin.site.register(Vehicle)
 admin.site.register(ParkingLot)
 admin.site.register(ParkingSpot)
 admin.site.register(Booking)
-admin.site.register(Payment)
\ No newline at end of file
+admin.site.register(Payment)
+admin.site.register(ArchivedBooking)
+admin.site.register(ArchivedPayment)
+admin.site.register(HourlyLotStats)
+admin.site.register(DailyLotStats)
+admin.site.register(Tombstone)
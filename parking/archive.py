@@ -0,0 +1,178 @@
+"""
+Cold storage for finished bookings.
+
+Completed and cancelled bookings that ended more than ``age`` days ago are
+moved, with their payments, from the live Booking and Payment tables into
+ArchivedBooking and ArchivedPayment, keeping their ids. Like purge.py this
+works in batches: the ids of the oldest finished bookings are read, then
+copied and deleted in one short transaction, with a pause between batches.
+The live rows are deleted with plain DELETEs, without the ORM's signals
+and cascades: nothing references a booking, and a payment is only
+referenced by its booking, which goes first. Archiving therefore changes
+nothing but the two pairs of tables; the rollups are left as they are.
+
+Overlap checks, quick-book and the other hot queries only ever look at the
+live table, which stays small. A user's booking history (`user_history`)
+spans both tables.
+
+Batch size, pause and age come from ``settings.ARCHIVE_POLICY``.
+
+On PostgreSQL the archive table can also be range partitioned by month of
+``start_time`` (`partition_archive`, or ``archive_bookings --partition``), so
+old months can be detached or dropped as a whole. Partitions are created as
+rows for a new month are archived.
+"""
+import logging
+import time
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, router, transaction
+from django.utils import timezone
+
+from .models import ArchivedBooking, ArchivedPayment, Booking, Payment
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY = {"age": 90, "batch_size": 1000, "pause": 0.1}
+FINISHED = ("completed", "cancelled")
+
+BOOKING_FIELDS = [field.attname for field in ArchivedBooking._meta.concrete_fields if field.name != "archived_at"]
+PAYMENT_FIELDS = [field.attname for field in ArchivedPayment._meta.concrete_fields if field.name != "archived_at"]
+
+
+class PartitioningUnsupported(Exception):
+    """the database can't range partition the archive"""
+
+
+def get_policy():
+    policy = dict(DEFAULT_POLICY)
+    policy.update(getattr(settings, "ARCHIVE_POLICY", {}))
+    return policy
+
+
+def archivable(cutoff):
+    # bookings still waiting on their payment stay where reconciliation can find them
+    return (Booking.objects.filter(status__in=FINISHED, end_time__lt=cutoff)
+            .exclude(payment__status="pending"))
+
+
+def archive_batch(ids):
+    """moves the bookings with `ids` and their payments, returns how many bookings moved"""
+    with transaction.atomic():
+        bookings = list(Booking.objects.filter(id__in=ids).values(*BOOKING_FIELDS))
+        payment_ids = [row["payment_id"] for row in bookings if row["payment_id"]]
+        payments = list(Payment.objects.filter(id__in=payment_ids).values(*PAYMENT_FIELDS))
+        if is_partitioned():
+            ensure_partitions(row["start_time"] for row in bookings)
+
+        ArchivedPayment.objects.bulk_create([ArchivedPayment(**row) for row in payments])
+        ArchivedBooking.objects.bulk_create([ArchivedBooking(**row) for row in bookings])
+        Booking.objects.filter(id__in=ids)._raw_delete(router.db_for_write(Booking))
+        Payment.objects.filter(id__in=payment_ids)._raw_delete(router.db_for_write(Payment))
+    return len(bookings)
+
+
+def archive_bookings(age=None, batch_size=None, pause=None, limit=None, now=None):
+    """
+    Archives finished bookings that ended more than `age` days ago, at most
+    `limit` of them. Returns (bookings archived, seconds taken).
+    """
+    policy = get_policy()
+    age = policy["age"] if age is None else age
+    batch_size = batch_size or policy["batch_size"]
+    pause = policy["pause"] if pause is None else pause
+    queryset = archivable((now or timezone.now()) - timedelta(days=age))
+
+    started = time.monotonic()
+    archived = 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        ids = list(queryset.order_by("end_time").values_list("id", flat=True)[:size])
+        if not ids:
+            break
+        archived += archive_batch(ids)
+        if len(ids) < size:
+            break
+        time.sleep(pause)
+
+    elapsed = time.monotonic() - started
+    if archived:
+        logger.info("archived %s bookings in %.1fs", archived, elapsed)
+    return archived, elapsed
+
+
+def user_history(user):
+    """
+    (live, archived) querysets of the user's bookings, with everything
+    BookingSerializer reads loaded up front. See `newest_first`.
+    """
+    related = ("vehicle", "parking_spot__lot__operator")
+    prefetch = ("parking_spot__lot__spots",)
+    return (
+        Booking.objects.filter(user_id=user.pk).select_related(*related).prefetch_related(*prefetch),
+        ArchivedBooking.objects.filter(user_id=user.pk).select_related(*related).prefetch_related(*prefetch),
+    )
+
+
+def newest_first(bookings):
+    return sorted(bookings, key=lambda booking: booking.booking_time, reverse=True)
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+                       [ArchivedBooking._meta.db_table])
+        return cursor.fetchone() is not None
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(moment):
+    return month_start(month_start(moment) + timedelta(days=32))
+
+
+def ensure_partitions(start_times):
+    """creates the monthly partitions that rows starting at `start_times` go into"""
+    table = ArchivedBooking._meta.db_table
+    months = {month_start(moment.astimezone(dt_timezone.utc)) for moment in start_times}
+    with connection.cursor() as cursor:
+        for month in sorted(months):
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {table}_{month:%Y_%m} PARTITION OF {table} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [month, next_month(month)],
+            )
+
+
+def partition_archive():
+    """
+    Turns the archive table into one range partitioned by month of
+    start_time (PostgreSQL only). The primary key becomes (id, start_time),
+    as PostgreSQL requires of partitioned tables; ids still come from the
+    live table, so they stay unique. The archive's foreign keys are no
+    longer enforced by the database afterwards.
+    """
+    if connection.vendor != "postgresql":
+        raise PartitioningUnsupported("range partitioning needs PostgreSQL")
+    if is_partitioned():
+        return False
+
+    table = ArchivedBooking._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned")
+        cursor.execute(
+            f"CREATE TABLE {table} (LIKE {table}_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (start_time)"
+        )
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_partitioned_pkey PRIMARY KEY (id, start_time)")
+        cursor.execute(f"CREATE INDEX {table}_user_booking_time ON {table} (user_id, booking_time)")
+        cursor.execute(f"CREATE INDEX {table}_payment ON {table} (payment_id)")
+        cursor.execute(f"SELECT DISTINCT date_trunc('month', start_time) FROM {table}_unpartitioned")
+        ensure_partitions(month for (month,) in cursor.fetchall())
+        cursor.execute(f"INSERT INTO {table} SELECT * FROM {table}_unpartitioned")
+        cursor.execute(f"DROP TABLE {table}_unpartitioned")
+    return True
@@ -0,0 +1,208 @@
+"""
+Async versions of the read-heavy parking endpoints.
+
+Under ASGI these run on the event loop and use the async ORM, so a worker
+is not tied up while one request waits on the database and can serve many
+requests at once. They return the same payloads as the DRF viewsets in
+views.py, which still handle every other method (create, update, ...) on
+the same URLs and which WSGI deployments keep using unchanged.
+
+DRF views are synchronous, so authentication is done here directly with the
+project's JWT authentication, in a worker thread because it may need to load
+the user.
+"""
+import json
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.utils.encoders import JSONEncoder
+
+from config.metrics import PAYMENT_INITIATIONS
+from config.middleware import query_budget
+from config.resilience import ProviderUnavailable
+from users.authentication import RoleJWTAuthentication
+from . import lot_cache, sync
+from .archive import newest_first, user_history
+from .models import Booking
+from .serializers import BookingSerializer, ParkingLotSerializer, PaymentSerializer
+from .utils import PaymentService, payment_retry_after
+from .views import (
+    BookingViewSet, ParkingLotViewSet, PaymentViewSet, SearchError, record_payment, search_lots, within_radius,
+)
+
+READ_METHODS = ("GET", "HEAD")
+
+# shared by every payment initiated from this process so connections are reused
+_http_client = None
+
+
+def http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient()
+    return _http_client
+
+
+def respond(data, status=status.HTTP_200_OK, headers=None):
+    return JsonResponse(data, status=status, headers=headers, safe=False, encoder=JSONEncoder)
+
+
+def with_sync_fallback(sync_view, methods=READ_METHODS):
+    """
+    Serves `methods` with the decorated async view and hands every other
+    request to the synchronous DRF view for the same URL.
+    """
+    def decorator(async_view):
+        @csrf_exempt
+        async def view(request, *args, **kwargs):
+            if request.method in methods:
+                return await async_view(request, *args, **kwargs)
+            return await sync_to_async(sync_view)(request, *args, **kwargs)
+        view.__name__ = async_view.__name__
+        view.__doc__ = async_view.__doc__
+        # lets the query instrumentation find the budget of whichever view answers
+        view.query_budget = getattr(async_view, "query_budget", None)
+        view.sync_view = sync_view
+        view.async_methods = methods
+        return view
+    return decorator
+
+
+async def authenticate(request):
+    """returns (user, None), or (None, error response) if the request isn't authenticated"""
+    auth = RoleJWTAuthentication()
+    try:
+        result = await sync_to_async(auth.authenticate)(request)
+    except exceptions.AuthenticationFailed as e:
+        return None, respond({"detail": e.detail}, status=e.status_code,
+                             headers={"WWW-Authenticate": auth.authenticate_header(request)})
+    if result is None:
+        return None, respond({"detail": "Authentication credentials were not provided."},
+                             status=status.HTTP_401_UNAUTHORIZED,
+                             headers={"WWW-Authenticate": auth.authenticate_header(request)})
+    return result[0], None
+
+
+@with_sync_fallback(ParkingLotViewSet.as_view({"get": "list", "post": "create"}))
+@query_budget(2)
+async def lot_list(request):
+    lots = [lot async for lot in ParkingLotViewSet.queryset.all()]
+    return respond(ParkingLotSerializer(lots, many=True).data)
+
+
+@with_sync_fallback(ParkingLotViewSet.as_view({
+    "get": "retrieve", "put": "update", "patch": "partial_update", "delete": "destroy",
+}))
+@query_budget(2)
+async def lot_detail(request, pk):
+    try:
+        return respond(await sync_to_async(lot_cache.lot_detail)(pk))
+    except Http404:
+        return respond({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+
+@with_sync_fallback(ParkingLotViewSet.as_view({"get": "search"}))
+@query_budget(2)
+async def lot_search(request):
+    """async ParkingLotViewSet.search"""
+    try:
+        queryset, (lat, lon, radius) = search_lots(ParkingLotViewSet.queryset.all(), request.GET)
+    except SearchError as e:
+        return respond({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    lots = [lot async for lot in queryset]
+    return respond(ParkingLotSerializer(within_radius(lots, lat, lon, radius), many=True).data)
+
+
+@with_sync_fallback(ParkingLotViewSet.as_view({"get": "changes"}))
+@query_budget(3)
+async def lot_changes(request):
+    """async ParkingLotViewSet.changes"""
+    try:
+        return respond(await sync_to_async(sync.changes)(*sync.parse_params(request.GET)))
+    except sync.TokenExpired as e:
+        return respond({"error": str(e)}, status=status.HTTP_410_GONE)
+    except sync.SyncError as e:
+        return respond({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@with_sync_fallback(ParkingLotViewSet.as_view({"get": "available_spots"}))
+@query_budget(2)
+async def available_spots(request, pk):
+    """async ParkingLotViewSet.available_spots"""
+    try:
+        return respond(await sync_to_async(lot_cache.free_spots)(pk, request.GET.get("spot_type")))
+    except Http404:
+        return respond({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+
+@with_sync_fallback(BookingViewSet.as_view({"get": "list", "post": "create"}))
+@query_budget(5)
+async def booking_list(request):
+    user, error = await authenticate(request)
+    if error:
+        return error
+    bookings = newest_first([booking for queryset in user_history(user) async for booking in queryset])
+    return respond(BookingSerializer(bookings, many=True).data)
+
+
+@with_sync_fallback(PaymentViewSet.as_view({"get": "list", "post": "create"}), methods=("POST",))
+@query_budget(16)
+async def payment_create(request):
+    """
+    async PaymentViewSet.create. The checkout request goes out on a shared
+    httpx client, so a slow gateway does not hold a worker thread.
+    """
+    user, error = await authenticate(request)
+    if error:
+        return error
+
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return respond({"detail": "JSON parse error."}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        data = request.POST
+
+    serializer = PaymentSerializer(data=data)
+    if not serializer.is_valid():
+        return respond(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    phone_number = serializer.validated_data['phone_number']
+
+    try:
+        booking = await Booking.objects.aget(id=serializer.validated_data['booking_id'])
+    except Booking.DoesNotExist:
+        return respond({"error": "Booking not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    # Check if the booking is already paid for
+    if booking.status not in ['pending', 'confirmed']:
+        return respond({"error": "This booking cannot be paid for at its current status."},
+                       status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        # the Azampay client fetches its access token synchronously
+        payment_service = await sync_to_async(PaymentService)()
+        payment_response = await payment_service.ainitiate_payment(
+            phone_number=phone_number,
+            amount=booking.cost,
+            booking=booking.id,
+            client=http_client(),
+        )
+    except ProviderUnavailable:
+        PAYMENT_INITIATIONS.labels("unavailable").inc()
+        return respond({"error": "Payment provider is unavailable, please try again shortly."},
+                       status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": payment_retry_after()})
+
+    if not payment_response['success']:
+        PAYMENT_INITIATIONS.labels("failed").inc()
+        return respond({"error": payment_response.get('message', "Payment initiation failed.")},
+                       status=status.HTTP_400_BAD_REQUEST)
+
+    PAYMENT_INITIATIONS.labels("success").inc()
+    payment = await sync_to_async(transaction.atomic(record_payment))(booking, phone_number, payment_response)
+    return respond(PaymentSerializer(payment).data, status=status.HTTP_201_CREATED)
@@ -0,0 +1,223 @@
+"""
+Benchmarks for the booking API.
+
+Each scenario is a list of real requests against the URL routes (lot search,
+quick-book, payment creation) built from whatever is in the database,
+normally data generated by seeding.py. Scenarios run either in-process
+through the Django test client, which also counts the queries of every
+request, or over HTTP against a running server.
+
+Results are summarised as p50/p95/p99 latency, throughput and queries per
+request, and can be compared against a stored baseline: more queries per
+request, or a p95 beyond the tolerance, is reported as a regression.
+"""
+import asyncio
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+from unittest import mock
+
+import httpx
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from users.models import Motorist
+from users.tokens import RoleRefreshToken
+from .models import Booking, ParkingSpot
+from .seeding import CENTER, SPREAD
+
+SCENARIOS = ("search", "quick_book", "payment")
+
+
+class StubPaymentService:
+    """in-process stand-in for the payment gateway, answering after `latency` seconds"""
+    latency = 0.05
+
+    def initiate_payment(self, phone_number, amount, booking):
+        time.sleep(self.latency)
+        return self._checkout(booking)
+
+    async def ainitiate_payment(self, phone_number, amount, booking, client):
+        await asyncio.sleep(self.latency)
+        return self._checkout(booking)
+
+    @staticmethod
+    def _checkout(booking):
+        return {"success": True, "transaction_id": f"BENCH-{booking}", "external_id": str(booking)}
+
+
+class Scenario:
+    def __init__(self, name, requests, expected_status=200):
+        self.name = name
+        self.requests = requests  # (method, path, json body or None)
+        self.expected_status = expected_status
+
+
+def benchmark_motorist():
+    motorist = Motorist.objects.order_by("id").first()
+    if motorist is None:
+        raise ValueError("no motorists to benchmark with, seed the database first")
+    return motorist
+
+
+def auth_header(user):
+    return {"Authorization": f"Bearer {RoleRefreshToken.for_user(user).access_token}"}
+
+
+def search_scenario(count, radius=2, seed=1):
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        lat = CENTER[0] + rng.uniform(-SPREAD, SPREAD)
+        lon = CENTER[1] + rng.uniform(-SPREAD, SPREAD)
+        requests.append(("GET", f"/api/parking/lots/search/?lat={lat:.6f}&lon={lon:.6f}&radius={radius}", None))
+    return Scenario("search", requests)
+
+
+def free_spots(count, offset=0):
+    spots = (ParkingSpot.objects.filter(is_available=True, lot__is_active=True)
+             .order_by("id").values_list("id", "lot_id")[offset:offset + count])
+    spots = list(spots)
+    if len(spots) < count:
+        raise ValueError(f"only {len(spots)} free spots left, seed more spots or send fewer requests")
+    return spots
+
+
+def quick_book_scenario(count, motorist):
+    # each request books a different free spot, so none of them conflict
+    start = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+    plate = motorist.vehicles.values_list("license_plate", flat=True).first() or "T00000"
+    requests = [
+        ("POST", "/api/parking/bookings/quick-book/", {
+            "license_plate": plate, "phone_number": motorist.phone_number,
+            "parking_lot": lot_id, "parking_spot": spot_id,
+            "start_time": start.isoformat(), "end_time": (start + timedelta(hours=2)).isoformat(),
+        })
+        for spot_id, lot_id in free_spots(count)
+    ]
+    return Scenario("quick_book", requests, expected_status=201)
+
+
+def payment_scenario(count, motorist):
+    """creates `count` confirmed bookings to pay for"""
+    vehicle = motorist.vehicles.first()
+    start = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=3)
+    bookings = Booking.objects.bulk_create([
+        Booking(user=motorist, parking_spot_id=spot_id, vehicle=vehicle, start_time=start,
+                end_time=start + timedelta(hours=2), cost=2000, status="confirmed")
+        for spot_id, _ in free_spots(count)
+    ])
+    requests = [
+        ("POST", "/api/parking/payments/", {"booking_id": booking.id, "phone_number": motorist.phone_number})
+        for booking in bookings
+    ]
+    return Scenario("payment", requests, expected_status=201)
+
+
+def build_scenarios(names, count, radius=2):
+    motorist = benchmark_motorist()
+    builders = {
+        "search": lambda: search_scenario(count, radius),
+        "quick_book": lambda: quick_book_scenario(count, motorist),
+        "payment": lambda: payment_scenario(count, motorist),
+    }
+    return [builders[name]() for name in names], auth_header(motorist)
+
+
+def summarize(timings, elapsed, errors=0, queries=None):
+    """latency percentiles in milliseconds, requests per second and mean queries per request"""
+    if not timings:
+        return {"requests": 0, "errors": errors}
+    quantiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "p50_ms": round(quantiles[49], 2),
+        "p95_ms": round(quantiles[94], 2),
+        "p99_ms": round(quantiles[98], 2),
+        "throughput_rps": round(len(timings) / elapsed, 1) if elapsed else None,
+        "queries_per_request": round(statistics.fmean(queries), 2) if queries else None,
+    }
+
+
+def run_in_process(scenario, headers):
+    """runs the scenario through the test client, timing and counting the queries of every request"""
+    # outside the test runner "testserver" isn't an allowed host
+    client = Client(headers=headers, SERVER_NAME="localhost")
+    timings, queries, errors = [], [], 0
+    with mock.patch("parking.views.PaymentService", StubPaymentService), \
+            mock.patch("parking.async_views.PaymentService", StubPaymentService):
+        started = time.perf_counter()
+        for method, path, body in scenario.requests:
+            # the query log keeps the last 9000 queries, a full one would count none
+            reset_queries()
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                if method == "GET":
+                    response = client.get(path)
+                else:
+                    response = client.generic(method, path, json.dumps(body), content_type="application/json")
+                elapsed = (time.perf_counter() - request_started) * 1000
+            if response.status_code != scenario.expected_status:
+                errors += 1
+                continue
+            timings.append(elapsed)
+            queries.append(len(captured))
+        total = time.perf_counter() - started
+    return summarize(timings, total, errors, queries)
+
+
+async def send_all(base_url, requests, concurrency=1, headers=None, timeout=30, expected_status=None):
+    """sends `requests` over HTTP with `concurrency` in flight, returns (timings, errors, seconds)"""
+    limits = httpx.Limits(max_connections=concurrency)
+    pending = iter(requests)
+    timings = []
+    errors = 0
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=timeout) as client:
+        async def worker():
+            nonlocal errors
+            for method, path, body in pending:
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body)
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                ok = (response.status_code == expected_status if expected_status
+                      else response.status_code < 400)
+                if ok:
+                    timings.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return timings, errors, time.perf_counter() - started
+
+
+def run_over_http(scenario, headers, base_url, concurrency=1):
+    timings, errors, elapsed = asyncio.run(send_all(
+        base_url, scenario.requests, concurrency, headers, expected_status=scenario.expected_status,
+    ))
+    return summarize(timings, elapsed, errors)
+
+
+def compare(results, baseline, tolerance=0.25):
+    """returns a message for every scenario that regressed against `baseline`"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or not current.get("requests"):
+            continue
+        if (current.get("queries_per_request") is not None and previous.get("queries_per_request") is not None
+                and current["queries_per_request"] > previous["queries_per_request"]):
+            regressions.append(f"{name}: {current['queries_per_request']} queries per request, "
+                               f"baseline {previous['queries_per_request']}")
+        if previous.get("p95_ms") and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']}ms, baseline {previous['p95_ms']}ms")
+    return regressions
@@ -0,0 +1,172 @@
+"""
+Streaming exports of an operator's bookings and payments, as CSV or NDJSON,
+optionally gzipped.
+
+Rows are read with ``values_list().iterator()`` in chunks of ``CHUNK_SIZE``
+(from a worker thread when served over ASGI, where Django would otherwise
+read a synchronous iterator to the end before sending anything) and each
+chunk is encoded and sent before the next one is read, so memory stays the same
+whatever the size of the export. Live and archived rows are both exported.
+
+Compression is done on the fly with zlib, flushed after every chunk so the
+client keeps receiving data.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+from .models import ArchivedBooking, ArchivedPayment, Booking, Payment
+from .rollups import day_bounds
+
+CHUNK_SIZE = 2000
+
+BOOKING_COLUMNS = {
+    "id": "id",
+    "lot_id": "parking_spot__lot_id",
+    "lot": "parking_spot__lot__name",
+    "spot": "parking_spot__spot_number",
+    "vehicle": "vehicle__license_plate",
+    "booking_time": "booking_time",
+    "start_time": "start_time",
+    "end_time": "end_time",
+    "status": "status",
+    "cost": "cost",
+    "payment_id": "payment_id",
+    "payment_status": "payment__status",
+}
+
+PAYMENT_COLUMNS = {
+    "id": "id",
+    "booking_id": "booking__id",
+    "lot_id": "booking__parking_spot__lot_id",
+    "amount": "amount",
+    "status": "status",
+    "transaction_id": "transaction_id",
+    "external_id": "external_id",
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+}
+
+
+class ExportError(ValueError):
+    """invalid export parameters, reported to the client as a 400"""
+
+
+class CSVRenderer(BaseRenderer):
+    """lets ``?format=csv`` or ``Accept: text/csv`` select the CSV export; the rows are streamed, not rendered"""
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+
+def parse_filters(params):
+    """(lot ids or None, start, end) of an export request; start and end are inclusive days"""
+    lots = params.getlist("lot")
+    if not all(lot.isdigit() for lot in lots):
+        raise ExportError("lot must be a lot id.")
+    try:
+        start = date.fromisoformat(params["start"]) if params.get("start") else None
+        end = date.fromisoformat(params["end"]) if params.get("end") else None
+    except ValueError:
+        raise ExportError("Invalid start or end, use YYYY-MM-DD.")
+    if start and end and start > end:
+        raise ExportError("start must not be after end.")
+    return [int(lot) for lot in lots] or None, start, end
+
+
+def _filtered(queryset, lot_field, time_field, lot_ids, start, end):
+    queryset = queryset.filter(**{f"{lot_field}__in": lot_ids})
+    if start:
+        queryset = queryset.filter(**{f"{time_field}__gte": day_bounds(start)[0]})
+    if end:
+        queryset = queryset.filter(**{f"{time_field}__lt": day_bounds(end)[1]})
+    return queryset
+
+
+def bookings(lot_ids, start=None, end=None):
+    """querysets of the rows of the bookings of `lot_ids` starting between `start` and `end`"""
+    return [
+        _filtered(model.objects, "parking_spot__lot_id", "start_time", lot_ids, start, end)
+        .order_by("pk").values_list(*BOOKING_COLUMNS.values())
+        for model in (Booking, ArchivedBooking)
+    ]
+
+
+def payments(lot_ids, start=None, end=None):
+    """querysets of the rows of the payments for bookings of `lot_ids` made between `start` and `end`"""
+    return [
+        _filtered(model.objects, "booking__parking_spot__lot_id", "created_at", lot_ids, start, end)
+        .order_by("created_at", "pk").values_list(*PAYMENT_COLUMNS.values())
+        for model in (Payment, ArchivedPayment)
+    ]
+
+
+def csv_cell(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class Encoder:
+    """turns chunks of rows into the bytes of the export"""
+
+    def __init__(self, kind, columns, compress=False):
+        self.kind = kind
+        self.columns = list(columns)
+        self.gzip = zlib.compressobj(wbits=31) if compress else None
+
+    def _out(self, text):
+        data = text.encode()
+        if self.gzip is None:
+            return data
+        return self.gzip.compress(data) + self.gzip.flush(zlib.Z_SYNC_FLUSH)
+
+    def start(self):
+        return self._out(self.lines([self.columns]) if self.kind == "csv" else "")
+
+    def lines(self, rows):
+        if self.kind == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows([csv_cell(value) for value in row] for row in rows)
+            return buffer.getvalue()
+        return "".join(json.dumps(dict(zip(self.columns, row)), cls=DjangoJSONEncoder) + "\n" for row in rows)
+
+    def encode(self, rows):
+        return self._out(self.lines(rows))
+
+    def finish(self):
+        return self.gzip.flush() if self.gzip is not None else b""
+
+
+def take(rows, count):
+    return list(islice(rows, count))
+
+
+def stream(querysets, encoder, chunk_size=CHUNK_SIZE):
+    yield encoder.start()
+    for queryset in querysets:
+        rows = queryset.iterator(chunk_size=chunk_size)
+        while chunk := take(rows, chunk_size):
+            yield encoder.encode(chunk)
+    yield encoder.finish()
+
+
+async def astream(querysets, encoder, chunk_size=CHUNK_SIZE):
+    yield encoder.start()
+    for queryset in querysets:
+        # what aiterator() does, which for values_list() would run the query on the event loop
+        rows = await sync_to_async(queryset.iterator)(chunk_size=chunk_size)
+        while chunk := await sync_to_async(take)(rows, chunk_size):
+            yield encoder.encode(chunk)
+    yield encoder.finish()
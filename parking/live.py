@@ -0,0 +1,299 @@
+"""
+Live lot availability, pushed to clients as Server-Sent Events.
+
+Clients open ``/api/parking/lots/live/?lot=<id>&lot=<id>`` (ASGI only) and
+get a ``snapshot`` event with the free spots of each lot, then an
+``availability`` event whenever a lot's free spots change: the spots that
+became free or changed, and the ids of those that were taken.
+
+Whatever changes a lot's spots (saving a spot or lot, which is how bookings
+take spots, sensor flushes, bulk provisioning) calls `notify`, which
+publishes the lot ids to the broker once the transaction commits. Each ASGI
+process runs one `Hub`, a single task that listens to the broker and, for
+every lot watched in that process, reads its free spots once (through
+lot_cache.py, so mostly from the cache) and queues the difference with the
+previous read to every subscriber of the lot. A change costs the same
+whether a lot has one watcher or thousands.
+
+A subscription starts from a snapshot read only once the hub's listener is
+subscribed to the broker (each broker's `listen` sets the `subscribed`
+event it is given), so no change can fall between the snapshot and the
+first delta. If the broker can't be reached within LISTEN_TIMEOUT seconds
+the stream fails and the client retries.
+
+The broker is chosen by ``settings.LIVE_BROKER``. `LocalBroker` only
+reaches the process the change was made in; `RedisBroker` carries the
+notifications between processes over Redis pub/sub.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from contextlib import aclosing
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
+from rest_framework.utils.encoders import JSONEncoder
+
+from config.middleware import query_budget
+from . import lot_cache
+
+logger = logging.getLogger(__name__)
+
+RETRY_MS = 3000
+RECONNECT_DELAY = 1
+LISTEN_TIMEOUT = 5
+
+
+class LocalBroker:
+    """delivers notifications to the listeners of this process"""
+
+    def __init__(self, **options):
+        self.lock = threading.Lock()
+        self.listeners = set()
+
+    def publish(self, lot_ids):
+        with self.lock:
+            listeners = list(self.listeners)
+        for loop, queue in listeners:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, list(lot_ids))
+            except RuntimeError:
+                # the loop is closed
+                with self.lock:
+                    self.listeners.discard((loop, queue))
+
+    async def listen(self, subscribed):
+        listener = (asyncio.get_running_loop(), asyncio.Queue())
+        with self.lock:
+            self.listeners.add(listener)
+        subscribed.set()
+        try:
+            while True:
+                yield await listener[1].get()
+        finally:
+            with self.lock:
+                self.listeners.discard(listener)
+
+
+class RedisBroker:
+    """delivers notifications to the listeners of every process through a Redis channel"""
+    channel = "parking:live"
+
+    def __init__(self, LOCATION, **options):
+        self.url = LOCATION
+        self._client = None
+
+    def publish(self, lot_ids):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(self.channel, json.dumps(sorted(lot_ids)))
+
+    async def listen(self, subscribed):
+        import redis.asyncio
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.subscribe(self.channel)
+            async for message in pubsub.listen():
+                if message["type"] == "subscribe":
+                    # Redis confirmed it, messages published from now on reach this listener
+                    subscribed.set()
+                elif message["type"] == "message":
+                    yield json.loads(message["data"])
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+_broker = None
+
+
+def broker():
+    global _broker
+    if _broker is None:
+        options = dict(getattr(settings, "LIVE_BROKER", {}))
+        backend = options.pop("BACKEND", "parking.live.LocalBroker")
+        _broker = import_string(backend)(**options)
+    return _broker
+
+
+def publish(lot_ids):
+    try:
+        broker().publish(lot_ids)
+    except Exception:
+        # subscribers miss this change, the write itself went through
+        logger.exception("failed to publish the availability of lots %s", sorted(lot_ids))
+
+
+def notify(lot_ids):
+    """tells the subscribers of `lot_ids` to refresh once the current transaction commits"""
+    lot_ids = set(lot_ids)
+    if lot_ids:
+        transaction.on_commit(lambda: publish(lot_ids))
+
+
+def read_spots(lot_id):
+    """{spot id: spot} of the free spots of the lot, None if it isn't an active lot"""
+    try:
+        return {spot["id"]: spot for spot in lot_cache.free_spots(lot_id)}
+    except Http404:
+        return None
+
+
+def snapshot_event(lot_id, spots):
+    if spots is None:
+        return "unavailable", {"lot": lot_id}
+    return "snapshot", {"lot": lot_id, "available_spots_count": len(spots), "spots": list(spots.values())}
+
+
+def availability_event(lot_id, previous, spots):
+    """the event taking a subscriber from `previous` to `spots`, None if nothing changed"""
+    if previous is None or spots is None:
+        return snapshot_event(lot_id, spots) if previous is not spots else None
+    changed = [spot for spot_id, spot in spots.items() if previous.get(spot_id) != spot]
+    taken = [spot_id for spot_id in previous if spot_id not in spots]
+    if not changed and not taken:
+        return None
+    return "availability", {"lot": lot_id, "available_spots_count": len(spots), "changed": changed, "taken": taken}
+
+
+class Subscription:
+    def __init__(self, lot_ids):
+        self.lot_ids = lot_ids
+        self.queue = asyncio.Queue(maxsize=getattr(settings, "LIVE_QUEUE_SIZE", 100))
+        # set when events were dropped, the stream then starts over from snapshots
+        self.lagged = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+
+class Hub:
+    """the subscribers of this process and the last free spots read for each watched lot"""
+
+    def __init__(self, broker=None):
+        self.broker = broker
+        self.subscribers = defaultdict(set)
+        self.state = {}
+        self.task = None
+        # set while the listener is subscribed to the broker
+        self.listening = asyncio.Event()
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.subscribers.clear()
+            self.state.clear()
+            self.listening = asyncio.Event()
+            self.task = loop.create_task(self.run())
+
+    async def subscribe(self, lot_ids):
+        """a new Subscription and the (lot id, free spots) to start it from"""
+        self.start()
+        # read the snapshot only once changes reach the listener, so none falls between it and the deltas
+        await asyncio.wait_for(self.listening.wait(), LISTEN_TIMEOUT)
+        subscription = Subscription(lot_ids)
+        for lot_id in lot_ids:
+            self.subscribers[lot_id].add(subscription)
+        for lot_id in lot_ids:
+            if lot_id not in self.state:
+                spots = await sync_to_async(read_spots)(lot_id)
+                self.state.setdefault(lot_id, spots)
+        return subscription, [(lot_id, self.state.get(lot_id)) for lot_id in lot_ids]
+
+    def unsubscribe(self, subscription):
+        for lot_id in subscription.lot_ids:
+            watchers = self.subscribers.get(lot_id)
+            if watchers is not None:
+                watchers.discard(subscription)
+                if not watchers:
+                    del self.subscribers[lot_id]
+                    self.state.pop(lot_id, None)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def refresh(self, lot_ids):
+        for lot_id in sorted(set(lot_ids) & set(self.subscribers)):
+            spots = await sync_to_async(read_spots)(lot_id)
+            event = availability_event(lot_id, self.state.get(lot_id), spots)
+            self.state[lot_id] = spots
+            if event is not None:
+                for subscription in list(self.subscribers.get(lot_id, ())):
+                    subscription.put(event)
+
+    async def run(self):
+        broker_ = self.broker or broker()
+        reconnecting = False
+        while True:
+            try:
+                if reconnecting:
+                    # changes made while disconnected were missed
+                    await self.refresh(list(self.subscribers))
+                async with aclosing(broker_.listen(self.listening)) as notifications:
+                    async for lot_ids in notifications:
+                        await self.refresh(lot_ids)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("lost the availability notifications, listening again")
+            self.listening.clear()
+            reconnecting = True
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+hub = Hub()
+
+
+def format_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, cls=JSONEncoder)}\n\n"
+
+
+async def events(lot_ids):
+    subscription, snapshots = await hub.subscribe(lot_ids)
+    heartbeat = getattr(settings, "LIVE_HEARTBEAT", 15)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        for lot_id, spots in snapshots:
+            yield format_event(*snapshot_event(lot_id, spots))
+        while True:
+            if subscription.lagged:
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.lagged = False
+                for lot_id in lot_ids:
+                    yield format_event(*snapshot_event(lot_id, hub.state.get(lot_id)))
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(*event)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+@query_budget(0)  # everything is read by the stream, after the response has started
+async def stream_view(request):
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Live availability is only served over ASGI."}, status=501)
+    lots = request.GET.getlist("lot")
+    max_lots = getattr(settings, "LIVE_MAX_LOTS", 20)
+    if not lots or len(lots) > max_lots or not all(lot.isdigit() for lot in lots):
+        return JsonResponse({"error": f"Give between 1 and {max_lots} lot ids as lot."}, status=400)
+
+    response = StreamingHttpResponse(events(sorted({int(lot) for lot in lots})), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # stops nginx from buffering the events
+    response["X-Accel-Buffering"] = "no"
+    return response
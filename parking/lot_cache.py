@@ -0,0 +1,127 @@
+"""
+Read-through cache of the serialized lot payloads: a lot's detail and its
+free spots.
+
+Payloads are stored under a per-lot version, ``lot:<id>:<version>:<name>``.
+The signals in signals.py bump the version whenever the lot, its operator or
+one of its spots is saved or deleted, once the write commits, so
+invalidating a lot is a single ``cache.incr``: entries of older versions are
+never read again and simply expire.
+
+Every entry is fresh for ``LOT_CACHE_TTL`` seconds and kept for
+``LOT_CACHE_GRACE`` more. Past that point the first reader takes a short
+lock (``cache.add``) and recomputes while the others keep getting the
+previous payload. On a cold miss the others wait up to ``LOT_CACHE_WAIT``
+seconds for that reader's result instead of all querying the database at
+once (single flight).
+
+Misses are computed from the primary database, so a lagging replica can
+never put an outdated payload under a new version.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.generics import get_object_or_404
+
+from config.replicas import primary_reads
+from . import serializers
+from .models import ParkingLot, ParkingSpot
+
+LOCK_TIMEOUT = 10
+WAIT_INTERVAL = 0.05
+
+
+def version_key(lot_id):
+    return f"lot:{lot_id}:version"
+
+
+def get_version(lot_id):
+    key = version_key(lot_id)
+    version = cache.get(key)
+    if version is None:
+        # versions start from the clock, so one evicted from the cache is never handed out again
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key, time.time_ns())
+    return version
+
+
+def bump(lot_id):
+    try:
+        cache.incr(version_key(lot_id))
+    except ValueError:
+        cache.add(version_key(lot_id), time.time_ns(), None)
+
+
+def bump_many(lot_ids):
+    for lot_id in set(lot_ids):
+        bump(lot_id)
+
+
+def _store(key, compute):
+    try:
+        with primary_reads():
+            payload = compute()
+        ttl = settings.LOT_CACHE_TTL
+        cache.set(key, (time.time() + ttl, payload), ttl + settings.LOT_CACHE_GRACE)
+        return payload
+    finally:
+        cache.delete(f"{key}:lock")
+
+
+def _wait_for(key):
+    deadline = time.monotonic() + settings.LOT_CACHE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def read_through(lot_id, name, compute):
+    """the `name` payload of the lot, computed by `compute()` when missing or stale"""
+    key = f"lot:{lot_id}:{get_version(lot_id)}:{name}"
+    entry = cache.get(key)
+    if entry is not None:
+        fresh_until, payload = entry
+        if time.time() < fresh_until or not cache.add(f"{key}:lock", 1, LOCK_TIMEOUT):
+            return payload
+        return _store(key, compute)
+
+    if cache.add(f"{key}:lock", 1, LOCK_TIMEOUT):
+        return _store(key, compute)
+    entry = _wait_for(key)
+    if entry is not None:
+        return entry[1]
+    # whoever held the lock failed or is too slow
+    return compute()
+
+
+def _cacheable(pk):
+    return str(pk).isdigit()
+
+
+def lot_detail(pk):
+    """ParkingLotSerializer data of the active lot `pk`; raises Http404"""
+    def compute():
+        return serializers.ParkingLotSerializer(get_object_or_404(
+            ParkingLot.objects.filter(is_active=True).select_related("operator").prefetch_related("spots"), pk=pk,
+        )).data
+
+    return read_through(pk, "detail", compute) if _cacheable(pk) else compute()
+
+
+def free_spots(pk, spot_type=None):
+    """the available spots of the active lot `pk`, of `spot_type` if given; raises Http404"""
+    def compute():
+        lot = get_object_or_404(ParkingLot.objects.filter(is_active=True), pk=pk)
+        spots = lot.spots.filter(is_available=True)
+        if spot_type:
+            spots = spots.filter(spot_type=spot_type)
+        return serializers.ParkingSpotSerializer(spots, many=True).data
+
+    known_type = not spot_type or spot_type in dict(ParkingSpot.SPOT_TYPES)
+    if _cacheable(pk) and known_type:
+        return read_through(pk, f"free_spots:{spot_type or 'all'}", compute)
+    return compute()
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parking.archive import PartitioningUnsupported, archive_bookings, partition_archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move completed and cancelled bookings, and their payments, into the archive tables in small batches. "
+        "Defaults come from settings.ARCHIVE_POLICY."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--age", type=int, default=None,
+                            help="archive bookings that ended more than this many days ago")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="bookings moved per transaction")
+        parser.add_argument("--pause", type=float, default=None,
+                            help="seconds to sleep between batches")
+        parser.add_argument("--limit", type=int, default=None,
+                            help="archive at most this many bookings per sweep")
+        parser.add_argument("--loop", type=float, default=None, metavar="SECONDS",
+                            help="keep sweeping, sleeping this long between sweeps")
+        parser.add_argument("--partition", action="store_true",
+                            help="first turn the archive into a table partitioned by month (PostgreSQL only)")
+
+    def handle(self, *args, **options):
+        if options["partition"]:
+            try:
+                converted = partition_archive()
+            except PartitioningUnsupported as e:
+                raise CommandError(str(e))
+            self.stdout.write("archive partitioned by month" if converted else "archive is already partitioned")
+
+        while True:
+            archived, elapsed = archive_bookings(
+                age=options["age"],
+                batch_size=options["batch_size"],
+                pause=options["pause"],
+                limit=options["limit"],
+            )
+            rate = archived / elapsed if elapsed else 0
+            self.stdout.write(f"archived {archived} bookings in {elapsed:.1f}s ({rate:.0f} rows/s)")
+            if options["loop"] is None:
+                return
+            time.sleep(options["loop"])
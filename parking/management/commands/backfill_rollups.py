@@ -0,0 +1,45 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from parking.models import ArchivedBooking, Booking
+from parking.rollups import backfill
+
+
+def booking_days():
+    """the first and last day any live or archived booking was made or covers"""
+    days = [
+        timezone.localtime(moment).date()
+        for model in (Booking, ArchivedBooking)
+        for moment in model.objects.aggregate(Min("booking_time"), Min("start_time"), Max("end_time")).values()
+        if moment is not None
+    ]
+    return (min(days), max(days)) if days else (None, None)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the hourly and daily lot rollups of a range of days from the live and archived bookings, "
+        "e.g. after seeding or fixing bookings by hand."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=date.fromisoformat, default=None,
+                            help="first day to rebuild (YYYY-MM-DD), by default the first day with bookings")
+        parser.add_argument("--until", type=date.fromisoformat, default=None,
+                            help="last day to rebuild (YYYY-MM-DD), by default the last day with bookings")
+
+    def handle(self, *args, **options):
+        first, last = booking_days()
+        since = options["since"] or first
+        until = options["until"] or last
+        if since is None or until is None:
+            self.stdout.write("no bookings to roll up")
+            return
+        if since > until:
+            raise CommandError("--since is after --until")
+
+        days = backfill(since, until)
+        self.stdout.write(f"rebuilt the rollups of {days} days ({since} to {until})")
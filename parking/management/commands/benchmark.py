@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parking.benchmark import SCENARIOS, build_scenarios, compare, run_in_process, run_over_http
+from parking.seeding import seed
+
+DEFAULT_BASELINE = os.path.join("benchmarks", "baseline.json")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark lot search, quick-book and payment creation through the real URL routes, "
+        "in-process or against a running server, and compare with a stored baseline. "
+        "Creates bookings (and with --seed, a whole dataset): run it against a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+        parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+        parser.add_argument("--radius", type=float, default=2, help="search radius")
+        parser.add_argument("--base-url", default=None,
+                            help="benchmark a running server over HTTP instead of in-process; "
+                                 "payments then go to the server's real gateway")
+        parser.add_argument("--concurrency", type=int, default=1, help="requests in flight over HTTP")
+
+        parser.add_argument("--seed", action="store_true", help="seed an empty database first")
+        parser.add_argument("--lots", type=int, default=20)
+        parser.add_argument("--spots-per-lot", type=int, default=500)
+        parser.add_argument("--motorists", type=int, default=200)
+        parser.add_argument("--bookings", type=int, default=100_000)
+
+        parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file to compare with")
+        parser.add_argument("--save-baseline", action="store_true", help="write the results to --baseline")
+        parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="allowed p95 slowdown against the baseline, as a fraction")
+        parser.add_argument("--check", action="store_true", help="fail if any scenario regressed")
+        parser.add_argument("--output", default=None, help="also write the results to this file")
+
+    def handle(self, *args, **options):
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        names = options["scenarios"] or list(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+        dataset = {key: options[key] for key in ("lots", "spots_per_lot", "motorists", "bookings")}
+        if options["seed"]:
+            counts = seed(**dataset)
+            self.stdout.write("seeded " + ", ".join(f"{count} {name}" for name, count in counts.items()))
+
+        try:
+            scenarios, headers = build_scenarios(names, options["requests"], options["radius"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        mode = "http" if options["base_url"] else "in-process"
+        results = {}
+        for scenario in scenarios:
+            if options["base_url"]:
+                results[scenario.name] = run_over_http(scenario, headers, options["base_url"],
+                                                       options["concurrency"])
+            else:
+                results[scenario.name] = run_in_process(scenario, headers)
+            self.report(scenario.name, results[scenario.name])
+
+        report = {"mode": mode, "dataset": dataset, "requests": options["requests"], "results": results}
+        if options["output"]:
+            self.write(options["output"], report)
+
+        baseline = self.load(options["baseline"])
+        regressions = []
+        if baseline and baseline.get("mode") == mode:
+            if baseline.get("dataset") != dataset:
+                self.stdout.write(self.style.WARNING("baseline was taken on a different dataset"))
+            regressions = compare(results, baseline["results"], options["tolerance"])
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(f"regression: {regression}"))
+
+        if options["save_baseline"]:
+            self.write(options["baseline"], report)
+            self.stdout.write(self.style.SUCCESS(f"baseline written to {options['baseline']}"))
+        if regressions and options["check"]:
+            raise CommandError(f"{len(regressions)} regressions against {options['baseline']}")
+
+    def report(self, name, stats):
+        if not stats.get("requests"):
+            self.stdout.write(self.style.ERROR(f"{name}: all {stats['errors']} requests failed"))
+            return
+        queries = stats["queries_per_request"]
+        self.stdout.write(
+            f"{name}: {stats['requests']} ok, {stats['errors']} errors, {stats['throughput_rps']} req/s, "
+            f"p50 {stats['p50_ms']}ms, p95 {stats['p95_ms']}ms, p99 {stats['p99_ms']}ms"
+            + (f", {queries} queries/request" if queries is not None else "")
+        )
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path) as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def write(path, report):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+            fh.write("\n")
@@ -0,0 +1,44 @@
+import asyncio
+import logging
+
+from django.core.management.base import BaseCommand
+
+from parking.benchmark import send_all, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent GET requests at a running server and report throughput and latency, "
+        "e.g. to compare the uvicorn (ASGI) and gunicorn sync (WSGI) deployments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="paths to request in turn, e.g. /api/parking/lots/")
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--concurrency", type=int, default=50,
+                            help="requests kept in flight at once")
+        parser.add_argument("--requests", type=int, default=2000, help="total requests to send")
+        parser.add_argument("--timeout", type=float, default=30)
+        parser.add_argument("--header", action="append", default=[],
+                            help="extra 'Name: value' header, e.g. an Authorization header")
+
+    def handle(self, *args, **options):
+        # httpx logs every request at INFO
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        headers = dict(header.split(":", 1) for header in options["header"])
+        headers = {name.strip(): value.strip() for name, value in headers.items()}
+        paths = options["paths"]
+        requests = [("GET", paths[i % len(paths)], None) for i in range(options["requests"])]
+
+        timings, errors, elapsed = asyncio.run(send_all(
+            options["base_url"], requests, options["concurrency"], headers, options["timeout"],
+        ))
+        stats = summarize(timings, elapsed, errors)
+        if not stats["requests"]:
+            self.stderr.write(f"all {errors} requests failed")
+            return
+        self.stdout.write(
+            f"{stats['requests']} ok, {errors} errors in {elapsed:.1f}s at concurrency {options['concurrency']}: "
+            f"{stats['throughput_rps']:.0f} req/s, p50 {stats['p50_ms']:.1f}ms, "
+            f"p95 {stats['p95_ms']:.1f}ms, p99 {stats['p99_ms']:.1f}ms"
+        )
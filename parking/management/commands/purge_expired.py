@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parking.purge import TARGETS, purge
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired OTPs, sessions, stale pending bookings, old sync tombstones and finished SMS jobs "
+        "in small batches. Per-target defaults come from settings.PURGE_POLICIES."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("targets", nargs="*",
+                            help=f"what to purge, any of {', '.join(TARGETS)} (default: everything)")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="rows deleted per transaction")
+        parser.add_argument("--pause", type=float, default=None,
+                            help="seconds to sleep between batches")
+        parser.add_argument("--retention", type=int, default=None,
+                            help="keep rows for this many minutes past their expiry")
+        parser.add_argument("--limit", type=int, default=None,
+                            help="delete at most this many rows per target per sweep")
+        parser.add_argument("--loop", type=float, default=None, metavar="SECONDS",
+                            help="keep sweeping, sleeping this long between sweeps")
+
+    def handle(self, *args, **options):
+        targets = options["targets"] or list(TARGETS)
+        unknown = set(targets) - set(TARGETS)
+        if unknown:
+            raise CommandError(f"unknown purge targets: {', '.join(sorted(unknown))}")
+        while True:
+            for name in targets:
+                deleted, elapsed = purge(
+                    name,
+                    batch_size=options["batch_size"],
+                    pause=options["pause"],
+                    retention=options["retention"],
+                    limit=options["limit"],
+                )
+                rate = deleted / elapsed if elapsed else 0
+                self.stdout.write(f"{name}: deleted {deleted} rows in {elapsed:.1f}s ({rate:.0f} rows/s)")
+            if options["loop"] is None:
+                return
+            time.sleep(options["loop"])
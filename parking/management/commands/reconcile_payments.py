@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from parking.reconciliation import Checkpoint, reconcile_payments
+from parking.utils import PaymentService
+
+
+class Command(BaseCommand):
+    help = "Settle payments that are still pending because their webhook never arrived."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=int, default=30,
+                            help="only sweep payments pending for at least this many minutes")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=8,
+                            help="maximum concurrent status lookups against the provider")
+        parser.add_argument("--rate", type=float, default=20,
+                            help="maximum provider calls per second")
+        parser.add_argument("--limit", type=int, default=None,
+                            help="stop after checking this many payments")
+        parser.add_argument("--checkpoint", default=None,
+                            help="file used to resume an interrupted run")
+
+    def handle(self, *args, **options):
+        stats = reconcile_payments(
+            PaymentService(),
+            older_than=timedelta(minutes=options["older_than"]),
+            batch_size=options["batch_size"],
+            workers=options["workers"],
+            rate=options["rate"],
+            checkpoint=Checkpoint(options["checkpoint"]),
+            limit=options["limit"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            "checked {checked}: {completed} completed, {failed} failed, "
+            "{pending} still pending, {errors} errors".format(**stats)
+        ))
@@ -0,0 +1,58 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from parking.models import ParkingLot
+from parking.seeding import DEFAULT_PASSWORD, seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate deterministic synthetic users, lots, spots, vehicles, bookings and payments "
+        "with bulk inserts. Meant for an empty scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--operators", type=int, default=50)
+        parser.add_argument("--motorists", type=int, default=100_000)
+        parser.add_argument("--lots", type=int, default=500)
+        parser.add_argument("--spots-per-lot", type=int, default=200)
+        parser.add_argument("--bookings", type=int, default=1_000_000)
+        parser.add_argument("--seed", type=int, default=1, help="same seed, same data")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="rows per bulk insert")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="processes inserting in parallel (ignored on SQLite)")
+        parser.add_argument("--now", default=None,
+                            help="ISO time the booking history ends at (default: now), fix it for identical data")
+        parser.add_argument("--password", default=DEFAULT_PASSWORD, help="password of every generated user")
+        parser.add_argument("--force", action="store_true", help="seed even if the database has lots already")
+
+    def handle(self, *args, **options):
+        if ParkingLot.objects.exists() and not options["force"]:
+            raise CommandError("the database already has parking lots, use --force to seed anyway")
+        now = None
+        if options["now"]:
+            now = datetime.fromisoformat(options["now"])
+            if timezone.is_naive(now):
+                now = timezone.make_aware(now)
+        if options["workers"] > 1 and connection.vendor == "sqlite":
+            self.stdout.write(self.style.WARNING("SQLite allows a single writer, seeding in one process"))
+
+        started = time.monotonic()
+        counts = seed(
+            operators=options["operators"], motorists=options["motorists"], lots=options["lots"],
+            spots_per_lot=options["spots_per_lot"], bookings=options["bookings"], seed=options["seed"],
+            chunk_size=options["chunk_size"], workers=options["workers"], now=now,
+            password=options["password"], progress=self.progress,
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"seeded {', '.join(f'{count} {kind}' for kind, count in counts.items())} in {elapsed:.0f}s"
+        ))
+
+    def progress(self, kind, done, total):
+        self.stdout.write(f"{kind}: {done}/{total} ({done * 100 // max(total, 1)}%)")
+        self.stdout.flush()
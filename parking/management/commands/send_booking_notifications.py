@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from parking.notifications import queue_booking_reminders, queue_expiry_notices
+
+
+class Command(BaseCommand):
+    help = "Queue booking reminders and expiry notices for the SMS worker. Safe to run every minute."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reminder-lead", type=int, default=30,
+                            help="remind motorists this many minutes before their booking starts")
+        parser.add_argument("--expiry-lead", type=int, default=15,
+                            help="warn motorists this many minutes before their booking ends")
+
+    def handle(self, *args, **options):
+        reminders = queue_booking_reminders(lead=timedelta(minutes=options["reminder_lead"]))
+        notices = queue_expiry_notices(lead=timedelta(minutes=options["expiry_lead"]))
+        self.stdout.write(self.style.SUCCESS(f"queued {reminders} reminders and {notices} expiry notices"))
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0005_payment_external_id_payment_webhook_data'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'created_at'], name='parking_pay_status_176a44_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0006_payment_status_created_at_index'),
+        ('users', '0007_otp_expires_at_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status', 'booking_time'], name='parking_boo_status_99e427_idx'),
+        ),
+    ]
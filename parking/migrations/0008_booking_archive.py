@@ -0,0 +1,56 @@
+# Generated by Django 5.2 on 2026-10-19 13:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0007_booking_status_booking_time_index'),
+        ('users', '0007_otp_expires_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPayment',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('amount', models.PositiveIntegerField(help_text='Amount in TZS')),
+                ('phone_number', models.CharField(max_length=15)),
+                ('transaction_id', models.CharField(max_length=50)),
+                ('external_id', models.CharField(blank=True, max_length=50, null=True)),
+                ('webhook_data', models.JSONField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed')], max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Archived Payment',
+                'verbose_name_plural': 'Archived Payments',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedBooking',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('phone_number', models.CharField(blank=True, max_length=15, null=True)),
+                ('booking_time', models.DateTimeField()),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField()),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('active', 'Active'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('parking_spot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to='parking.parkingspot')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to='users.motorist')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to='parking.vehicle')),
+                ('payment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='booking', to='parking.archivedpayment')),
+            ],
+            options={
+                'verbose_name': 'Archived Booking',
+                'verbose_name_plural': 'Archived Bookings',
+                'indexes': [models.Index(fields=['user', 'booking_time'], name='parking_arc_user_id_b0d8e2_idx')],
+            },
+        ),
+    ]
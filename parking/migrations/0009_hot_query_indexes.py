@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-19 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0008_booking_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', '-booking_time'], name='booking_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('status__in', ['confirmed', 'active'])), fields=['parking_spot', 'start_time'], include=('end_time',), name='booking_spot_live_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingspot',
+            index=models.Index(fields=['lot', 'is_available', 'spot_type'], name='spot_lot_free_type_idx'),
+        ),
+    ]
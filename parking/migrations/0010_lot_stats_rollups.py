@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-19 13:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0009_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyLotStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bookings', models.PositiveIntegerField(default=0)),
+                ('occupied_seconds', models.BigIntegerField(default=0, help_text='Spot-seconds of paid bookings')),
+                ('revenue', models.BigIntegerField(default=0, help_text='Amount in TZS')),
+                ('day', models.DateField()),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parking.parkinglot')),
+            ],
+            options={
+                'verbose_name': 'Daily Lot Stats',
+                'verbose_name_plural': 'Daily Lot Stats',
+                'constraints': [models.UniqueConstraint(fields=('lot', 'day'), name='daily_lot_stats_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyLotStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bookings', models.PositiveIntegerField(default=0)),
+                ('occupied_seconds', models.BigIntegerField(default=0, help_text='Spot-seconds of paid bookings')),
+                ('revenue', models.BigIntegerField(default=0, help_text='Amount in TZS')),
+                ('hour', models.DateTimeField()),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parking.parkinglot')),
+            ],
+            options={
+                'verbose_name': 'Hourly Lot Stats',
+                'verbose_name_plural': 'Hourly Lot Stats',
+                'constraints': [models.UniqueConstraint(fields=('lot', 'hour'), name='hourly_lot_stats_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0010_lot_stats_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parkingspot',
+            name='occupancy_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -44,10 +44,15 @@ class ParkingLot(models.Model):
     opening_hours = models.TimeField()
     closing_hours = models.TimeField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # when the lot last changed, what the delta sync (sync.py) pages through
+    updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
     class Meta:
-        indexes = [ models.Index(fields=['latitude', 'longitude']), ]
+        indexes = [
+            models.Index(fields=['latitude', 'longitude']),
+            models.Index(fields=['updated_at', 'id'], name='lot_updated_idx'),
+        ]
         verbose_name = 'Parking Lot'
         verbose_name_plural = 'Parking Lots'
 
@@ -70,9 +75,18 @@ class ParkingSpot(models.Model):
     spot_type = models.CharField(max_length=20, choices=SPOT_TYPES)
     hourly_rate = models.DecimalField(max_digits=6, decimal_places=2, validators=[MinValueValidator(1)])
     is_available = models.BooleanField(default=True)
+    # time of the sensor reading is_available comes from, see sensors.py
+    occupancy_updated_at = models.DateTimeField(null=True, blank=True)
+    # set by bulk updates too, see sync.py
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('lot', 'spot_number')
+        indexes = [
+            # free spots of a lot, by type
+            models.Index(fields=['lot', 'is_available', 'spot_type'], name='spot_lot_free_type_idx'),
+            models.Index(fields=['updated_at', 'id'], name='spot_updated_idx'),
+        ]
         verbose_name = 'Parking Spot'
         verbose_name_plural = 'Parking Spots'
 
@@ -102,6 +116,15 @@ class Booking(models.Model):
 
     class Meta:
         unique_together = ('parking_spot', 'start_time', 'end_time')
+        indexes = [
+            models.Index(fields=['status', 'booking_time']),
+            # a user's history, newest first
+            models.Index(fields=['user', '-booking_time'], name='booking_user_recent_idx'),
+            # overlap checks only look at bookings that hold their spot; on PostgreSQL
+            # this index alone answers them
+            models.Index(fields=['parking_spot', 'start_time'], include=['end_time'],
+                         condition=models.Q(status__in=['confirmed', 'active']), name='booking_spot_live_idx'),
+        ]
         verbose_name = 'Booking'
         verbose_name_plural = 'Bookings'
 
@@ -169,6 +192,7 @@ class Payment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
+        indexes = [ models.Index(fields=['status', 'created_at']), ]
         verbose_name = 'Payment'
         verbose_name_plural = 'Payments'
         ordering = ['-created_at']
@@ -201,3 +225,106 @@ class Payment(models.Model):
         """Get formatted amount string"""
         return f"TZS {self.amount:,}"
 
+
+
+class ArchivedPayment(models.Model):
+    """a Payment moved out of the live table along with its booking, see archive.py"""
+    id = models.UUIDField(primary_key=True, editable=False)
+    amount = models.PositiveIntegerField(help_text="Amount in TZS")
+    phone_number = models.CharField(max_length=15)
+    transaction_id = models.CharField(max_length=50)
+    external_id = models.CharField(max_length=50, null=True, blank=True)
+    webhook_data = models.JSONField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=Payment.PAYMENT_STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Archived Payment'
+        verbose_name_plural = 'Archived Payments'
+
+    def __str__(self):
+        return f"Archived payment {self.transaction_id}"
+
+
+class ArchivedBooking(models.Model):
+    """
+    A completed or cancelled Booking moved out of the live table, keeping
+    its id. Its fields match Booking so the same serializer reads both.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(Motorist, on_delete=models.CASCADE, related_name='archived_bookings')
+    parking_spot = models.ForeignKey(ParkingSpot, on_delete=models.CASCADE, related_name='archived_bookings')
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='archived_bookings')
+    phone_number = models.CharField(max_length=15, blank=True, null=True)
+    booking_time = models.DateTimeField()
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    cost = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    payment = models.OneToOneField(ArchivedPayment, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='booking')
+    status = models.CharField(max_length=20, choices=Booking.STATUS_CHOICES)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [ models.Index(fields=['user', 'booking_time']), ]
+        verbose_name = 'Archived Booking'
+        verbose_name_plural = 'Archived Bookings'
+
+    def __str__(self):
+        return f"Archived booking {self.id} for {self.parking_spot_id} ({self.start_time})"
+
+    def duration(self):
+        return self.end_time - self.start_time
+
+
+class LotStats(models.Model):
+    """
+    Booking counts, occupancy and revenue of a lot over one period, kept up
+    to date by rollups.py. Bookings are counted when made; occupancy and
+    revenue come from paid bookings.
+    """
+    lot = models.ForeignKey(ParkingLot, on_delete=models.CASCADE, related_name='+')
+    bookings = models.PositiveIntegerField(default=0)
+    occupied_seconds = models.BigIntegerField(default=0, help_text="Spot-seconds of paid bookings")
+    revenue = models.BigIntegerField(default=0, help_text="Amount in TZS")
+
+    class Meta:
+        abstract = True
+
+
+class HourlyLotStats(LotStats):
+    hour = models.DateTimeField()
+
+    class Meta:
+        constraints = [ models.UniqueConstraint(fields=['lot', 'hour'], name='hourly_lot_stats_unique'), ]
+        verbose_name = 'Hourly Lot Stats'
+        verbose_name_plural = 'Hourly Lot Stats'
+
+
+class DailyLotStats(LotStats):
+    day = models.DateField()
+
+    class Meta:
+        constraints = [ models.UniqueConstraint(fields=['lot', 'day'], name='daily_lot_stats_unique'), ]
+        verbose_name = 'Daily Lot Stats'
+        verbose_name_plural = 'Daily Lot Stats'
+
+
+class Tombstone(models.Model):
+    """a deleted lot or spot, kept for the delta sync (sync.py) until purged"""
+    KINDS = [
+        ('lot', 'Lot'),
+        ('spot', 'Spot'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [ models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_idx'), ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} (deleted {self.deleted_at:%Y-%m-%d %H:%M})"
@@ -0,0 +1,45 @@
+"""
+Booking reminders and expiry notices, queued in bulk on the SMS queue.
+
+Messages only mention the lot and the time, so every booking that starts
+(or ends) at the same lot at the same minute shares one text and the SMS
+worker can deliver them in a single multi-recipient request.
+"""
+from datetime import timedelta
+
+from django.utils import timezone
+
+from users.sms import enqueue_many
+from .models import Booking
+
+REMINDER_TEXT = "Reminder: your egesha parking at {lot} starts at {time}."
+EXPIRY_TEXT = "Your egesha parking at {lot} ends at {time}. Please move your vehicle or extend your booking."
+
+
+def _queue(bookings, time_field, text, kind):
+    rows = bookings.values(
+        'id', 'phone_number', 'user__phone_number', time_field, 'parking_spot__lot__name'
+    ).iterator(chunk_size=2000)
+    messages = (
+        (
+            row['phone_number'] or row['user__phone_number'],
+            text.format(lot=row['parking_spot__lot__name'], time=timezone.localtime(row[time_field]).strftime('%H:%M')),
+            f"{kind}:{row['id']}",
+        )
+        for row in rows
+    )
+    return enqueue_many(messages)
+
+
+def queue_booking_reminders(lead=timedelta(minutes=30), now=None):
+    """queues a reminder for every confirmed booking starting within `lead`"""
+    now = now or timezone.now()
+    bookings = Booking.objects.filter(status='confirmed', start_time__gt=now, start_time__lte=now + lead)
+    return _queue(bookings, 'start_time', REMINDER_TEXT, 'reminder')
+
+
+def queue_expiry_notices(lead=timedelta(minutes=15), now=None):
+    """queues a notice for every active booking ending within `lead`"""
+    now = now or timezone.now()
+    bookings = Booking.objects.filter(status='active', end_time__gt=now, end_time__lte=now + lead)
+    return _queue(bookings, 'end_time', EXPIRY_TEXT, 'expiry')
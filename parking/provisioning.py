@@ -0,0 +1,75 @@
+"""
+Bulk creation and update of a lot's parking spots.
+
+Operators describe spots as runs of numbers (``{"prefix": "A", "first": 1,
+"last": 200, ...}`` gives A1..A200) or upload them as CSV rows; the
+serializers in serializers.py expand either into one list of spots.
+`provision` checks the whole list against the lot's existing spot numbers in
+one query and inserts it with ``bulk_create``. `update_spots` applies any
+number of rate and type changes in a single ``UPDATE`` built from ``CASE``
+expressions.
+
+Neither sends model signals, so both bump the lot's cached payloads
+(see lot_cache.py) and notify the live availability streams (live.py)
+themselves.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from . import live, lot_cache
+from .models import ParkingSpot
+
+# spots created or updated by one request
+MAX_SPOTS = 2000
+CSV_COLUMNS = ("spot_number", "spot_type", "hourly_rate")
+
+
+class SpotConflict(ValueError):
+    """spot numbers that already exist in the lot, reported to the client as a 400"""
+
+    def __init__(self, spot_numbers):
+        self.spot_numbers = sorted(spot_numbers)
+        super().__init__(f"{len(self.spot_numbers)} spot numbers already exist in this lot.")
+
+
+def spot_numbers(prefix, first, last):
+    return [f"{prefix}{number}" for number in range(first, last + 1)]
+
+
+def provision(lot, spots):
+    """creates `spots` (dicts of spot_number, spot_type and hourly_rate) in `lot`, returns how many"""
+    numbers = [spot["spot_number"] for spot in spots]
+    existing = ParkingSpot.objects.filter(lot=lot, spot_number__in=numbers).values_list("spot_number", flat=True)
+    if existing := set(existing):
+        raise SpotConflict(existing)
+    try:
+        with transaction.atomic():
+            ParkingSpot.objects.bulk_create([ParkingSpot(lot=lot, **spot) for spot in spots], batch_size=1000)
+    except IntegrityError:
+        # created by someone else since the check
+        raise SpotConflict(ParkingSpot.objects.filter(lot=lot, spot_number__in=numbers)
+                           .values_list("spot_number", flat=True))
+    lot_cache.bump(lot.pk)
+    live.notify([lot.pk])
+    return len(spots)
+
+
+def update_spots(lot, changes):
+    """
+    Applies `changes` (dicts of spot_numbers and a new hourly_rate and/or
+    spot_type) to the spots of `lot` in one UPDATE. Later changes win over
+    earlier ones for the same spot. Returns the number of spots updated.
+    """
+    fields = {}
+    for field in ("hourly_rate", "spot_type"):
+        whens = [When(spot_number__in=change["spot_numbers"], then=Value(change[field]))
+                 for change in reversed(changes) if field in change]
+        if whens:
+            fields[field] = Case(*whens, default=F(field))
+    numbers = {number for change in changes for number in change["spot_numbers"]}
+    # update() skips auto_now
+    updated = ParkingSpot.objects.filter(lot=lot, spot_number__in=numbers).update(**fields, updated_at=timezone.now())
+    lot_cache.bump(lot.pk)
+    live.notify([lot.pk])
+    return updated
@@ -0,0 +1,105 @@
+"""
+Batched deletion of expired rows.
+
+Each target names a model, the indexed column its rows expire on and the
+filter for rows that are safe to delete. `purge` removes them in chunks of
+`batch_size`: the ids of the oldest expired rows are read through the index,
+then deleted by primary key in their own short transaction, with a pause
+between chunks so concurrent writers are never held up for long.
+
+Retention, batch size and pause are set per target in
+``settings.PURGE_POLICIES``.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from users.models import OTP, SMSJob
+from .models import Booking, Tombstone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY = {"retention": 0, "batch_size": 1000, "pause": 0.1}
+
+
+def expired_otps(cutoff):
+    # rows written before expires_at was recorded expire 15 minutes after creation
+    return OTP.objects.filter(
+        Q(expires_at__lt=cutoff)
+        | Q(expires_at__isnull=True, created_at__lt=cutoff - timedelta(minutes=15))
+    ), "expires_at"
+
+
+def expired_sessions(cutoff):
+    return Session.objects.filter(expire_date__lt=cutoff), "expire_date"
+
+
+def stale_pending_bookings(cutoff):
+    """bookings that never got paid for; they still block their spot until deleted"""
+    return Booking.objects.filter(status="pending", booking_time__lt=cutoff).exclude(
+        payment__status="completed"
+    ), "booking_time"
+
+
+def old_tombstones(cutoff):
+    """deletions the delta sync (sync.py) no longer reports"""
+    return Tombstone.objects.filter(deleted_at__lt=cutoff), "deleted_at"
+
+
+def finished_sms_jobs(cutoff):
+    """SMS jobs that were sent or gave up; a sweep can queue their dedupe_key again once they are gone"""
+    return SMSJob.objects.filter(status__in=["sent", "dead"], available_at__lt=cutoff), "available_at"
+
+
+TARGETS = {
+    "otps": expired_otps,
+    "sessions": expired_sessions,
+    "pending_bookings": stale_pending_bookings,
+    "tombstones": old_tombstones,
+    "sms_jobs": finished_sms_jobs,
+}
+
+
+def get_policy(name):
+    policy = dict(DEFAULT_POLICY)
+    policy.update(getattr(settings, "PURGE_POLICIES", {}).get(name, {}))
+    return policy
+
+
+def purge(name, batch_size=None, pause=None, retention=None, limit=None, now=None):
+    """
+    Deletes the expired rows of target `name`, at most `limit` of them.
+    Returns (rows deleted, seconds taken).
+    """
+    policy = get_policy(name)
+    batch_size = batch_size or policy["batch_size"]
+    pause = policy["pause"] if pause is None else pause
+    retention = policy["retention"] if retention is None else retention
+    cutoff = (now or timezone.now()) - timedelta(minutes=retention)
+
+    queryset, order_field = TARGETS[name](cutoff)
+    model = queryset.model
+    started = time.monotonic()
+    deleted = 0
+    while limit is None or deleted < limit:
+        size = batch_size if limit is None else min(batch_size, limit - deleted)
+        ids = list(queryset.order_by(order_field).values_list("pk", flat=True)[:size])
+        if not ids:
+            break
+        with transaction.atomic():
+            _, per_model = model.objects.filter(pk__in=ids).delete()
+        deleted += per_model.get(model._meta.label, 0)
+        if len(ids) < size:
+            break
+        time.sleep(pause)
+
+    elapsed = time.monotonic() - started
+    if deleted:
+        logger.info("purged %s %s in %.1fs", deleted, name, elapsed)
+    return deleted, elapsed
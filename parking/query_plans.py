@@ -0,0 +1,131 @@
+"""
+The hot queries of the API and a check that none of them reads a whole table.
+
+Each entry of HOT_QUERIES builds the queryset as the code that runs it does
+(with placeholder values). `full_scans` runs EXPLAIN on a queryset and
+returns the tables its plan reads in full, or None on a database FULL_SCAN
+has no pattern for. The test suite asserts that list is empty for every
+hot query (and skips on other databases), so a query change or a dropped
+index that loses the index shows up as a failing test.
+
+On PostgreSQL the plan is taken with sequential scans disabled, since on the
+near-empty test tables the planner would prefer them even with a usable
+index; a "Seq Scan" that is left means there was no index to use.
+"""
+import re
+from datetime import timedelta
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from users.models import OTP, SMSJob
+from .archive import archivable, user_history
+from .models import Booking, DailyLotStats, HourlyLotStats, ParkingLot, ParkingSpot, Payment, Tombstone
+from .purge import expired_otps, stale_pending_bookings
+from .sync import LOTS, SPOTS, TOMBSTONES, changed
+
+ACTIVE = ["confirmed", "active"]
+
+
+class Placeholder:
+    pk = 1
+
+
+def booking_overlap():
+    """the overlap check of BookingSerializer and QuickBookingSerializer"""
+    start = timezone.now()
+    return Booking.objects.filter(parking_spot_id=1, start_time__lt=start + timedelta(hours=1),
+                                  end_time__gt=start, status__in=ACTIVE)
+
+
+def booking_history():
+    return user_history(Placeholder())[0].order_by("-booking_time")
+
+
+def archived_history():
+    return user_history(Placeholder())[1].order_by("-booking_time")
+
+
+def free_spots():
+    """ParkingLotViewSet.available_spots"""
+    return ParkingSpot.objects.filter(lot_id=1, is_available=True, spot_type="standard")
+
+
+def pending_payments():
+    """reconciliation.reconcile_payments"""
+    return Payment.objects.filter(status="pending", created_at__lt=timezone.now()).order_by("created_at")
+
+
+def otp_lookup():
+    """users.otp marks an issued code as used"""
+    return OTP.objects.filter(phone_number="255700000000", code_hash="0" * 64, is_used=False)
+
+
+def due_sms_jobs():
+    """the queued half of users.sms.claim_jobs"""
+    return SMSJob.objects.filter(status="queued", available_at__lte=timezone.now()).order_by("available_at")
+
+
+def hourly_lot_stats():
+    """LotStatsViewSet.retrieve"""
+    now = timezone.now()
+    return HourlyLotStats.objects.filter(lot_id=1, hour__gte=now - timedelta(days=7), hour__lte=now)
+
+
+def daily_lot_totals():
+    """LotStatsViewSet.list"""
+    today = timezone.localdate()
+    return DailyLotStats.objects.filter(lot__in=[1, 2], day__gte=today - timedelta(days=30), day__lte=today)
+
+
+def sync_changes(model, kind, time_field):
+    """one of the queries of sync.changes, past a token"""
+    def build():
+        now = timezone.now()
+        return changed(model.objects.all(), kind, time_field, (now - timedelta(hours=1), SPOTS, 1), now)
+    return build
+
+
+def archivable_bookings():
+    return archivable(timezone.now()).order_by("end_time")
+
+
+HOT_QUERIES = {
+    "booking_overlap": booking_overlap,
+    "booking_history": booking_history,
+    "archived_history": archived_history,
+    "free_spots": free_spots,
+    "pending_payments": pending_payments,
+    "otp_lookup": otp_lookup,
+    "due_sms_jobs": due_sms_jobs,
+    "expired_otps": lambda: expired_otps(timezone.now())[0],
+    "stale_pending_bookings": lambda: stale_pending_bookings(timezone.now())[0],
+    "archivable_bookings": archivable_bookings,
+    "hourly_lot_stats": hourly_lot_stats,
+    "daily_lot_totals": daily_lot_totals,
+    "lot_changes": sync_changes(ParkingLot, LOTS, "updated_at"),
+    "spot_changes": sync_changes(ParkingSpot, SPOTS, "updated_at"),
+    "tombstone_changes": sync_changes(Tombstone, TOMBSTONES, "deleted_at"),
+}
+
+FULL_SCAN = {
+    "sqlite": re.compile(r"\bSCAN (\w+)"),
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+}
+
+
+def explain(queryset):
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return queryset.explain()
+    with transaction.atomic(using=queryset.db), connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+
+def full_scans(queryset):
+    """the tables `queryset` reads in full, according to its query plan, None if the database has no plan check"""
+    pattern = FULL_SCAN.get(connections[queryset.db].vendor)
+    if pattern is None:
+        return None
+    return pattern.findall(explain(queryset))
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from config.resilience import RateLimiter
+from . import rollups
+from .models import Booking, Payment
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """
+    Remembers the (created_at, id) of the last payment that was reconciled so
+    an interrupted run can pick up where it stopped.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def load(self):
+        if not self.path:
+            return None
+        try:
+            with open(self.path) as fh:
+                data = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+        return datetime.fromisoformat(data["created_at"]), data["id"]
+
+    def save(self, created_at, payment_id):
+        if not self.path:
+            return
+        with open(self.path, "w") as fh:
+            json.dump({"created_at": created_at.isoformat(), "id": str(payment_id)}, fh)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def stale_pending_payments(older_than, after=None):
+    """
+    Pending payments created before `older_than`, walked in (created_at, id)
+    order so the (status, created_at) index drives the scan.
+    """
+    queryset = Payment.objects.filter(status="pending", created_at__lt=older_than)
+    if after:
+        created_at, payment_id = after
+        queryset = queryset.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=payment_id)
+        )
+    return queryset.order_by("created_at", "id")
+
+
+def apply_outcomes(outcomes):
+    """
+    Writes a batch of provider outcomes in one short transaction.
+    Only rows that are still pending are touched, so a webhook that landed in
+    the meantime always wins.
+    """
+    completed = [pk for pk, outcome in outcomes.items() if outcome == "completed"]
+    failed = [pk for pk, outcome in outcomes.items() if outcome == "failed"]
+    now = timezone.now()
+
+    with transaction.atomic():
+        # the rollups only count the payments this batch actually completes
+        completed = list(Payment.objects.select_for_update().filter(pk__in=completed, status="pending")
+                         .values_list("pk", flat=True))
+        paid = Booking.objects.filter(payment_id__in=completed).values_list(
+            "parking_spot__lot_id", "start_time", "end_time", "payment__amount")
+        rollups.bookings_paid(list(paid))
+        completed_count = Payment.objects.filter(pk__in=completed).update(status="completed", updated_at=now)
+        failed_count = Payment.objects.filter(pk__in=failed, status="pending").update(
+            status="failed", updated_at=now
+        )
+        Booking.objects.filter(payment_id__in=completed, status__in=["pending", "confirmed"]).update(
+            status="active"
+        )
+    return completed_count, failed_count
+
+
+def reconcile_payments(provider, older_than=timedelta(minutes=30), batch_size=500,
+                       workers=8, rate=20, checkpoint=None, limit=None):
+    """
+    Sweeps stale pending payments and settles them with the provider's view.
+
+    `provider` is anything with a `get_payment_status(reference)` method
+    returning 'completed', 'failed' or 'pending' (see `PaymentService`).
+    Provider calls run on a bounded thread pool behind a shared rate limiter;
+    results are written back one batch at a time so no transaction stays open
+    while we wait on the network.
+    """
+    checkpoint = checkpoint or Checkpoint()
+    limiter = RateLimiter(rate)
+    cutoff = timezone.now() - older_than
+    position = checkpoint.load()
+    stats = {"checked": 0, "completed": 0, "failed": 0, "pending": 0, "errors": 0}
+
+    def lookup(payment):
+        limiter.acquire()
+        try:
+            return payment.pk, provider.get_payment_status(payment.transaction_id)
+        except Exception:
+            logger.exception("status lookup failed for payment %s", payment.pk)
+            return payment.pk, None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while limit is None or stats["checked"] < limit:
+            size = batch_size if limit is None else min(batch_size, limit - stats["checked"])
+            batch = list(
+                stale_pending_payments(cutoff, after=position).only("id", "transaction_id", "created_at")[:size]
+            )
+            if not batch:
+                # the sweep reached the end, so the next run starts from the top
+                checkpoint.clear()
+                break
+
+            outcomes = {}
+            for pk, outcome in pool.map(lookup, batch):
+                if outcome is None:
+                    stats["errors"] += 1
+                    continue
+                outcomes[pk] = outcome
+                if outcome == "pending":
+                    stats["pending"] += 1
+
+            completed_count, failed_count = apply_outcomes(outcomes)
+            stats["completed"] += completed_count
+            stats["failed"] += failed_count
+            stats["checked"] += len(batch)
+
+            last = batch[-1]
+            position = (last.created_at, last.pk)
+            checkpoint.save(*position)
+
+    return stats
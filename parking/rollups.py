@@ -0,0 +1,232 @@
+"""
+Per-lot hourly and daily rollups of bookings, occupancy and revenue, read
+by the operator dashboard instead of the Booking and Payment tables.
+
+They are maintained incrementally where the state changes:
+
+* `booking_created` counts a booking in the hour (and day) it was made;
+* `bookings_paid` adds the spot time of paid bookings to every hour they
+  cover and their payment to the hour they start in.
+
+Each change is applied as a single ``INSERT ... ON CONFLICT DO UPDATE``
+per table that adds to the existing counters, so concurrent writers never
+lose each other's updates and no row has to be read first.
+
+Hours are UTC hours; days are calendar days in ``settings.TIME_ZONE``.
+Rows written without going through those functions (seeding, the admin,
+raw SQL) are picked up by recomputing the affected days with `backfill`
+(``backfill_rollups`` command), which reads the live and archived tables.
+Archiving a booking leaves the rollups unchanged.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import ArchivedBooking, Booking, DailyLotStats, HourlyLotStats
+
+logger = logging.getLogger(__name__)
+
+HOUR = timedelta(hours=1)
+COUNTERS = ("bookings", "occupied_seconds", "revenue")
+
+
+def hour_of(moment):
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def day_of(hour):
+    return timezone.localtime(hour).date()
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, dt_time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), dt_time.min))
+
+
+class Deltas:
+    """counter increments by (lot, hour), rolled up into days when applied"""
+
+    def __init__(self):
+        self.hours = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+    def add(self, lot_id, hour, **counters):
+        row = self.hours[lot_id, hour]
+        for name, value in counters.items():
+            row[name] += value
+
+    def add_booking(self, lot_id, booking_time):
+        self.add(lot_id, hour_of(booking_time), bookings=1)
+
+    def add_paid(self, lot_id, start_time, end_time, amount):
+        self.add(lot_id, hour_of(start_time), revenue=amount)
+        hour = hour_of(start_time)
+        while hour < end_time:
+            overlap = min(end_time, hour + HOUR) - max(start_time, hour)
+            self.add(lot_id, hour, occupied_seconds=int(overlap.total_seconds()))
+            hour += HOUR
+
+    def days(self):
+        days = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        for (lot_id, hour), counters in self.hours.items():
+            row = days[lot_id, day_of(hour)]
+            for name, value in counters.items():
+                row[name] += value
+        return days
+
+    def __bool__(self):
+        return bool(self.hours)
+
+
+def upsert(model, bucket, rows):
+    """adds the counters of `rows` ({(lot_id, bucket): counters}) to the rows of `model`"""
+    if not rows:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    field = model._meta.get_field(bucket)
+    columns = ("lot_id", bucket, *COUNTERS)
+    updates = ", ".join(f"{name} = {table}.{name} + excluded.{name}" for name in COUNTERS)
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON CONFLICT (lot_id, {bucket}) DO UPDATE SET {updates}"
+    )
+    params = [
+        (lot_id, field.get_db_prep_value(key, connection), *(counters[name] for name in COUNTERS))
+        for (lot_id, key), counters in sorted(rows.items())
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def apply(deltas):
+    if not deltas:
+        return
+    # both statements or neither, without a savepoint of its own inside the request's transaction
+    with transaction.atomic(savepoint=False):
+        upsert(HourlyLotStats, "hour", deltas.hours)
+        upsert(DailyLotStats, "day", deltas.days())
+
+
+def booking_created(booking):
+    deltas = Deltas()
+    deltas.add_booking(booking.parking_spot.lot_id, booking.booking_time)
+    apply(deltas)
+
+
+def bookings_paid(rows):
+    """`rows` are (lot_id, start_time, end_time, amount) of bookings whose payment just completed"""
+    deltas = Deltas()
+    for lot_id, start_time, end_time, amount in rows:
+        deltas.add_paid(lot_id, start_time, end_time, amount)
+    apply(deltas)
+
+
+def booking_paid(booking, payment):
+    bookings_paid([(booking.parking_spot.lot_id, booking.start_time, booking.end_time, payment.amount)])
+
+
+def recompute(start, end):
+    """the rollups of the hours from `start` to `end`, recomputed from the live and archived bookings"""
+    deltas = Deltas()
+    for model in (Booking, ArchivedBooking):
+        made = (model.objects.filter(booking_time__gte=start, booking_time__lt=end)
+                .annotate(hour=TruncHour("booking_time", tzinfo=dt_timezone.utc))
+                .values_list("parking_spot__lot_id", "hour").annotate(count=Count("pk")).order_by())
+        for lot_id, hour, count in made:
+            deltas.add(lot_id, hour, bookings=count)
+
+        paid = model.objects.filter(start_time__lt=end, end_time__gt=start, payment__status="completed")
+        for lot_id, start_time, end_time, amount in paid.values_list(
+                "parking_spot__lot_id", "start_time", "end_time", "payment__amount").iterator(5000):
+            deltas.add_paid(lot_id, start_time, end_time, amount)
+
+    # paid bookings overlapping the range also reach into the hours around it
+    for key in [key for key in deltas.hours if not start <= key[1] < end]:
+        del deltas.hours[key]
+    return deltas
+
+
+def backfill(first_day, last_day):
+    """
+    Replaces the rollups of every day from `first_day` to `last_day`. The
+    bookings are read once for the whole range, the rollups are then
+    replaced one day per transaction. Returns the number of days rebuilt.
+    """
+    start, end = day_bounds(first_day)[0], day_bounds(last_day)[1]
+    deltas = recompute(start, end)
+    by_day = defaultdict(Deltas)
+    for (lot_id, hour), counters in deltas.hours.items():
+        by_day[day_of(hour)].add(lot_id, hour, **counters)
+
+    day = first_day
+    days = 0
+    while day <= last_day:
+        day_start, day_end = day_bounds(day)
+        with transaction.atomic():
+            HourlyLotStats.objects.filter(hour__gte=day_start, hour__lt=day_end).delete()
+            DailyLotStats.objects.filter(day=day).delete()
+            apply(by_day.get(day, Deltas()))
+        days += 1
+        day += timedelta(days=1)
+    logger.info("rebuilt the rollups of %s days", days)
+    return days
+
+
+GRANULARITIES = {
+    # model, bucket field, seconds per bucket, longest range in days
+    "hour": (HourlyLotStats, "hour", 3600, 31),
+    "day": (DailyLotStats, "day", 86400, 366),
+}
+
+
+def buckets(granularity, first_day, last_day):
+    if granularity == "day":
+        return [first_day + timedelta(days=n) for n in range((last_day - first_day).days + 1)]
+    start, end = day_bounds(first_day)[0], day_bounds(last_day)[1]
+    return [hour_of(start) + HOUR * n for n in range(int((end - start) / HOUR))]
+
+
+def occupancy(occupied_seconds, spots, seconds):
+    return round(occupied_seconds / (spots * seconds), 4) if spots else None
+
+
+def series(lot, granularity, first_day, last_day):
+    """the lot's rollups for every hour or day of the range, zero where nothing happened"""
+    model, bucket, seconds, _ = GRANULARITIES[granularity]
+    periods = buckets(granularity, first_day, last_day)
+    rows = {
+        row[bucket]: row for row in model.objects.filter(
+            lot=lot, **{f"{bucket}__gte": periods[0], f"{bucket}__lte": periods[-1]},
+        ).values(bucket, *COUNTERS)
+    }
+    results = []
+    for period in periods:
+        row = rows.get(period) or {name: 0 for name in COUNTERS}
+        results.append({
+            "period": period, **{name: row[name] for name in COUNTERS},
+            "occupancy": occupancy(row["occupied_seconds"], lot.total_spots, seconds),
+        })
+    return results
+
+
+def lot_totals(lots, first_day, last_day):
+    """the daily rollups of each of `lots` summed over the range"""
+    lots = list(lots)
+    sums = {
+        row["lot_id"]: row for row in DailyLotStats.objects.filter(
+            lot__in=lots, day__gte=first_day, day__lte=last_day,
+        ).values("lot_id").annotate(**{name: Sum(name) for name in COUNTERS}).order_by()
+    }
+    seconds = ((last_day - first_day).days + 1) * 86400
+    results = []
+    for lot in lots:
+        row = sums.get(lot.pk) or {name: 0 for name in COUNTERS}
+        results.append({
+            "lot": lot.pk, "name": lot.name, **{name: row[name] for name in COUNTERS},
+            "occupancy": occupancy(row["occupied_seconds"], lot.total_spots, seconds),
+        })
+    return results
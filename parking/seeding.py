@@ -0,0 +1,289 @@
+"""
+Deterministic generator of realistic parking data for benchmarks and load
+tests (see the `seed` management command).
+
+Rows are generated in fixed-size chunks, and every chunk draws from its own
+random generator seeded with (seed, kind, chunk), so the same arguments
+always produce the same data however many worker processes share the work.
+Everything is written with `bulk_create`; Motorist and ParkingOperator are
+multi-table models, which `bulk_create` refuses, so their Person rows are
+bulk created first and the child rows inserted with a single executemany.
+All users share one password hash computed up front.
+
+Bookings are spread round-robin over every spot and the n-th booking of a
+spot takes the n-th two hour slot before `now`, so no two overlap. Spots
+and drivers are looked up by the index they were generated with (read back
+from the lot name, spot number and phone number), not by database id, since
+parallel workers insert chunks in no particular order. Completed
+bookings get a completed payment, cancelled ones a failed payment.
+"""
+import multiprocessing
+import random
+import uuid
+from array import array
+from contextlib import contextmanager
+from datetime import time, timedelta
+from decimal import Decimal
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from users.models import Motorist, ParkingOperator, Person
+from . import lot_cache
+from .models import Booking, ParkingLot, ParkingSpot, Payment, Vehicle
+
+# downtown Dar es Salaam, lots are scattered up to ~10km around it
+CENTER = (-6.8160, 39.2803)
+SPREAD = 0.09
+
+SPOT_TYPES = ["standard"] * 8 + ["motorcycle", "reserved"]
+HISTORY_STATUSES = ["completed"] * 17 + ["cancelled"] * 3
+VEHICLE_TYPES = ["sedan"] * 5 + ["suv"] * 3 + ["van", "truck", "motorcycle"]
+LAST_NAMES = ["Ali", "Juma", "Mushi", "Mrema", "Mwakyusa", "Kimaro", "Hassan", "Njau"]
+BOOKING_SLOT = timedelta(hours=2)
+DEFAULT_PASSWORD = "egesha-seed"
+
+
+def operator_phone(index):
+    return f"2556{index:08d}"
+
+
+def motorist_phone(index):
+    return f"2557{index:08d}"
+
+
+def phone_range(phone, count):
+    """the (first, last) phone numbers of `count` generated users, for a range lookup"""
+    return phone(0), phone(max(count, 1) - 1)
+
+
+def chunk_rng(seed, kind, start):
+    return random.Random(f"{seed}:{kind}:{start}")
+
+
+@contextmanager
+def historical_timestamps():
+    """lets bulk_create keep the generated booking and payment times instead of now()"""
+    fields = [Booking._meta.get_field("booking_time"), Payment._meta.get_field("created_at")]
+    try:
+        for field in fields:
+            field.auto_now_add = False
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _insert_children(model, rows):
+    """inserts the child table rows of a multi-table model, (person_ptr_id, *local values)"""
+    fields = [field.column for field in model._meta.local_concrete_fields]
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        connection.ops.quote_name(model._meta.db_table),
+        ", ".join(connection.ops.quote_name(column) for column in fields),
+        ", ".join(["%s"] * len(fields)),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def _create_people(model, people, child_values):
+    """
+    Bulk creates Person rows and the `model` rows on top of them.
+    `child_values` holds the values of the model's own fields for each person.
+    Returns the new ids by phone number.
+    """
+    with transaction.atomic():
+        Person.objects.bulk_create(people)
+        ids = dict(Person.objects.filter(phone_number__in=[person.phone_number for person in people])
+                   .values_list("phone_number", "id"))
+        _insert_children(model, [
+            (ids[person.phone_number], *values) for person, values in zip(people, child_values)
+        ])
+    return ids
+
+
+def seed_operators(start, stop, seed, password):
+    rng = chunk_rng(seed, "operators", start)
+    people = [
+        Person(phone_number=operator_phone(i), password=password, first_name=f"Operator {i}",
+               last_name=rng.choice(LAST_NAMES))
+        for i in range(start, stop)
+    ]
+    # company_name, business_telephone, business_email, address, city
+    _create_people(ParkingOperator, people, [
+        (f"Egesha {i}", operator_phone(i), f"operator{i}@example.com", "Samora Ave", "Dar es Salaam")
+        for i in range(start, stop)
+    ])
+    return stop - start
+
+
+def seed_motorists(start, stop, seed, password):
+    """motorists with one vehicle each"""
+    rng = chunk_rng(seed, "motorists", start)
+    people = [
+        Person(phone_number=motorist_phone(i), password=password, first_name=f"Motorist {i}",
+               last_name=rng.choice(LAST_NAMES))
+        for i in range(start, stop)
+    ]
+    # id_type, id_number
+    user_ids = _create_people(Motorist, people, [(None, None)] * len(people))
+    Vehicle.objects.bulk_create([
+        Vehicle(user_id=user_ids[motorist_phone(i)], license_plate=f"T{i:07d}",
+                vehicle_type=rng.choice(VEHICLE_TYPES))
+        for i in range(start, stop)
+    ])
+    return stop - start
+
+
+def seed_lots(start, stop, seed, spots_per_lot, operators):
+    rng = chunk_rng(seed, "lots", start)
+    operator_ids = list(ParkingOperator.objects.filter(
+        phone_number__in=[operator_phone(i) for i in range(operators)]).order_by("id").values_list("id", flat=True))
+    lots = [
+        ParkingLot(
+            name=f"Lot {i}", address=f"Street {i}", operator_id=operator_ids[i % len(operator_ids)],
+            latitude=Decimal(f"{CENTER[0] + rng.uniform(-SPREAD, SPREAD):.6f}"),
+            longitude=Decimal(f"{CENTER[1] + rng.uniform(-SPREAD, SPREAD):.6f}"),
+            total_spots=spots_per_lot, opening_hours=time(6), closing_hours=time(22),
+        )
+        for i in range(start, stop)
+    ]
+    with transaction.atomic():
+        ParkingLot.objects.bulk_create(lots)
+        # only our own operators: with --force other lots may share the generated names
+        lot_ids = ParkingLot.objects.filter(
+            name__in=[lot.name for lot in lots], operator_id__in=operator_ids,
+        ).values_list("id", flat=True)
+        ParkingSpot.objects.bulk_create([
+            ParkingSpot(lot_id=lot_id, spot_number=f"S{n}", spot_type=rng.choice(SPOT_TYPES),
+                        hourly_rate=rng.choice([500, 1000, 1500, 2000]))
+            for lot_id in sorted(lot_ids) for n in range(spots_per_lot)
+        ], batch_size=5000)
+    # bulk_create sends no signals, and a reused id may still have payloads cached
+    lot_cache.bump_many(lot_ids)
+    return stop - start
+
+
+_spots = None
+_drivers = None
+
+
+def _load_references(lots, spots_per_lot, motorists, operators, reload=False):
+    """
+    spot ids/rates by lot index * spots_per_lot + spot index and vehicle/owner
+    ids by motorist index, loaded once per process as compact arrays
+    """
+    global _spots, _drivers
+    if _spots is None or reload:
+        spot_ids, rates = array("q", [0]) * (lots * spots_per_lot), array("q", [0]) * (lots * spots_per_lot)
+        spots = ParkingSpot.objects.filter(lot__operator__phone_number__range=phone_range(operator_phone, operators))
+        for spot_id, rate, lot_name, spot_number in spots.values_list(
+                "id", "hourly_rate", "lot__name", "spot_number").iterator(10000):
+            # "Lot <i>" and "S<n>"
+            index = int(lot_name[4:]) * spots_per_lot + int(spot_number[1:])
+            spot_ids[index], rates[index] = spot_id, int(rate)
+        vehicle_ids, user_ids = array("q", [0]) * motorists, array("q", [0]) * motorists
+        vehicles = Vehicle.objects.filter(user__phone_number__range=phone_range(motorist_phone, motorists))
+        for vehicle_id, user_id, phone_number in vehicles.values_list(
+                "id", "user_id", "user__phone_number").iterator(10000):
+            index = int(phone_number) - int(motorist_phone(0))
+            vehicle_ids[index], user_ids[index] = vehicle_id, user_id
+        _spots, _drivers = (spot_ids, rates), (vehicle_ids, user_ids)
+    return _spots, _drivers
+
+
+def seed_bookings(start, stop, seed, now, lots, spots_per_lot, motorists, operators):
+    rng = chunk_rng(seed, "bookings", start)
+    (spot_ids, rates), (vehicle_ids, user_ids) = _load_references(lots, spots_per_lot, motorists, operators)
+    payments, bookings = [], []
+    for i in range(start, stop):
+        spot = i % len(spot_ids)
+        driver = rng.randrange(len(vehicle_ids))
+        start_time = now - BOOKING_SLOT * (i // len(spot_ids) + 1)
+        cost = rates[spot] * 2
+        status = rng.choice(HISTORY_STATUSES)
+        payment = Payment(
+            id=uuid.UUID(int=rng.getrandbits(128), version=4),
+            amount=cost, phone_number=motorist_phone(driver), transaction_id=f"SEED-{i}",
+            external_id=str(i), status="completed" if status == "completed" else "failed",
+            created_at=start_time - timedelta(minutes=rng.randrange(5, 120)),
+        )
+        payments.append(payment)
+        bookings.append(Booking(
+            user_id=user_ids[driver], parking_spot_id=spot_ids[spot], vehicle_id=vehicle_ids[driver],
+            phone_number=motorist_phone(driver), booking_time=payment.created_at,
+            start_time=start_time, end_time=start_time + BOOKING_SLOT, cost=cost, status=status,
+            payment_id=payment.id,
+        ))
+    with historical_timestamps(), transaction.atomic():
+        Payment.objects.bulk_create(payments)
+        Booking.objects.bulk_create(bookings)
+    return stop - start
+
+
+def _forget_references():
+    global _spots, _drivers
+    _spots = _drivers = None
+
+
+def _init_worker():
+    django.setup()
+    # never share the parent's database connections across processes
+    connections.close_all()
+
+
+def run_chunks(func, total, chunk_size, workers=1, progress=None, **kwargs):
+    """
+    Calls func(start, stop, **kwargs) for every chunk of range(total),
+    across `workers` processes when the database accepts concurrent writers.
+    """
+    chunks = [(start, min(total, start + chunk_size)) for start in range(0, total, chunk_size)]
+    done = 0
+    if workers > 1 and connection.vendor != "sqlite" and len(chunks) > 1:
+        connections.close_all()
+        with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+            results = [pool.apply_async(func, chunk, kwargs) for chunk in chunks]
+            for result in results:
+                done += result.get()
+                if progress:
+                    progress(done, total)
+    else:
+        for start, stop in chunks:
+            done += func(start, stop, **kwargs)
+            if progress:
+                progress(done, total)
+    return done
+
+
+def seed(lots=20, spots_per_lot=500, motorists=200, bookings=100_000, operators=5, seed=1,
+         chunk_size=5000, workers=1, now=None, password=DEFAULT_PASSWORD, progress=None):
+    """
+    Fills an empty database and returns the number of rows created per kind.
+    `progress(kind, done, total)` is called after every chunk.
+    """
+    now = (now or timezone.now()).replace(minute=0, second=0, microsecond=0)
+    password = make_password(password)
+
+    def reporter(kind):
+        return (lambda done, total: progress(kind, done, total)) if progress else None
+
+    counts = {}
+    counts["operators"] = run_chunks(seed_operators, operators, chunk_size, 1, reporter("operators"),
+                                     seed=seed, password=password)
+    counts["motorists"] = run_chunks(seed_motorists, motorists, chunk_size, workers, reporter("motorists"),
+                                     seed=seed, password=password)
+    lots_per_chunk = max(1, chunk_size // max(spots_per_lot, 1))
+    counts["lots"] = run_chunks(seed_lots, lots, lots_per_chunk, workers, reporter("lots"),
+                                seed=seed, spots_per_lot=spots_per_lot, operators=operators)
+    counts["spots"] = lots * spots_per_lot
+    if workers <= 1 or connection.vendor == "sqlite":
+        _load_references(lots, spots_per_lot, motorists, operators, reload=True)
+    else:
+        _forget_references()
+    counts["bookings"] = run_chunks(seed_bookings, bookings, chunk_size, workers, reporter("bookings"),
+                                    seed=seed, now=now, lots=lots, spots_per_lot=spots_per_lot,
+                                    motorists=motorists, operators=operators)
+    counts["payments"] = counts["bookings"]
+    return counts
@@ -0,0 +1,218 @@
+"""
+Occupancy readings from ground sensors and cameras.
+
+Gateways POST batches of ``{"spot": <id>, "occupied": <bool>, "ts": <time>}``
+events to ``/api/parking/sensors/events/`` with ``Authorization: Bearer
+<SENSOR_TOKEN>``. The view only parses the batch and merges it into this
+process's `OccupancyBuffer`, which keeps the latest reading per spot, so a
+spot reporting every second costs one row update per flush however many
+events arrive in between.
+
+A background thread flushes the buffer every ``SENSOR_FLUSH_INTERVAL``
+seconds (right away in the request when it is 0, and whenever more than
+``SENSOR_MAX_PENDING`` spots are waiting). A flush reads up to
+``FLUSH_CHUNK`` spots at a time and writes the ones whose occupancy flipped,
+skipping spots that already hold a newer reading, so readings of the same
+spot handled by different workers are applied in the order they were
+taken. It then bumps the cached payloads of the lots that changed (see
+lot_cache.py), which is where the free spot counts are read from, and
+tells the live availability streams (live.py).
+
+Readings are acknowledged with a 202 once they are in the buffer, before
+they are written. A worker that exits normally writes what it still holds
+(`flush_on_exit`, from gunicorn's ``worker_exit`` hook). One that is
+killed or crashes loses up to ``SENSOR_FLUSH_INTERVAL`` seconds of
+readings. Sensors repeat their state every few seconds, so the next
+repeat puts those spots right.
+"""
+import hmac
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import BooleanField, Case, DateTimeField, Q, Value, When
+from django.http import HttpResponseForbidden, JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from config.metrics import SENSOR_EVENTS, SENSOR_SPOT_UPDATES
+from config.middleware import query_budget
+from . import live, lot_cache
+from .models import ParkingSpot
+
+logger = logging.getLogger(__name__)
+
+FLUSH_CHUNK = 500
+MAX_BATCH = 5000
+
+
+def parse_time(value):
+    """an aware datetime from epoch seconds or ISO 8601 (UTC if no offset), None if invalid"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value, dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        return None
+    if moment is not None and moment.tzinfo is None:
+        moment = moment.replace(tzinfo=dt_timezone.utc)
+    return moment
+
+
+def parse_events(events):
+    """(spot id, occupied, time) of the valid events, and the number of invalid ones"""
+    valid = []
+    for event in events:
+        if not isinstance(event, dict):
+            continue
+        spot, occupied, moment = event.get("spot"), event.get("occupied"), parse_time(event.get("ts"))
+        if isinstance(spot, int) and not isinstance(spot, bool) and isinstance(occupied, bool) and moment:
+            valid.append((spot, occupied, moment))
+    return valid, len(events) - len(valid)
+
+
+def apply_readings(readings):
+    """
+    Writes {spot id: (occupied, time)} to the spots, leaving those with a
+    newer reading alone. Returns the ids of the lots whose spots changed.
+
+    Sensors repeat their state every few seconds, so only the spots whose
+    occupancy flips are written in full (``is_available`` and
+    ``updated_at``). For the others only the reading time moves forward, so
+    a late reading taken before the repeat still loses to it, and their
+    lots are neither invalidated nor reported as changed.
+    """
+    spot_ids = sorted(readings)
+    updated = 0
+    lot_ids = set()
+    now = timezone.now()
+    with transaction.atomic():
+        for start in range(0, len(spot_ids), FLUSH_CHUNK):
+            chunk = spot_ids[start:start + FLUSH_CHUNK]
+            taken_at = Case(*[When(pk=spot, then=Value(readings[spot][1])) for spot in chunk],
+                            output_field=DateTimeField())
+            newer = ParkingSpot.objects.filter(pk__in=chunk).filter(
+                Q(occupancy_updated_at__isnull=True) | Q(occupancy_updated_at__lt=taken_at)
+            )
+            flipped, repeated = [], []
+            for spot, lot_id, is_available in newer.select_for_update().values_list("pk", "lot_id", "is_available"):
+                if is_available == readings[spot][0]:
+                    flipped.append(spot)
+                    lot_ids.add(lot_id)
+                else:
+                    repeated.append(spot)
+            if flipped:
+                occupied = [spot for spot in flipped if readings[spot][0]]
+                updated += ParkingSpot.objects.filter(pk__in=flipped).update(
+                    is_available=Case(When(pk__in=occupied, then=Value(False)), default=Value(True),
+                                      output_field=BooleanField()),
+                    occupancy_updated_at=taken_at,
+                    updated_at=now,
+                )
+            if repeated:
+                ParkingSpot.objects.filter(pk__in=repeated).update(occupancy_updated_at=taken_at)
+    SENSOR_SPOT_UPDATES.inc(updated)
+    return lot_ids
+
+
+class OccupancyBuffer:
+    """the latest reading of every spot heard from since the last flush"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.thread = None
+
+    def add(self, events):
+        """merges (spot id, occupied, time) events, returns how many spots are waiting"""
+        with self.lock:
+            for spot, occupied, moment in events:
+                current = self.pending.get(spot)
+                if current is None or moment >= current[1]:
+                    self.pending[spot] = (occupied, moment)
+            return len(self.pending)
+
+    def flush(self):
+        """writes the waiting readings; returns how many spots were written"""
+        with self.lock:
+            readings, self.pending = self.pending, {}
+        if not readings:
+            return 0
+        try:
+            lot_ids = apply_readings(readings)
+            lot_cache.bump_many(lot_ids)
+            live.notify(lot_ids)
+        except Exception:
+            # put them back unless newer readings arrived meanwhile
+            self.add((spot, occupied, moment) for spot, (occupied, moment) in readings.items())
+            raise
+        return len(readings)
+
+    def ensure_flusher(self, interval):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, args=(interval,), name="sensor-flush", daemon=True)
+                self.thread.start()
+
+    def run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("failed to flush sensor readings")
+            finally:
+                # this thread owns its own connection, let it expire like a request's would
+                close_old_connections()
+
+
+buffer = OccupancyBuffer()
+
+
+def flush_on_exit():
+    """writes the readings this process still holds, for gunicorn's worker_exit hook"""
+    try:
+        buffer.flush()
+    except Exception:
+        logger.exception("failed to flush sensor readings on exit")
+    finally:
+        connections.close_all()
+
+
+@csrf_exempt
+@require_POST
+@query_budget(5)  # only spent when the batch is flushed in the request
+def events_view(request):
+    token = getattr(settings, "SENSOR_TOKEN", "")
+    authorization = request.headers.get("Authorization", "").encode()
+    if not token or not hmac.compare_digest(authorization, f"Bearer {token}".encode()):
+        return HttpResponseForbidden()
+    try:
+        events = json.loads(request.body)["events"]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": 'Expected {"events": [...]}.'}, status=400)
+    if not isinstance(events, list) or len(events) > MAX_BATCH:
+        return JsonResponse({"error": f"events must be a list of at most {MAX_BATCH} events."}, status=400)
+
+    valid, invalid = parse_events(events)
+    SENSOR_EVENTS.labels("accepted").inc(len(valid))
+    SENSOR_EVENTS.labels("invalid").inc(invalid)
+    waiting = buffer.add(valid)
+
+    interval = getattr(settings, "SENSOR_FLUSH_INTERVAL", 1.0)
+    if not interval or waiting > getattr(settings, "SENSOR_MAX_PENDING", 10000):
+        buffer.flush()
+    else:
+        buffer.ensure_flusher(interval)
+    return JsonResponse({"accepted": len(valid), "invalid": invalid}, status=202)
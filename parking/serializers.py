@@ -1,7 +1,14 @@
+import codecs
+import csv
+from collections import Counter
 from datetime import  timedelta
+from itertools import islice
 from django.utils import timezone
 from rest_framework import serializers
+from . import provisioning
 from .models import ParkingLot, ParkingSpot, Booking, Vehicle, Payment
+from config.metrics import BOOKING_CONFLICTS
+from users.roles import get_motorist
 import re
 
 class VehicleSerializer(serializers.ModelSerializer):
@@ -45,7 +52,24 @@ class ParkingLotSerializer(serializers.ModelSerializer):
         read_only_fields = ("id", "created_at")
 
     def get_available_spots_count(self, obj):
-        return obj.spots.filter(is_available=True).count()
+        # counted from obj.spots.all() so a prefetch of the spots covers it too
+        return sum(1 for spot in obj.spots.all() if spot.is_available)
+
+
+class SyncLotSerializer(serializers.ModelSerializer):
+    """a lot in the delta sync (sync.py), whose spots are synced separately"""
+    operator_name = serializers.CharField(source="operator.company_name", read_only=True, default=None)
+
+    class Meta:
+        model = ParkingLot
+        fields = ("id", "name", "address", "latitude", "longitude", "operator_name", "opening_hours",
+                  "closing_hours", "is_active")
+
+
+class SyncSpotSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ParkingSpot
+        fields = ("id", "lot", "spot_number", "spot_type", "hourly_rate", "is_available")
 
 class BookingSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(read_only=True)
@@ -73,6 +97,7 @@ class BookingSerializer(serializers.ModelSerializer):
         # Check if the spot is available
         spot = data.get("parking_spot")
         if not spot.is_available:
+            BOOKING_CONFLICTS.labels("booking").inc()
             raise serializers.ValidationError("This parking spot is not currently available.")
 
         # Check for overlapping bookings
@@ -86,6 +111,7 @@ class BookingSerializer(serializers.ModelSerializer):
         ).exists()
 
         if overlapping_bookings:
+            BOOKING_CONFLICTS.labels("booking").inc()
             raise serializers.ValidationError("This parking spot is already booked for the selected time.")
 
         # Ensure the vehicle belongs to the user
@@ -132,6 +158,7 @@ class QuickBookingSerializer(serializers.Serializer):
             )
 
         if not parking_spot.is_available:
+            BOOKING_CONFLICTS.labels("quick_book").inc()
             raise serializers.ValidationError(
                 f"Spot {parking_spot.spot_number} is not available"
             )
@@ -145,6 +172,7 @@ class QuickBookingSerializer(serializers.Serializer):
         ).exists()
 
         if overlapping:
+            BOOKING_CONFLICTS.labels("quick_book").inc()
             raise serializers.ValidationError(
                 f"Spot {parking_spot.spot_number} is already booked for the selected time"
             )
@@ -160,11 +188,14 @@ class QuickBookingSerializer(serializers.Serializer):
 
     def create(self, validated_data):
         request = self.context['request']
+        motorist = get_motorist(request.user)
+        if motorist is None:
+            raise serializers.ValidationError("Only motorists can make bookings.")
 
         # Get or create vehicle with defaults
         vehicle, _ = Vehicle.objects.get_or_create(
             license_plate=validated_data["license_plate"],
-            user=request.user.motorist,
+            user=motorist,
             defaults={
                 'vehicle_type': 'sedan',
                 'make': 'Unknown',
@@ -175,7 +206,7 @@ class QuickBookingSerializer(serializers.Serializer):
 
         # Create booking with calculated cost
         booking = Booking.objects.create(
-            user=request.user.motorist,
+            user=motorist,
             parking_spot=validated_data["parking_spot"],
             vehicle=vehicle,
             phone_number=validated_data["phone_number"],
@@ -216,3 +247,114 @@ class PaymentSerializer(serializers.ModelSerializer):
         if amount <= 0:
             raise serializers.ValidationError("Amount must be a positive number.")
         return amount
+
+
+class SpotRangeSerializer(serializers.Serializer):
+    """spots `prefix` + `first` to `prefix` + `last`, e.g. A1 to A200"""
+    prefix = serializers.CharField(max_length=9, required=False, default="", allow_blank=True)
+    first = serializers.IntegerField(min_value=0)
+    last = serializers.IntegerField(min_value=0)
+
+    def validate(self, data):
+        if data["last"] < data["first"]:
+            raise serializers.ValidationError("last must not be smaller than first.")
+        if data["last"] - data["first"] >= provisioning.MAX_SPOTS:
+            raise serializers.ValidationError(f"At most {provisioning.MAX_SPOTS} spots at a time.")
+        if len(f"{data['prefix']}{data['last']}") > ParkingSpot._meta.get_field("spot_number").max_length:
+            raise serializers.ValidationError("Spot numbers would be too long.")
+        data["spot_numbers"] = provisioning.spot_numbers(data["prefix"], data["first"], data["last"])
+        return data
+
+
+class NewSpotsSerializer(SpotRangeSerializer):
+    spot_type = serializers.ChoiceField(choices=ParkingSpot.SPOT_TYPES, default="standard")
+    hourly_rate = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=1)
+
+
+class SpotRowSerializer(serializers.ModelSerializer):
+    """one row of an uploaded spot CSV"""
+    spot_type = serializers.ChoiceField(choices=ParkingSpot.SPOT_TYPES, default="standard")
+
+    class Meta:
+        model = ParkingSpot
+        fields = provisioning.CSV_COLUMNS
+        # uniqueness within the lot is checked for the whole upload at once
+        validators = []
+
+
+class SpotProvisionSerializer(serializers.Serializer):
+    """
+    New spots for a lot, as `ranges` or as an uploaded CSV `file` with a
+    spot_number,spot_type,hourly_rate header. Validated into `spots`.
+    """
+    ranges = NewSpotsSerializer(many=True, required=False, allow_empty=False)
+    file = serializers.FileField(required=False)
+
+    def validate_file(self, file):
+        try:
+            reader = csv.DictReader(codecs.iterdecode(file, "utf-8-sig"))
+            rows = list(islice(reader, provisioning.MAX_SPOTS + 1))
+        except (UnicodeDecodeError, csv.Error):
+            raise serializers.ValidationError("The file is not a UTF-8 CSV file.")
+        if reader.fieldnames is None or not {"spot_number", "hourly_rate"} <= set(reader.fieldnames):
+            raise serializers.ValidationError(f"The CSV header must be {','.join(provisioning.CSV_COLUMNS)}.")
+        if len(rows) > provisioning.MAX_SPOTS:
+            raise serializers.ValidationError(f"At most {provisioning.MAX_SPOTS} spots at a time.")
+        serializer = SpotRowSerializer(data=[
+            {column: value for column, value in row.items() if column in provisioning.CSV_COLUMNS and value}
+            for row in rows
+        ], many=True)
+        if not serializer.is_valid():
+            # a list, or only the invalid rows by index, depending on the DRF version
+            errors = serializer.errors
+            by_row = errors.items() if isinstance(errors, dict) else enumerate(errors)
+            raise serializers.ValidationError([
+                f"row {index + 2}, {field}: {' '.join(messages)}"
+                for index, row_errors in by_row for field, messages in row_errors.items()
+            ])
+        return serializer.validated_data
+
+    def validate(self, data):
+        if ("ranges" in data) == ("file" in data):
+            raise serializers.ValidationError("Send either ranges or a file.")
+        if "file" in data:
+            spots = data["file"]
+        else:
+            spots = [
+                {"spot_number": number, "spot_type": spot_range["spot_type"], "hourly_rate": spot_range["hourly_rate"]}
+                for spot_range in data["ranges"] for number in spot_range["spot_numbers"]
+            ]
+        if len(spots) > provisioning.MAX_SPOTS:
+            raise serializers.ValidationError(f"At most {provisioning.MAX_SPOTS} spots at a time.")
+        numbers = Counter(spot["spot_number"] for spot in spots)
+        repeated = sorted(number for number, count in numbers.items() if count > 1)
+        if repeated:
+            raise serializers.ValidationError({"spot_numbers": [f"Repeated: {', '.join(repeated[:20])}"]})
+        return {"spots": spots}
+
+
+class SpotChangeSerializer(serializers.Serializer):
+    """a new rate and/or type for the spots listed in `spot_numbers` or the range `prefix`, `first`, `last`"""
+    spot_numbers = serializers.ListField(child=serializers.CharField(max_length=10), required=False,
+                                         allow_empty=False, max_length=provisioning.MAX_SPOTS)
+    range = SpotRangeSerializer(required=False)
+    spot_type = serializers.ChoiceField(choices=ParkingSpot.SPOT_TYPES, required=False)
+    hourly_rate = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=1, required=False)
+
+    def validate(self, data):
+        if ("spot_numbers" in data) == ("range" in data):
+            raise serializers.ValidationError("Give either spot_numbers or a range.")
+        if "spot_type" not in data and "hourly_rate" not in data:
+            raise serializers.ValidationError("Nothing to change, give a spot_type or an hourly_rate.")
+        if "range" in data:
+            data["spot_numbers"] = data.pop("range")["spot_numbers"]
+        return data
+
+
+class SpotBulkUpdateSerializer(serializers.Serializer):
+    changes = SpotChangeSerializer(many=True, allow_empty=False)
+
+    def validate_changes(self, changes):
+        if sum(len(change["spot_numbers"]) for change in changes) > provisioning.MAX_SPOTS:
+            raise serializers.ValidationError(f"At most {provisioning.MAX_SPOTS} spots at a time.")
+        return changes
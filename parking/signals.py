@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import ParkingOperator
+from . import live, sync
+from .lot_cache import bump_many
+from .models import ParkingLot, ParkingSpot, Tombstone
+
+
+def bump_on_commit(lot_ids):
+    """bumps the cached payloads of `lot_ids` once the current transaction commits"""
+    # bumping earlier would let a reader cache the uncommitted rows' old state under the new version
+    lot_ids = set(lot_ids)
+    if lot_ids:
+        transaction.on_commit(lambda: bump_many(lot_ids))
+
+
+@receiver(pre_save, sender=ParkingLot)
+def lot_saving(sender, instance, raw=False, **kwargs):
+    # synced clients drop the spots of a deactivated lot and fetch them again once it's reactivated
+    instance._activity_changed = bool(
+        instance.pk and not raw
+        and ParkingLot.objects.filter(pk=instance.pk).exclude(is_active=instance.is_active).exists()
+    )
+
+
+@receiver([post_save, post_delete], sender=ParkingLot)
+def lot_changed(sender, instance, **kwargs):
+    bump_on_commit([instance.pk])
+    live.notify([instance.pk])
+    if getattr(instance, "_activity_changed", False):
+        sync.touch_spots([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=ParkingSpot)
+def spot_changed(sender, instance, **kwargs):
+    bump_on_commit([instance.lot_id])
+    live.notify([instance.lot_id])
+
+
+@receiver(post_delete, sender=ParkingLot)
+def lot_deleted(sender, instance, **kwargs):
+    Tombstone.objects.create(kind="lot", object_id=instance.pk)
+
+
+@receiver(post_delete, sender=ParkingSpot)
+def spot_deleted(sender, instance, origin=None, **kwargs):
+    # clients drop the spots of a deleted lot with it
+    if not isinstance(origin, ParkingLot):
+        Tombstone.objects.create(kind="spot", object_id=instance.pk)
+
+
+@receiver(post_save, sender=ParkingOperator)
+def operator_changed(sender, instance, update_fields=None, **kwargs):
+    """the lot payloads carry the operator's company name"""
+    if update_fields and "company_name" not in update_fields:
+        return
+    lots = ParkingLot.objects.filter(operator_id=instance.pk)
+    bump_on_commit(lots.values_list("id", flat=True))
+    # and so do the lots of the delta sync
+    lots.update(updated_at=timezone.now())
@@ -0,0 +1,148 @@
+"""
+Delta sync of the lot list, for clients that keep a copy of it offline.
+
+``GET /api/parking/lots/changes/`` without ``since`` pages through every
+active lot and every spot; with ``since=<token>`` it returns what changed
+after the token: lots and spots (by ``updated_at``), and under ``removed``
+the ids of lots that were deactivated or deleted and of spots that were
+deleted (see `Tombstone`) or whose lot was deactivated. Every page carries the token of the next one
+and ``has_more``; a client applies pages until ``has_more`` is false and
+keeps the last token for its next launch.
+
+Changes are ordered by (time, kind, id) and the token records the last one
+sent, so a page never skips or repeats a change, even when many share a
+timestamp. Only changes older than ``SYNC_SETTLE`` seconds are served:
+``updated_at`` is set before the writing transaction commits, and a change
+committed later than that with an earlier time would fall behind a token
+that was already handed out. For the same reason changes are always read
+from the primary.
+
+Tombstones are deleted by the ``tombstones`` purge (see purge.py); a token
+older than their retention gets a 410 and the client starts over.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ParkingLot, ParkingSpot, Tombstone
+from .purge import get_policy
+from .serializers import SyncLotSerializer, SyncSpotSerializer
+
+# kinds of change, in their order at the same time; END is past all of them
+LOTS, SPOTS, TOMBSTONES, END = range(4)
+
+
+class SyncError(ValueError):
+    """an invalid token or limit, reported to the client as a 400"""
+
+
+class TokenExpired(SyncError):
+    """a token older than the tombstones, reported as a 410"""
+
+
+def encode_token(key):
+    moment, kind, pk = key
+    return base64.urlsafe_b64encode(json.dumps([moment.isoformat(), kind, pk]).encode()).decode()
+
+
+def decode_token(token):
+    try:
+        moment, kind, pk = json.loads(base64.urlsafe_b64decode(token.encode()))
+        moment = datetime.fromisoformat(moment)
+    except (ValueError, TypeError, binascii.Error):
+        raise SyncError("Invalid since token.")
+    if timezone.is_naive(moment) or kind not in (LOTS, SPOTS, TOMBSTONES, END) or not isinstance(pk, int):
+        raise SyncError("Invalid since token.")
+    return moment, kind, pk
+
+
+def after(time_field, kind, cursor):
+    """rows of `kind` ordered after `cursor` by (time, kind, id)"""
+    moment, cursor_kind, pk = cursor
+    if kind > cursor_kind:
+        return Q(**{f"{time_field}__gte": moment})
+    if kind < cursor_kind:
+        return Q(**{f"{time_field}__gt": moment})
+    return Q(**{f"{time_field}__gt": moment}) | Q(**{time_field: moment, "pk__gt": pk})
+
+
+def changed(queryset, kind, time_field, cursor, settled):
+    """the rows of `queryset` past `cursor` and up to `settled`, in order"""
+    queryset = queryset.filter(**{f"{time_field}__lte": settled})
+    if cursor is not None:
+        queryset = queryset.filter(after(time_field, kind, cursor))
+    return queryset.order_by(time_field, "pk")
+
+
+def sources(cursor):
+    """(kind, time field, queryset) of everything that can change"""
+    lots = ParkingLot.objects.select_related("operator")
+    spots = ParkingSpot.objects.annotate(lot_is_active=F("lot__is_active"))
+    if cursor is None:
+        # nothing to remove yet on a first sync
+        return [
+            (LOTS, "updated_at", lots.filter(is_active=True)),
+            (SPOTS, "updated_at", spots.filter(lot__is_active=True)),
+        ]
+    return [(LOTS, "updated_at", lots), (SPOTS, "updated_at", spots), (TOMBSTONES, "deleted_at", Tombstone.objects)]
+
+
+def parse_params(params):
+    """(since, limit) of a changes request"""
+    limit = params.get("limit")
+    if limit is not None and not limit.isdigit():
+        raise SyncError("limit must be a number.")
+    return params.get("since") or None, int(limit) if limit else None
+
+
+def changes(since=None, limit=None):
+    """one page of the changes after the token `since`"""
+    page_size = getattr(settings, "SYNC_PAGE_SIZE", 500)
+    limit = limit or page_size
+    if not 1 <= limit <= page_size:
+        raise SyncError(f"limit must be between 1 and {page_size}.")
+    cursor = decode_token(since) if since else None
+    now = timezone.now()
+    if cursor is not None and cursor[0] < now - timedelta(minutes=get_policy("tombstones")["retention"]):
+        raise TokenExpired("since is older than the retained deletions, sync again without it.")
+    settled = now - timedelta(seconds=getattr(settings, "SYNC_SETTLE", 5))
+
+    rows = []
+    for kind, time_field, queryset in sources(cursor):
+        for row in changed(queryset, kind, time_field, cursor, settled)[:limit + 1]:
+            rows.append(((getattr(row, time_field), kind, row.pk), row))
+    rows.sort(key=lambda item: item[0])
+    page = rows[:limit]
+
+    by_kind = {LOTS: [], SPOTS: [], TOMBSTONES: []}
+    for (_, kind, _), row in page:
+        by_kind[kind].append(row)
+    lots = [lot for lot in by_kind[LOTS] if lot.is_active]
+    removed_lots = [lot.pk for lot in by_kind[LOTS] if not lot.is_active]
+    # deactivating a lot touches its spots (see signals.py), they are removed with it
+    spots = [spot for spot in by_kind[SPOTS] if spot.lot_is_active]
+    removed_spots = [spot.pk for spot in by_kind[SPOTS] if not spot.lot_is_active]
+    for tombstone in by_kind[TOMBSTONES]:
+        (removed_lots if tombstone.kind == "lot" else removed_spots).append(tombstone.object_id)
+
+    has_more = len(rows) > limit
+    # a complete page covers everything up to `settled`, the token moves there
+    # even when nothing changed, so it doesn't expire while the client polls
+    last = page[-1][0] if has_more else (settled, END, 0)
+    return {
+        "lots": SyncLotSerializer(lots, many=True).data,
+        "spots": SyncSpotSerializer(spots, many=True).data,
+        "removed": {"lots": removed_lots, "spots": removed_spots},
+        "next": encode_token(last),
+        "has_more": has_more,
+    }
+
+
+def touch_spots(lot_ids):
+    """marks the spots of `lot_ids` changed, so clients fetch them again"""
+    ParkingSpot.objects.filter(lot_id__in=lot_ids).update(updated_at=timezone.now())
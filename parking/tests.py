@@ -1,2 +1,1198 @@
+import csv
+import asyncio
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time as time_module
+from datetime import time, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
+from django.db.models.signals import post_delete
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from prometheus_client import REGISTRY
+
+from config.metrics import registry as metrics_registry
+from config.middleware import QueryBudgetExceeded, QueryInstrumentationMiddleware
+from config.replicas import reset_health
+from config.resilience import ProviderUnavailable, get_provider, reset_providers
+from users.models import OTP, Motorist, ParkingOperator, SMSJob
+from users.tokens import RoleRefreshToken
+from . import exports, live, lot_cache, rollups, sensors, sync
+from .models import ArchivedBooking, DailyLotStats, HourlyLotStats, ParkingLot, ParkingSpot, Vehicle, Booking, Payment
+from .archive import archive_bookings
+from .benchmark import build_scenarios, compare, run_in_process
+from .notifications import queue_booking_reminders
+from .purge import purge
+from .query_plans import HOT_QUERIES, full_scans
+from .views import ParkingLotViewSet
+from .reconciliation import Checkpoint, reconcile_payments
+from .seeding import DEFAULT_PASSWORD, seed
+from .utils import PaymentService
+
+
+class StubPaymentProvider:
+    """local stand-in for the payment gateway's status lookup"""
+
+    def __init__(self, outcomes=None, default="pending"):
+        self.outcomes = outcomes or {}
+        self.default = default
+        self.calls = []
+
+    def get_payment_status(self, reference):
+        self.calls.append(reference)
+        outcome = self.outcomes.get(reference, self.default)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class ParkingTestMixin:
+    """shared fixtures for a lot with a few spots and a motorist with a vehicle"""
+
+    def setUp(self):
+        super().setUp()
+        # cached lot payloads outlive the rolled back lots whose ids get reused
+        cache.clear()
+        self.operator = ParkingOperator.objects.create_user(
+            phone_number="255700000001", password="pass", first_name="Op",
+            company_name="Egesha", business_telephone="255700000001",
+            business_email="ops@example.com", address="Kariakoo", city="Dar",
+        )
+        self.motorist = Motorist.objects.create_user(
+            phone_number="255700000002", password="pass", first_name="Juma", last_name="Ali",
+        )
+        self.lot = ParkingLot.objects.create(
+            name="Kariakoo", address="Msimbazi St", operator=self.operator,
+            latitude="-6.817000", longitude="39.278000", total_spots=3,
+            opening_hours=time(6), closing_hours=time(22),
+        )
+        self.spots = [
+            ParkingSpot.objects.create(lot=self.lot, spot_number=f"A{i}", spot_type="standard", hourly_rate=1000)
+            for i in range(3)
+        ]
+        self.vehicle = Vehicle.objects.create(user=self.motorist, license_plate="T123ABC", vehicle_type="sedan")
+
+    def auth(self, user):
+        """request kwargs authenticating as `user`"""
+        return {"HTTP_AUTHORIZATION": f"Bearer {RoleRefreshToken.for_user(user).access_token}"}
+
+    def make_booking(self, spot=None, start=None, hours=1, status="confirmed"):
+        start = start or timezone.now() + timedelta(hours=1)
+        return Booking.objects.create(
+            user=self.motorist, parking_spot=spot or self.spots[0], vehicle=self.vehicle,
+            start_time=start, end_time=start + timedelta(hours=hours), status=status,
+        )
+
+
+class PaymentReconciliationTests(ParkingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.payments = []
+        for i, spot in enumerate(self.spots):
+            booking = self.make_booking(spot=spot)
+            payment = Payment.objects.create(amount=1000, phone_number="255700000002", transaction_id=f"TX{i}")
+            booking.add_payment(payment)
+            self.payments.append(payment)
+        # make them look like they have been waiting for a webhook for an hour
+        Payment.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+    def test_settles_stale_payments_and_activates_bookings(self):
+        provider = StubPaymentProvider({"TX0": "completed", "TX1": "failed"})
+
+        stats = reconcile_payments(provider, batch_size=2, workers=2, rate=0)
+
+        self.assertEqual(stats["checked"], 3)
+        self.assertEqual((stats["completed"], stats["failed"], stats["pending"]), (1, 1, 1))
+        self.assertEqual(Payment.objects.get(transaction_id="TX0").status, "completed")
+        self.assertEqual(Payment.objects.get(transaction_id="TX1").status, "failed")
+        self.assertEqual(Payment.objects.get(transaction_id="TX2").status, "pending")
+        self.assertEqual(Booking.objects.get(payment=self.payments[0]).status, "active")
+
+    def test_recent_payments_are_left_alone(self):
+        Payment.objects.filter(transaction_id="TX2").update(created_at=timezone.now())
+        provider = StubPaymentProvider(default="completed")
+
+        reconcile_payments(provider, rate=0)
+
+        self.assertEqual(sorted(provider.calls), ["TX0", "TX1"])
+
+    def test_provider_errors_are_counted_not_applied(self):
+        provider = StubPaymentProvider({"TX0": ConnectionError("down")}, default="completed")
+
+        with self.assertLogs("parking.reconciliation", "ERROR"):
+            stats = reconcile_payments(provider, rate=0)
+
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(Payment.objects.get(transaction_id="TX0").status, "pending")
+
+    def test_resumes_from_checkpoint(self):
+        path = os.path.join(tempfile.mkdtemp(), "reconcile.json")
+        provider = StubPaymentProvider(default="completed")
+
+        reconcile_payments(provider, batch_size=1, rate=0, limit=2, checkpoint=Checkpoint(path))
+        self.assertTrue(os.path.exists(path))
+
+        reconcile_payments(provider, batch_size=1, rate=0, checkpoint=Checkpoint(path))
+
+        self.assertEqual(len(provider.calls), 3)
+        self.assertFalse(Payment.objects.filter(status="pending").exists())
+        self.assertFalse(os.path.exists(path))
+
+
+class BookingNotificationTests(ParkingTestMixin, TestCase):
+    def test_reminders_share_text_and_are_queued_once(self):
+        start = (timezone.now() + timedelta(minutes=20)).replace(second=0, microsecond=0)
+        for spot in self.spots[:2]:
+            self.make_booking(spot=spot, start=start)
+        self.make_booking(spot=self.spots[2], start=start + timedelta(hours=3))
+
+        self.assertEqual(queue_booking_reminders(), 2)
+        self.assertEqual(queue_booking_reminders(), 0)
+
+        jobs = SMSJob.objects.all()
+        self.assertEqual(jobs.count(), 2)
+        self.assertEqual(len({job.message for job in jobs}), 1)
+        self.assertEqual({job.phone_number for job in jobs}, {self.motorist.phone_number})
+
+
+class RoleAwareViewTests(ParkingTestMixin, TestCase):
+    def test_motorist_can_add_a_vehicle(self):
+        response = self.client.post("/api/parking/vehicles/", {"license_plate": "T999XYZ", "vehicle_type": "suv"},
+                                    **self.auth(self.motorist))
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Vehicle.objects.get(license_plate="T999XYZ").user, self.motorist)
+
+    def test_operator_cannot_book(self):
+        start = timezone.now() + timedelta(hours=1)
+        response = self.client.post("/api/parking/bookings/quick-book/", {
+            "license_plate": "T1", "phone_number": "0712345678", "parking_lot": self.lot.pk,
+            "parking_spot": self.spots[0].pk, "start_time": start.isoformat(),
+            "end_time": (start + timedelta(hours=1)).isoformat(),
+        }, **self.auth(self.operator))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Booking.objects.exists())
+
+
+class PurgeTests(ParkingTestMixin, TestCase):
+    def test_stale_unpaid_bookings_are_deleted_in_batches(self):
+        stale = [self.make_booking(spot, status="pending") for spot in self.spots]
+        paid = stale.pop()
+        paid.add_payment(Payment.objects.create(
+            amount=1000, phone_number="255700000002", transaction_id="TX-paid", status="completed",
+        ))
+        fresh = self.make_booking(self.spots[0], start=timezone.now() + timedelta(days=1), status="pending")
+        Booking.objects.exclude(id=fresh.id).update(booking_time=timezone.now() - timedelta(days=2))
+
+        deleted, _ = purge("pending_bookings", batch_size=1, pause=0, retention=60 * 24)
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(set(Booking.objects.values_list("id", flat=True)), {paid.id, fresh.id})
+
+    def test_expired_otps_and_sessions_are_deleted(self):
+        now = timezone.now()
+        OTP.objects.create(phone_number="255700000002", code_hash="a", expires_at=now - timedelta(minutes=1))
+        OTP.objects.create(phone_number="255700000002", code_hash="b", expires_at=now + timedelta(minutes=5))
+        Session.objects.create(session_key="old", session_data="", expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key="new", session_data="", expire_date=now + timedelta(days=1))
+
+        output = StringIO()
+        call_command("purge_expired", "otps", "sessions", retention=0, pause=0, stdout=output)
+
+        self.assertEqual(list(OTP.objects.values_list("code_hash", flat=True)), ["b"])
+        self.assertEqual(list(Session.objects.values_list("session_key", flat=True)), ["new"])
+        self.assertIn("otps: deleted 1 rows", output.getvalue())
+
+    def test_finished_sms_jobs_are_deleted(self):
+        old = timezone.now() - timedelta(days=2)
+        for status in ("sent", "dead", "queued"):
+            SMSJob.objects.create(phone_number="255700000002", message="", status=status, available_at=old)
+        SMSJob.objects.create(phone_number="255700000002", message="", status="sent")
+
+        deleted, _ = purge("sms_jobs", pause=0)
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(sorted(SMSJob.objects.values_list("status", flat=True)), ["queued", "sent"])
+
+    def test_limit_caps_a_sweep(self):
+        past = timezone.now() - timedelta(days=2)
+        OTP.objects.bulk_create(OTP(phone_number="255700000002", expires_at=past) for _ in range(5))
+
+        deleted, _ = purge("otps", batch_size=2, pause=0, limit=3)
+
+        self.assertEqual(deleted, 3)
+        self.assertEqual(OTP.objects.count(), 2)
+
+
+class ArchiveTests(ParkingTestMixin, TestCase):
+    def paid_booking(self, days_ago, status="completed", payment_status="completed"):
+        booking = self.make_booking(start=timezone.now() - timedelta(days=days_ago), status=status)
+        booking.add_payment(Payment.objects.create(
+            amount=1000, phone_number="255700000002", transaction_id=f"TX-{booking.id}", status=payment_status,
+        ))
+        return booking
+
+    def test_finished_bookings_move_with_their_payments(self):
+        old = [self.paid_booking(200), self.paid_booking(150, status="cancelled", payment_status="failed")]
+        kept = [
+            self.paid_booking(10),
+            self.paid_booking(120, status="confirmed"),
+            self.paid_booking(130, status="cancelled", payment_status="pending"),
+        ]
+
+        output = StringIO()
+        call_command("archive_bookings", age=90, batch_size=1, pause=0, stdout=output)
+
+        self.assertIn("archived 2 bookings", output.getvalue())
+        self.assertEqual(set(Booking.objects.values_list("id", flat=True)), {booking.id for booking in kept})
+        archived = ArchivedBooking.objects.select_related("payment").order_by("start_time")
+        self.assertEqual([booking.id for booking in archived], [booking.id for booking in old])
+        self.assertEqual([booking.payment.transaction_id for booking in archived],
+                         [f"TX-{booking.id}" for booking in old])
+        self.assertFalse(Payment.objects.filter(transaction_id__in=[f"TX-{booking.id}" for booking in old]).exists())
+
+    def test_history_spans_live_and_archived_bookings(self):
+        archived = self.paid_booking(200)
+        live = self.make_booking()
+        archive_bookings(age=90, pause=0)
+
+        response = self.client.get("/api/parking/bookings/", **self.auth(self.motorist))
+        self.assertEqual([booking["id"] for booking in response.json()], [live.id, archived.id])
+        self.assertEqual(response.json()[1]["parking_lot"]["name"], "Kariakoo")
+
+        response = self.client.get(f"/api/parking/bookings/{archived.id}/", **self.auth(self.motorist))
+        self.assertEqual((response.status_code, response.json()["status"]), (200, "completed"))
+        response = self.client.get(f"/api/parking/bookings/{archived.id}/", **self.auth(self.operator))
+        self.assertEqual(response.status_code, 404)
+
+    def test_partitioning_needs_postgresql(self):
+        if connection.vendor == "postgresql":
+            self.skipTest("partitioning is supported here")
+        with self.assertRaisesMessage(CommandError, "range partitioning needs PostgreSQL"):
+            call_command("archive_bookings", partition=True, stdout=StringIO())
+
+
+class QueryPlanTests(TestCase):
+    def full_scans(self, queryset):
+        scans = full_scans(queryset)
+        if scans is None:
+            self.skipTest(f"no plan check for {connection.vendor}")
+        return scans
+
+    def test_hot_queries_are_answered_from_indexes(self):
+        for name, build in HOT_QUERIES.items():
+            with self.subTest(name):
+                self.assertEqual(self.full_scans(build()), [])
+
+    def test_full_scans_are_reported(self):
+        self.assertEqual(self.full_scans(OTP.objects.filter(code_hash="0" * 64)), ["users_otp"])
+
+    def test_unknown_databases_get_no_verdict(self):
+        with mock.patch.dict("parking.query_plans.FULL_SCAN", clear=True):
+            self.assertIsNone(full_scans(OTP.objects.all()))
+
+
+class StubCheckout:
+    """PaymentService stand-in for the async payment view"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def ainitiate_payment(self, phone_number, amount, booking, client):
+        self.calls.append((phone_number, amount, booking))
+        return {"success": True, "transaction_id": "TX-async", "external_id": str(booking)}
+
+
+class AsyncViewTests(ParkingTestMixin, TestCase):
+    def test_lot_list_query_count_does_not_grow_with_lots(self):
+        for i in range(5):
+            lot = ParkingLot.objects.create(
+                name=f"Lot {i}", address="Msimbazi St", operator=self.operator,
+                latitude="-6.817000", longitude="39.278000", total_spots=1,
+                opening_hours=time(6), closing_hours=time(22),
+            )
+            ParkingSpot.objects.create(lot=lot, spot_number="A0", spot_type="standard", hourly_rate=1000)
+
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/parking/lots/")
+
+        self.assertEqual(len(response.json()), 6)
+        kariakoo = next(lot for lot in response.json() if lot["id"] == self.lot.id)
+        self.assertEqual(kariakoo["operator_name"], "Egesha")
+        self.assertEqual(kariakoo["available_spots_count"], 3)
+
+    async def test_search_and_availability(self):
+        await ParkingSpot.objects.filter(pk=self.spots[0].pk).aupdate(is_available=False)
+
+        response = await self.async_client.get(
+            "/api/parking/lots/search/", {"q": "kariakoo", "lat": "-6.817", "lon": "39.278"})
+        self.assertEqual([lot["id"] for lot in response.json()], [self.lot.id])
+
+        response = await self.async_client.get("/api/parking/lots/search/", {"lat": "x", "lon": "39.278"})
+        self.assertEqual(response.status_code, 400)
+
+        response = await self.async_client.get(f"/api/parking/lots/{self.lot.pk}/available-spots/")
+        self.assertEqual([spot["spot_number"] for spot in response.json()], ["A1", "A2"])
+
+        response = await self.async_client.get("/api/parking/lots/999/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_booking_list_requires_authentication(self):
+        booking = self.make_booking()
+
+        self.assertEqual(self.client.get("/api/parking/bookings/").status_code, 401)
+        response = self.client.get("/api/parking/bookings/", **self.auth(self.motorist))
+
+        self.assertEqual([item["id"] for item in response.json()], [booking.id])
+        self.assertEqual(response.json()[0]["parking_lot"]["name"], "Kariakoo")
+
+    def test_writes_still_go_to_the_viewsets(self):
+        response = self.client.patch(f"/api/parking/lots/{self.lot.pk}/", {"name": "Kariakoo Market"},
+                                     content_type="application/json", **self.auth(self.operator))
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.lot.refresh_from_db()
+        self.assertEqual(self.lot.name, "Kariakoo Market")
+
+    def test_payment_is_initiated_asynchronously(self):
+        booking = self.make_booking()
+        checkout = StubCheckout()
+
+        with mock.patch("parking.async_views.PaymentService", return_value=checkout):
+            response = self.client.post("/api/parking/payments/", {
+                "booking_id": booking.id, "phone_number": "0712345678",
+            }, content_type="application/json", **self.auth(self.motorist))
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(checkout.calls, [("255712345678", booking.cost, booking.id)])
+        booking.refresh_from_db()
+        self.assertEqual((booking.status, booking.payment.transaction_id), ("active", "TX-async"))
+
+
+    def test_gateway_outage_during_checkout_is_a_503(self):
+        reset_providers()
+        self.addCleanup(reset_providers)
+        booking = self.make_booking()
+        with mock.patch("parking.utils.Azampay", return_value=mock.Mock(BASE_URL="https://azampay.test", headers={})):
+            service = PaymentService()
+        breaker = get_provider("azampay").breaker
+        breaker.state, breaker.opened_at = breaker.OPEN, time_module.monotonic()
+
+        with self.assertRaises(ProviderUnavailable):
+            service.initiate_payment("0712345678", booking.cost, booking.id)
+        with mock.patch("parking.async_views.PaymentService", return_value=service):
+            response = self.client.post("/api/parking/payments/", {
+                "booking_id": booking.id, "phone_number": "0712345678",
+            }, content_type="application/json", **self.auth(self.motorist))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], str(breaker.reset_timeout))
+
+
+class QueryInstrumentationTests(ParkingTestMixin, TestCase):
+    def test_server_timing_reports_the_queries(self):
+        response = self.client.get(f"/api/parking/lots/{self.lot.pk}/available-spots/")
+
+        self.assertIn('desc="2 queries"', response["Server-Timing"])
+
+    async def test_async_view_queries_are_counted(self):
+        token = RoleRefreshToken.for_user(self.motorist).access_token
+        response = await self.async_client.get("/api/parking/bookings/", headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response["Server-Timing"], r'desc="[1-9]\d* queries"')
+
+    def test_over_budget_fails_the_test_run(self):
+        view = resolve("/api/parking/lots/").func
+        with mock.patch.object(view, "query_budget", 1), self.assertRaises(QueryBudgetExceeded):
+            self.client.get("/api/parking/lots/")
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_over_budget_is_logged_in_production(self):
+        with mock.patch.object(ParkingLotViewSet, "query_budget", {"partial_update": 1}), \
+                self.assertLogs("config.middleware", "WARNING") as logs:
+            response = self.client.patch(f"/api/parking/lots/{self.lot.pk}/", {"name": "Kariakoo Market"},
+                                         content_type="application/json", **self.auth(self.operator))
+
+        self.assertEqual(response.status_code, 200)
+        record = json.loads(logs.records[0].args[0])
+        self.assertEqual((record["view"], record["budget"]), ("parkinglot-detail", 1))
+        self.assertGreater(record["queries"], 1)
+
+    def test_repeated_statements_are_reported(self):
+        def view(request):
+            for spot in self.spots:
+                ParkingSpot.objects.get(pk=spot.pk)
+            return HttpResponse()
+
+        middleware = QueryInstrumentationMiddleware(view)
+        with self.assertLogs("config.middleware", "DEBUG") as logs:
+            middleware(RequestFactory().get("/"))
+
+        record = json.loads(logs.records[0].args[0])
+        self.assertEqual(record["queries"], 3)
+        self.assertEqual(record["duplicates"][0]["count"], 3)
+
+
+class MetricsTests(ParkingTestMixin, TestCase):
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def quick_book(self, spot):
+        start = timezone.now() + timedelta(hours=1)
+        return self.client.post("/api/parking/bookings/quick-book/", {
+            "license_plate": "T123ABC", "phone_number": "0712345678", "parking_lot": self.lot.pk,
+            "parking_spot": spot.pk, "start_time": start.isoformat(),
+            "end_time": (start + timedelta(hours=1)).isoformat(),
+        }, **self.auth(self.motorist))
+
+    def test_requests_are_timed_per_route_and_status(self):
+        labels = {"method": "GET", "route": "parkinglot-list", "status": "200"}
+        before = self.sample("http_request_duration_seconds_count", **labels)
+        queries = self.sample("http_request_db_queries_sum", route="parkinglot-list")
+
+        self.client.get("/api/parking/lots/")
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_request_duration_seconds_count{method="GET",route="parkinglot-list",status="200"}',
+                      response.content)
+        self.assertEqual(self.sample("http_request_duration_seconds_count", **labels), before + 1)
+        self.assertEqual(self.sample("http_request_db_queries_sum", route="parkinglot-list"), queries + 2)
+
+    def test_bookings_and_conflicts_are_counted(self):
+        created = self.sample("bookings_created_total", channel="quick_book")
+        conflicts = self.sample("booking_conflicts_total", channel="quick_book")
+
+        self.assertEqual(self.quick_book(self.spots[0]).status_code, 201)
+        self.assertEqual(self.quick_book(self.spots[0]).status_code, 400)
+
+        self.assertEqual(self.sample("bookings_created_total", channel="quick_book"), created + 1)
+        self.assertEqual(self.sample("booking_conflicts_total", channel="quick_book"), conflicts + 1)
+
+    def test_payment_outcomes_are_counted(self):
+        succeeded = self.sample("payment_initiations_total", outcome="success")
+        completed = self.sample("payment_webhooks_total", outcome="completed")
+        booking = self.make_booking()
+
+        with mock.patch("parking.async_views.PaymentService", return_value=StubCheckout()):
+            self.client.post("/api/parking/payments/", {"booking_id": booking.id, "phone_number": "0712345678"},
+                             content_type="application/json", **self.auth(self.motorist))
+        Payment.objects.update(status="pending")
+        self.client.post("/api/parking/payments/webhook/", {
+            "externalId": str(booking.id), "transactionStatus": "success",
+        }, content_type="application/json", **self.auth(self.motorist))
+
+        self.assertEqual(self.sample("payment_initiations_total", outcome="success"), succeeded + 1)
+        self.assertEqual(self.sample("payment_webhooks_total", outcome="completed"), completed + 1)
+
+    @override_settings(METRICS_TOKEN="scraper")
+    def test_metrics_can_require_a_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scraper").status_code, 200)
+
+    def test_workers_are_added_up_in_multiprocess_mode(self):
+        script = "from prometheus_client import Counter; Counter('worker_jobs', 'jobs').inc(2)"
+        with tempfile.TemporaryDirectory() as directory:
+            env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": directory}
+            for _ in range(3):
+                subprocess.run([sys.executable, "-c", script], env=env, check=True)
+
+            with mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory}):
+                self.assertEqual(metrics_registry().get_sample_value("worker_jobs_total"), 6)
+
+
+@override_settings(REPLICA_DATABASES=["replica"])
+class ReplicaRoutingTests(ParkingTestMixin, TestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        super().setUp()
+        reset_health()
+        self.addCleanup(reset_health)
+        # the replica is behind: the lot still has its old name and there are no bookings yet
+        for obj in (self.operator, self.motorist, self.lot, *self.spots, self.vehicle):
+            obj.save(using="replica")
+        ParkingLot.objects.using("replica").filter(pk=self.lot.pk).update(name="Kariakoo (old)")
+
+    def quick_book(self, headers):
+        start = timezone.now() + timedelta(hours=1)
+        return self.client.post("/api/parking/bookings/quick-book/", {
+            "license_plate": "T123ABC", "phone_number": "0712345678", "parking_lot": self.lot.pk,
+            "parking_spot": self.spots[0].pk, "start_time": start.isoformat(),
+            "end_time": (start + timedelta(hours=1)).isoformat(),
+        }, **headers)
+
+    def test_lot_reads_come_from_the_replica(self):
+        self.assertEqual(self.client.get("/api/parking/lots/").json()[0]["name"], "Kariakoo (old)")
+        response = self.client.get("/api/parking/lots/search/?lat=-6.817&lon=39.278&radius=5")
+        self.assertEqual(response.json()[0]["name"], "Kariakoo (old)")
+
+    def test_cached_lot_payloads_are_computed_from_the_primary(self):
+        response = self.client.get(f"/api/parking/lots/{self.lot.pk}/", **self.auth(self.motorist))
+        self.assertEqual(response.json()["name"], "Kariakoo")
+
+    def test_writer_reads_their_own_writes(self):
+        motorist, operator = self.auth(self.motorist), self.auth(self.operator)
+        self.assertEqual(self.client.get("/api/parking/bookings/", **motorist).json(), [])
+
+        self.assertEqual(self.quick_book(motorist).status_code, 201)
+
+        self.assertEqual(len(self.client.get("/api/parking/bookings/", **motorist).json()), 1)
+        self.assertFalse(Booking.objects.using("replica").exists())
+        # other clients keep reading from the replica
+        self.assertEqual(self.client.get("/api/parking/lots/", **operator).json()[0]["name"], "Kariakoo (old)")
+
+    def test_pin_expires(self):
+        motorist = self.auth(self.motorist)
+        with override_settings(REPLICA_PIN_SECONDS=0.01):
+            self.quick_book(motorist)
+        time_module.sleep(0.05)
+
+        self.assertEqual(self.client.get("/api/parking/bookings/", **motorist).json(), [])
+
+    def test_a_new_login_reads_from_the_primary(self):
+        # only on the primary, like a motorist who registered a moment ago
+        Motorist.objects.create_user(phone_number="255712000009", password="pass", first_name="New")
+        cache.clear()
+        tokens = self.client.post("/api/auth/login/", {"phone_number": "255712000009", "password": "pass"}).json()
+
+        response = self.client.get("/api/parking/bookings/", HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+
+        self.assertEqual((response.status_code, response.json()), (200, []))
+
+    def test_unhealthy_replica_is_skipped_until_the_next_check(self):
+        with mock.patch("config.replicas.replica_lag", side_effect=OperationalError("unreachable")) as probe:
+            self.assertEqual(self.client.get("/api/parking/lots/").json()[0]["name"], "Kariakoo")
+            self.assertEqual(self.client.get("/api/parking/lots/").json()[0]["name"], "Kariakoo")
+        self.assertEqual(probe.call_count, 1)
+
+        with mock.patch("config.replicas.replica_lag", return_value=120), \
+                override_settings(REPLICA_HEALTH_INTERVAL=0):
+            self.assertEqual(self.client.get("/api/parking/lots/").json()[0]["name"], "Kariakoo")
+
+    def test_other_views_read_from_the_primary(self):
+        booking = self.make_booking()
+        response = self.client.get(f"/api/parking/bookings/{booking.pk}/", **self.auth(self.motorist))
+        self.assertEqual(response.status_code, 200)
+
+
+class LotCacheTests(ParkingTestMixin, TestCase):
+    def key(self, name):
+        return f"lot:{self.lot.pk}:{lot_cache.get_version(self.lot.pk)}:{name}"
+
+    def test_hits_run_no_queries(self):
+        url = f"/api/parking/lots/{self.lot.pk}/available-spots/?spot_type=standard"
+        self.assertEqual(len(self.client.get(url).json()), 3)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get(url).json()), 3)
+
+    def test_writes_invalidate_the_lot(self):
+        url = f"/api/parking/lots/{self.lot.pk}/"
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.spots[0].is_available = False
+            self.spots[0].save()
+        self.assertEqual(self.client.get(url).json()["available_spots_count"], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.operator.company_name = "Egesha Ltd"
+            self.operator.save()
+        self.assertEqual(self.client.get(url).json()["operator_name"], "Egesha Ltd")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lot.is_active = False
+            self.lot.save()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_reads_during_a_write_are_not_cached_under_the_new_version(self):
+        url = f"/api/parking/lots/{self.lot.pk}/"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.spots[0].is_available = False
+            self.spots[0].save()
+            # another worker still sees the committed rows and caches them while the write is open
+            cache.set(self.key("detail"), (time_module.time() + 60, {"available_spots_count": 3}))
+
+        self.assertEqual(self.client.get(url).json()["available_spots_count"], 2)
+
+    def test_stale_payload_is_served_while_another_reader_refreshes_it(self):
+        compute = mock.Mock(side_effect=["old", "new"])
+        with override_settings(LOT_CACHE_TTL=0):
+            self.assertEqual(lot_cache.read_through(self.lot.pk, "test", compute), "old")
+
+            cache.add(f"{self.key('test')}:lock", 1)
+            self.assertEqual(lot_cache.read_through(self.lot.pk, "test", compute), "old")
+
+            cache.delete(f"{self.key('test')}:lock")
+            self.assertEqual(lot_cache.read_through(self.lot.pk, "test", compute), "new")
+        self.assertEqual(compute.call_count, 2)
+
+    def test_concurrent_misses_compute_once(self):
+        compute = mock.Mock(return_value="computed")
+        cache.add(f"{self.key('test')}:lock", 1)
+        # the reader holding the lock stores its result while the second one waits
+        writer = threading.Timer(0.1, cache.set, [self.key("test"), (time_module.time() + 60, "stored")])
+        writer.start()
+        self.addCleanup(writer.join)
+
+        self.assertEqual(lot_cache.read_through(self.lot.pk, "test", compute), "stored")
+        compute.assert_not_called()
+
+
+class RollupTests(ParkingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.start = (timezone.now() + timedelta(days=1)).replace(hour=10, minute=30, second=0, microsecond=0)
+
+    def book_and_pay(self, spot, hours=2):
+        start = self.start.isoformat()
+        response = self.client.post("/api/parking/bookings/quick-book/", {
+            "license_plate": "T123ABC", "phone_number": "0712345678", "parking_lot": self.lot.pk,
+            "parking_spot": spot.pk, "start_time": start,
+            "end_time": (self.start + timedelta(hours=hours)).isoformat(),
+        }, **self.auth(self.motorist))
+        booking = Booking.objects.get(pk=response.json()["id"])
+        booking.add_payment(Payment.objects.create(
+            amount=booking.cost, phone_number="255712345678", transaction_id=f"TX{booking.pk}",
+            external_id=f"EX{booking.pk}",
+        ))
+        self.client.post("/api/parking/payments/webhook/", {
+            "externalId": f"EX{booking.pk}", "transactionStatus": "success",
+        }, content_type="application/json", **self.auth(self.motorist))
+        return booking
+
+    def rollups(self):
+        return (sorted(HourlyLotStats.objects.values_list("lot_id", "hour", *rollups.COUNTERS)),
+                sorted(DailyLotStats.objects.values_list("lot_id", "day", *rollups.COUNTERS)))
+
+    def test_bookings_and_payments_update_the_rollups(self):
+        self.book_and_pay(self.spots[0])
+        self.book_and_pay(self.spots[1])
+
+        start_hour = self.start.replace(minute=0)
+        occupied = dict(HourlyLotStats.objects.filter(hour__gte=start_hour).values_list("hour", "occupied_seconds"))
+        self.assertEqual(occupied, {
+            start_hour: 2 * 1800, start_hour + timedelta(hours=1): 2 * 3600, start_hour + timedelta(hours=2): 2 * 1800,
+        })
+        self.assertEqual(HourlyLotStats.objects.get(hour=start_hour).revenue, 2 * 2000)
+        day = DailyLotStats.objects.get(day=self.start.date())
+        self.assertEqual((day.occupied_seconds, day.revenue), (4 * 3600, 4000))
+        self.assertEqual(DailyLotStats.objects.get(day=timezone.localdate()).bookings, 2)
+
+    def test_backfill_rebuilds_the_same_rollups(self):
+        self.book_and_pay(self.spots[0])
+        self.book_and_pay(self.spots[1], hours=5)
+        archived = self.book_and_pay(self.spots[2])
+        archived.status = "completed"
+        archived.save()
+        archive_bookings(age=-2)
+        expected = self.rollups()
+        HourlyLotStats.objects.update(bookings=0, revenue=0)
+
+        call_command("backfill_rollups", stdout=StringIO())
+
+        self.assertEqual(self.rollups(), expected)
+
+    def test_archiving_leaves_the_rollups_unchanged(self):
+        booking = self.book_and_pay(self.spots[0])
+        booking.status = "completed"
+        booking.save()
+        expected = self.rollups()
+        deleted = mock.Mock()
+        post_delete.connect(deleted)
+        self.addCleanup(post_delete.disconnect, deleted)
+
+        self.assertEqual(archive_bookings(age=-2)[0], 1)
+
+        self.assertEqual(self.rollups(), expected)
+        deleted.assert_not_called()
+
+    def test_dashboard_reads_the_rollups(self):
+        self.book_and_pay(self.spots[0])
+        operator = self.auth(self.operator)
+        day = self.start.date().isoformat()
+
+        response = self.client.get(f"/api/parking/stats/{self.lot.pk}/?granularity=hour&start={day}&end={day}",
+                                   **operator)
+        results = response.json()["results"]
+        self.assertEqual(len(results), 24)
+        self.assertEqual(results[10], {
+            "period": self.start.replace(minute=0).isoformat().replace("+00:00", "Z"),
+            "bookings": 0, "occupied_seconds": 1800, "revenue": 2000, "occupancy": round(1800 / (3 * 3600), 4),
+        })
+
+        totals = self.client.get(f"/api/parking/stats/?end={day}", **operator).json()["results"]
+        self.assertEqual([(row["lot"], row["bookings"], row["revenue"]) for row in totals], [(self.lot.pk, 1, 2000)])
+
+    def test_dashboard_is_limited_to_the_operators_own_lots(self):
+        other = ParkingOperator.objects.create_user(
+            phone_number="255700000009", password="pass", company_name="Other", business_telephone="255700000009",
+            business_email="other@example.com", address="Posta", city="Dar",
+        )
+        self.assertEqual(self.client.get(f"/api/parking/stats/{self.lot.pk}/", **self.auth(other)).status_code, 404)
+        self.assertEqual(self.client.get("/api/parking/stats/", **self.auth(self.motorist)).status_code, 403)
+        response = self.client.get("/api/parking/stats/?start=2025-01-01&end=2026-06-01", **self.auth(self.operator))
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTests(ParkingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.bookings = [self.make_booking(spot=spot) for spot in self.spots]
+        for booking in self.bookings:
+            booking.add_payment(Payment.objects.create(
+                amount=1000, phone_number="255700000002", transaction_id=f"TX{booking.pk}", status="completed",
+            ))
+        self.bookings[0].status = "completed"
+        self.bookings[0].save()
+        archive_bookings(age=-2)
+        other = ParkingLot.objects.create(
+            name="Posta", address="Azikiwe St", operator=self.operator, latitude="-6.816000",
+            longitude="39.289000", total_spots=1, opening_hours=time(6), closing_hours=time(22),
+        )
+        self.make_booking(spot=ParkingSpot.objects.create(lot=other, spot_number="B0", hourly_rate=500))
+
+    def test_bookings_stream_as_csv(self):
+        response = self.client.get(f"/api/parking/exports/bookings/?lot={self.lot.pk}", **self.auth(self.operator))
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertIn("attachment", response["Content-Disposition"])
+        rows = list(csv.DictReader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(sorted(int(row["id"]) for row in rows), sorted(booking.pk for booking in self.bookings))
+        self.assertEqual({row["lot"] for row in rows}, {"Kariakoo"})
+
+    def test_payments_stream_as_gzipped_ndjson(self):
+        response = self.client.get("/api/parking/exports/payments/?format=ndjson&gzip=1", **self.auth(self.operator))
+
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        lines = gzip.decompress(b"".join(response.streaming_content)).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(sorted(row["booking_id"] for row in rows), sorted(booking.pk for booking in self.bookings))
+        self.assertEqual({row["amount"] for row in rows}, {1000})
+
+    async def test_asgi_exports_stream_from_the_async_orm(self):
+        token = await sync_to_async(lambda: str(RoleRefreshToken.for_user(self.operator).access_token))()
+        response = await self.async_client.get("/api/parking/exports/bookings/?format=ndjson",
+                                               headers={"Authorization": f"Bearer {token}"})
+
+        self.assertTrue(response.is_async)
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content.decode().splitlines()), 4)
+
+    def test_rows_are_encoded_a_chunk_at_a_time(self):
+        encoder = exports.Encoder("csv", exports.BOOKING_COLUMNS)
+        chunks = list(exports.stream(exports.bookings([self.lot.pk]), encoder, chunk_size=1))
+
+        # header, one chunk per live and archived booking, end
+        self.assertEqual(len(chunks), 5)
+
+    def test_invalid_requests_get_json_errors(self):
+        response = self.client.get("/api/parking/exports/bookings/?start=2025-02-01&end=2025-01-01",
+                                   **self.auth(self.operator))
+        self.assertEqual((response.status_code, response["Content-Type"]), (400, "application/json"))
+        response = self.client.get("/api/parking/exports/bookings/", **self.auth(self.motorist))
+        self.assertEqual((response.status_code, response["Content-Type"]), (403, "application/json"))
+
+
+class SpotProvisioningTests(ParkingTestMixin, TestCase):
+    def url(self):
+        return f"/api/parking/lots/{self.lot.pk}/spots/"
+
+    def post(self, data, user=None, **kwargs):
+        return self.client.post(self.url(), data, **kwargs, **self.auth(user or self.operator))
+
+    def test_spots_are_created_from_ranges(self):
+        response = self.post({"ranges": [
+            {"prefix": "B", "first": 1, "last": 790, "hourly_rate": "1000.00"},
+            {"prefix": "M", "first": 1, "last": 10, "spot_type": "motorcycle", "hourly_rate": "300.00"},
+        ]}, content_type="application/json")
+
+        self.assertEqual(response.json(), {"created": 800})
+        self.assertEqual(self.lot.spots.filter(spot_number__startswith="B", spot_type="standard").count(), 790)
+        self.assertEqual(self.lot.spots.get(spot_number="M10").hourly_rate, 300)
+
+    def test_spots_are_created_from_a_csv_upload(self):
+        upload = SimpleUploadedFile("spots.csv", b"spot_number,spot_type,hourly_rate\nV1,reserved,5000\nV2,,1500\n")
+
+        self.assertEqual(self.post({"file": upload}).status_code, 201)
+
+        self.assertEqual(list(self.lot.spots.filter(spot_number__startswith="V").order_by("spot_number")
+                              .values_list("spot_type", "hourly_rate")), [("reserved", 5000), ("standard", 1500)])
+
+    def test_invalid_csv_rows_are_reported_by_line(self):
+        upload = SimpleUploadedFile("spots.csv", b"spot_number,spot_type,hourly_rate\nV1,standard,1000\nV2,valet,0\n")
+
+        response = self.post({"file": upload})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error.split(":")[0] for error in response.json()["file"]],
+                         ["row 3, spot_type", "row 3, hourly_rate"])
+
+    def test_existing_and_repeated_spot_numbers_are_rejected(self):
+        response = self.post({"ranges": [{"prefix": "A", "first": 2, "last": 5, "hourly_rate": "1000.00"}]},
+                             content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["spot_numbers"], ["A2"])
+
+        response = self.post({"ranges": [{"prefix": "C", "first": 1, "last": 3, "hourly_rate": "1000.00"},
+                                         {"prefix": "C", "first": 3, "last": 4, "hourly_rate": "1000.00"}]},
+                             content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.lot.spots.count(), 3)
+
+    def test_rates_and_types_are_changed_in_one_update(self):
+        self.client.get(f"/api/parking/lots/{self.lot.pk}/available-spots/")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url(), {"changes": [
+                {"range": {"prefix": "A", "first": 0, "last": 2}, "hourly_rate": "1500.00"},
+                {"spot_numbers": ["A2"], "spot_type": "reserved", "hourly_rate": "4000.00"},
+            ]}, content_type="application/json", **self.auth(self.operator))
+
+        self.assertEqual(response.json(), {"updated": 3})
+        self.assertEqual(sum(query["sql"].startswith("UPDATE") for query in queries.captured_queries), 1)
+        spots = self.client.get(f"/api/parking/lots/{self.lot.pk}/available-spots/").json()
+        self.assertEqual([(spot["spot_type"], spot["hourly_rate"]) for spot in spots], [
+            ("standard", "1500.00"), ("standard", "1500.00"), ("reserved", "4000.00"),
+        ])
+
+    def test_only_the_lots_operator_can_provision(self):
+        other = ParkingOperator.objects.create_user(
+            phone_number="255700000009", password="pass", company_name="Other", business_telephone="255700000009",
+            business_email="other@example.com", address="Posta", city="Dar",
+        )
+        response = self.post({"ranges": [{"first": 1, "last": 2, "hourly_rate": "1000.00"}]}, user=other,
+                             content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+
+
+class LiveAvailabilityTests(ParkingTestMixin, TestCase):
+    async def next_event(self, content):
+        chunk = await asyncio.wait_for(anext(content), 5)
+        name, data = chunk.decode().strip().split("\n")
+        return name.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+    async def take_spot(self, spot):
+        await ParkingSpot.objects.filter(pk=spot.pk).aupdate(is_available=False)
+        await sync_to_async(lot_cache.bump)(self.lot.pk)
+
+    async def test_subscribers_get_a_snapshot_then_deltas(self):
+        response = await self.async_client.get("/api/parking/lots/live/", {"lot": self.lot.pk})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = response.streaming_content
+        try:
+            self.assertEqual(await asyncio.wait_for(anext(content), 5), b"retry: 3000\n\n")
+            name, snapshot = await self.next_event(content)
+            self.assertEqual((name, snapshot["available_spots_count"]), ("snapshot", 3))
+
+            await self.take_spot(self.spots[0])
+            live.broker().publish([self.lot.pk])
+
+            self.assertEqual(await self.next_event(content), ("availability", {
+                "lot": self.lot.pk, "available_spots_count": 2, "changed": [], "taken": [self.spots[0].pk],
+            }))
+        finally:
+            await content.aclose()
+
+    async def test_one_read_per_change_serves_every_subscriber(self):
+        hub = live.Hub(live.LocalBroker())
+        subscriptions = [(await hub.subscribe([self.lot.pk]))[0] for _ in range(3)]
+        self.addCleanup(lambda: [hub.unsubscribe(subscription) for subscription in subscriptions])
+
+        await self.take_spot(self.spots[1])
+        with mock.patch.object(lot_cache, "free_spots", wraps=lot_cache.free_spots) as free_spots:
+            hub.broker.publish([self.lot.pk])
+            events = [await asyncio.wait_for(subscription.queue.get(), 5) for subscription in subscriptions]
+
+        self.assertEqual(free_spots.call_count, 1)
+        self.assertEqual({event[1]["taken"][0] for event in events}, {self.spots[1].pk})
+
+    async def test_the_snapshot_waits_for_the_listener_to_subscribe(self):
+        class SlowBroker(live.LocalBroker):
+            async def listen(self, subscribed):
+                await asyncio.sleep(0.2)
+                async for lot_ids in super().listen(subscribed):
+                    yield lot_ids
+
+        # no reconnect comes to the rescue
+        patch = mock.patch.object(live, "RECONNECT_DELAY", 60)
+        patch.start()
+        self.addCleanup(patch.stop)
+        hub = live.Hub(SlowBroker())
+        subscription, _ = await hub.subscribe([self.lot.pk])
+        self.addCleanup(hub.unsubscribe, subscription)
+
+        await self.take_spot(self.spots[0])
+        hub.broker.publish([self.lot.pk])
+
+        event = await asyncio.wait_for(subscription.queue.get(), 5)
+        self.assertEqual(event[1]["taken"], [self.spots[0].pk])
+
+    def test_committed_spot_changes_are_published(self):
+        with mock.patch.object(live, "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.spots[0].is_available = False
+                self.spots[0].save()
+                publish.assert_not_called()
+        publish.assert_called_once_with({self.lot.pk})
+
+        self.assertEqual(self.client.get("/api/parking/lots/live/", {"lot": self.lot.pk}).status_code, 501)
+
+
+@override_settings(SENSOR_TOKEN="sensor-token", SENSOR_FLUSH_INTERVAL=0)
+class SensorIngestionTests(ParkingTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(sensors.buffer.pending.clear)
+        self.at = timezone.now().replace(microsecond=0)
+
+    def send(self, *events, token="sensor-token"):
+        return self.client.post("/api/parking/sensors/events/", {"events": list(events)},
+                                content_type="application/json", HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def event(self, spot, occupied, seconds=0):
+        return {"spot": spot.pk, "occupied": occupied, "ts": (self.at + timedelta(seconds=seconds)).isoformat()}
+
+    def test_the_latest_reading_of_each_spot_wins(self):
+        url = f"/api/parking/lots/{self.lot.pk}/available-spots/"
+        self.assertEqual(len(self.client.get(url).json()), 3)
+
+        response = self.send(self.event(self.spots[0], True, 2), self.event(self.spots[0], False, 1),
+                             self.event(self.spots[1], False), self.event(self.spots[1], True, 5))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {"accepted": 4, "invalid": 0})
+        self.assertEqual([spot["id"] for spot in self.client.get(url).json()], [self.spots[2].pk])
+        self.spots[0].refresh_from_db()
+        self.assertEqual(self.spots[0].occupancy_updated_at, self.at + timedelta(seconds=2))
+
+    def test_late_readings_do_not_overwrite_newer_ones(self):
+        self.send(self.event(self.spots[0], True, 10))
+        self.send(self.event(self.spots[0], False, 5))
+
+        self.spots[0].refresh_from_db()
+        self.assertFalse(self.spots[0].is_available)
+
+    def test_repeated_readings_leave_the_lot_alone(self):
+        self.send(self.event(self.spots[0], True))
+        self.spots[0].refresh_from_db()
+        version = lot_cache.get_version(self.lot.pk)
+
+        with mock.patch.object(sensors.live, "notify") as notify:
+            self.send(self.event(self.spots[0], True, 5), self.event(self.spots[1], False, 5))
+
+        notify.assert_called_once_with(set())
+        self.assertEqual(lot_cache.get_version(self.lot.pk), version)
+        updated_at = self.spots[0].updated_at
+        self.spots[0].refresh_from_db()
+        self.assertEqual((self.spots[0].updated_at, self.spots[0].occupancy_updated_at),
+                         (updated_at, self.at + timedelta(seconds=5)))
+
+        # a late reading taken before the repeat still loses to it
+        self.send(self.event(self.spots[0], False, 3))
+        self.spots[0].refresh_from_db()
+        self.assertFalse(self.spots[0].is_available)
+
+    def test_a_flush_updates_each_chunk_of_spots_in_one_statement(self):
+        sensors.buffer.add([(spot.pk, True, self.at) for spot in self.spots])
+
+        with mock.patch.object(sensors, "FLUSH_CHUNK", 2), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sensors.buffer.flush(), 3)
+
+        self.assertEqual(sum(query["sql"].startswith("UPDATE") for query in queries.captured_queries), 2)
+        self.assertFalse(self.lot.spots.filter(is_available=True).exists())
+
+    def test_invalid_events_are_counted_and_skipped(self):
+        response = self.send(self.event(self.spots[0], True), {"spot": self.spots[1].pk, "occupied": "yes"},
+                             {"spot": self.spots[2].pk, "occupied": True, "ts": "yesterday"}, "A1")
+
+        self.assertEqual(response.json(), {"accepted": 1, "invalid": 3})
+        self.assertEqual(self.lot.spots.filter(is_available=False).count(), 1)
+
+    def test_gateways_need_the_sensor_token(self):
+        self.assertEqual(self.send(self.event(self.spots[0], True), token="wrong").status_code, 403)
+        with override_settings(SENSOR_TOKEN=""):
+            self.assertEqual(self.send(self.event(self.spots[0], True), token="").status_code, 403)
+        self.assertEqual(self.send(self.event(self.spots[0], True), token="sensor-tokén").status_code, 403)
+        self.assertFalse(self.lot.spots.filter(is_available=False).exists())
+
+    def test_an_exiting_worker_writes_the_buffered_readings(self):
+        with override_settings(SENSOR_FLUSH_INTERVAL=60), mock.patch.object(sensors.buffer, "ensure_flusher"):
+            self.assertEqual(self.send(self.event(self.spots[0], True)).status_code, 202)
+        self.assertFalse(self.lot.spots.filter(is_available=False).exists())
+
+        with mock.patch.object(sensors.connections, "close_all"):
+            sensors.flush_on_exit()
+
+        self.assertEqual(list(self.lot.spots.filter(is_available=False)), [self.spots[0]])
+
+
+@override_settings(SYNC_SETTLE=0)
+class SyncTests(ParkingTestMixin, TestCase):
+    def changes(self, since=None, **params):
+        response = self.client.get("/api/parking/lots/changes/", {"since": since or "", **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_a_first_sync_pages_through_every_lot_and_spot(self):
+        lots, spots, since = [], [], None
+        while True:
+            page = self.changes(since, limit=2)
+            lots += [lot["id"] for lot in page["lots"]]
+            spots += [spot["id"] for spot in page["spots"]]
+            since = page["next"]
+            if not page["has_more"]:
+                break
+
+        self.assertEqual(lots, [self.lot.pk])
+        self.assertEqual(sorted(spots), [spot.pk for spot in self.spots])
+        page = self.changes(since)
+        self.assertEqual((page["lots"], page["spots"], page["removed"]), ([], [], {"lots": [], "spots": []}))
+
+    def test_only_changes_after_the_token_are_returned(self):
+        since = self.changes()["next"]
+        self.spots[1].is_available = False
+        self.spots[1].save()
+        sensors.apply_readings({self.spots[2].pk: (True, timezone.now())})
+
+        page = self.changes(since)
+
+        self.assertEqual(page["lots"], [])
+        self.assertEqual([(spot["id"], spot["is_available"]) for spot in page["spots"]],
+                         [(self.spots[1].pk, False), (self.spots[2].pk, False)])
+        self.assertEqual(self.changes(page["next"])["spots"], [])
+
+    def test_repeated_sensor_readings_are_not_changes(self):
+        since = self.changes()["next"]
+        # spot 0 is free and its sensor says so again
+        sensors.apply_readings({self.spots[0].pk: (False, timezone.now())})
+
+        page = self.changes(since)
+
+        self.assertEqual(page["spots"], [])
+        self.spots[0].refresh_from_db()
+        self.assertIsNotNone(self.spots[0].occupancy_updated_at)
+
+    def test_deletions_and_deactivations_are_tombstoned(self):
+        since = self.changes()["next"]
+        deleted = self.spots[0].pk
+        self.spots[0].delete()
+        self.lot.is_active = False
+        self.lot.save()
+
+        page = self.changes(since)
+        self.assertEqual(page["removed"]["lots"], [self.lot.pk])
+        # the spots left in the lot go with it
+        self.assertEqual(sorted(page["removed"]["spots"]), [deleted, self.spots[1].pk, self.spots[2].pk])
+        self.assertEqual((page["lots"], page["spots"]), ([], []))
+
+        self.lot.is_active = True
+        self.lot.save()
+        page = self.changes(page["next"])
+        self.assertEqual([lot["id"] for lot in page["lots"]], [self.lot.pk])
+        # its spots come back with it
+        self.assertEqual(sorted(spot["id"] for spot in page["spots"]), [self.spots[1].pk, self.spots[2].pk])
+
+    def test_a_first_sync_leaves_out_inactive_lots_and_their_spots(self):
+        inactive = ParkingLot.objects.create(
+            name="Posta", address="Azikiwe St", operator=self.operator, latitude="-6.815000",
+            longitude="39.290000", total_spots=1, opening_hours=time(6), closing_hours=time(22), is_active=False,
+        )
+        ParkingSpot.objects.create(lot=inactive, spot_number="B0", spot_type="standard", hourly_rate=1000)
+
+        page = self.changes()
+
+        self.assertEqual([lot["id"] for lot in page["lots"]], [self.lot.pk])
+        self.assertEqual(sorted(spot["id"] for spot in page["spots"]), [spot.pk for spot in self.spots])
+
+    def test_invalid_and_expired_tokens(self):
+        response = self.client.get("/api/parking/lots/changes/", {"since": "not-a-token"})
+        self.assertEqual(response.status_code, 400)
+
+        expired = sync.encode_token((timezone.now() - timedelta(days=31), sync.LOTS, 0))
+        response = self.client.get("/api/parking/lots/changes/", {"since": expired})
+        self.assertEqual(response.status_code, 410)
+
+
+class BenchmarkTests(TestCase):
+    def test_seeded_scenarios_run_through_the_real_routes(self):
+        counts = seed(lots=2, spots_per_lot=10, motorists=3, bookings=50, operators=1)
+        self.assertEqual(counts["bookings"], Booking.objects.count())
+
+        scenarios, headers = build_scenarios(["search", "quick_book", "payment"], 3)
+        results = {scenario.name: run_in_process(scenario, headers) for scenario in scenarios}
+
+        for name, stats in results.items():
+            self.assertEqual((stats["requests"], stats["errors"]), (3, 0), name)
+            self.assertGreater(stats["queries_per_request"], 0)
+        self.assertEqual(Payment.objects.filter(transaction_id__startswith="BENCH-").count(), 3)
+
+    def test_queries_are_counted_once_the_query_log_is_full(self):
+        seed(lots=1, spots_per_lot=5, motorists=1, bookings=0, operators=1)
+        scenarios, headers = build_scenarios(["search"], 2)
+        connection.queries_log.extend([{"sql": "", "time": "0"}] * connection.queries_limit)
+
+        self.assertEqual(run_in_process(scenarios[0], headers)["queries_per_request"], 2)
+
+    def test_seed_command_builds_consistent_users_and_history(self):
+        call_command("seed", operators=2, motorists=5, lots=2, spots_per_lot=3, bookings=20, chunk_size=4,
+                     stdout=StringIO())
+
+        self.assertEqual(Motorist.objects.count(), 5)
+        self.assertEqual(ParkingOperator.objects.count(), 2)
+        self.assertTrue(Motorist.objects.first().check_password(DEFAULT_PASSWORD))
+        self.assertEqual(Vehicle.objects.filter(user__in=Motorist.objects.all()).count(), 5)
+        self.assertEqual(ParkingSpot.objects.count(), 6)
+        self.assertEqual(Booking.objects.filter(status="completed", payment__status="completed").count()
+                         + Booking.objects.filter(status="cancelled", payment__status="failed").count(), 20)
+        self.assertFalse(Booking.objects.filter(start_time__gte=timezone.now()).exists())
+
+    def test_seeding_next_to_existing_data_only_uses_its_own_rows(self):
+        owner = ParkingOperator.objects.create_user(
+            phone_number="255699999999", password="pass", first_name="Op", company_name="Other",
+            business_telephone="255699999999", business_email="other@example.com", address="Posta", city="Dar",
+        )
+        other_lot = ParkingLot.objects.create(
+            name="Lot 0", address="Posta", operator=owner, latitude="-6.8", longitude="39.2", total_spots=1,
+            opening_hours=time(6), closing_hours=time(22),
+        )
+        ParkingSpot.objects.create(lot=other_lot, spot_number="S0", spot_type="standard", hourly_rate=1000)
+        driver = Motorist.objects.create_user(phone_number="255799999999", password="pass", first_name="Other")
+        Vehicle.objects.create(user=driver, license_plate="T999", vehicle_type="sedan")
+
+        seed(lots=2, spots_per_lot=3, motorists=3, bookings=12, operators=1, chunk_size=4)
+
+        self.assertEqual(other_lot.spots.count(), 1)
+        self.assertFalse(Booking.objects.filter(parking_spot__lot=other_lot).exists())
+        self.assertFalse(Booking.objects.filter(user=driver).exists())
+        for booking in Booking.objects.select_related("parking_spot__lot", "vehicle"):
+            i = int(booking.payment.transaction_id.removeprefix("SEED-")) % 6
+            self.assertEqual((booking.parking_spot.lot.name, booking.parking_spot.spot_number),
+                             (f"Lot {i // 3}", f"S{i % 3}"))
+            self.assertEqual(booking.vehicle.user_id, booking.user_id)
+
+    def test_more_queries_or_slower_p95_is_a_regression(self):
+        baseline = {"search": {"requests": 10, "p95_ms": 100, "queries_per_request": 2}}
+
+        self.assertEqual(compare({"search": {"requests": 10, "p95_ms": 120, "queries_per_request": 2}}, baseline), [])
+        self.assertEqual(len(compare({"search": {"requests": 10, "p95_ms": 130, "queries_per_request": 3}},
+                                     baseline)), 2)
@@ -1,10 +1,29 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import ParkingLotViewSet, BookingViewSet, VehicleViewSet,PaymentViewSet
+from . import async_views, live, sensors
+from .views import ParkingLotViewSet, BookingViewSet, VehicleViewSet,PaymentViewSet, LotStatsViewSet, ExportViewSet
 
 router = DefaultRouter()
 router.register(r'lots', ParkingLotViewSet, basename='parkinglot')
 router.register(r'bookings', BookingViewSet, basename='booking')
 router.register(r'vehicles', VehicleViewSet, basename='vehicle')
 router.register(r'payments', PaymentViewSet, basename='payment')
+router.register(r'stats', LotStatsViewSet, basename='lotstats')
+router.register(r'exports', ExportViewSet, basename='export')
 
-urlpatterns = router.urls
+# async views for the read-heavy endpoints, matched before the router's
+# routes for the same URLs (see async_views.py)
+async_urlpatterns = [
+    path('lots/', async_views.lot_list, name='parkinglot-list'),
+    path('lots/search/', async_views.lot_search, name='parkinglot-search'),
+    path('lots/live/', live.stream_view, name='parkinglot-live'),
+    path('lots/changes/', async_views.lot_changes, name='parkinglot-changes'),
+    path('lots/<pk>/', async_views.lot_detail, name='parkinglot-detail'),
+    path('lots/<pk>/available-spots/', async_views.available_spots, name='parkinglot-available-spots'),
+    path('bookings/', async_views.booking_list, name='booking-list'),
+    path('payments/', async_views.payment_create, name='payment-list'),
+]
+
+urlpatterns = async_urlpatterns + [
+    path('sensors/events/', sensors.events_view, name='sensor-events'),
+] + router.urls
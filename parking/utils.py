@@ -1,8 +1,11 @@
 import math
 import uuid
+import httpx
+import requests
 from azampay import Azampay
 
 from config import settings
+from config.resilience import ProviderUnavailable, get_provider
 
 
 def haversine_distance(lat1, lon1, lat2, lon2):
@@ -28,15 +31,22 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     return earth_radius * c
 
+def payment_retry_after():
+    """Retry-After for a 503 while the payment gateway is unavailable: its circuit's reset timeout"""
+    return str(math.ceil(get_provider("azampay").breaker.reset_timeout))
+
+
 class PaymentService:
     def __init__(self):
         self.app_name = settings.AZAMPAY_CONFIG["APP_NAME"]
         self.client_id = settings.AZAMPAY_CONFIG["CLIENT_ID"]
         self.client_secret = settings.AZAMPAY_CONFIG["CLIENT_SECRET"]
         self.provider = settings.AZAMPAY_CONFIG["PROVIDER"]
+        self.gateway = get_provider("azampay")
 
-        # Initialize Azampay client
-        self.client = Azampay(
+        # Initialize Azampay client (this fetches an access token)
+        self.client = self.gateway.call(
+            Azampay,
             app_name=self.app_name,
             client_id=self.client_id,
             client_secret=self.client_secret,
@@ -44,28 +54,90 @@ class PaymentService:
 
     def initiate_payment(self, phone_number, amount, booking):
         try:
-            checkout = self.client.mobile_checkout(
-                amount=amount,
-                mobile=phone_number,
-                external_id=str(booking),  # Ensure string conversion
-                provider=self.provider
+            response = self.gateway.request(
+                "POST",
+                f"{self.client.BASE_URL}/azampay/mno/checkout",
+                json=self._checkout_payload(phone_number, amount, booking),
+                headers=self.client.headers,
+                # once the request reached the gateway the customer may have been
+                # charged, so only retry when we never got connected
+                retry_on=(requests.ConnectTimeout,),
             )
+            return self._checkout_result(response.json())
 
-            if isinstance(checkout, dict) and checkout.get("success"):
-                transaction_id = checkout.get("transactionId")
-                if not transaction_id:
-                    # Fallback to a unique ID if not provided by the payment gateway
-                    transaction_id = f"FALLBACK_{uuid.uuid4()}"
-                return {
-                    "success": True,
-                    "transaction_id": transaction_id,
-                    "external_id": checkout.get("externalId"),
-                    "message": checkout.get("message", "Payment initiated")
-                }
-            else:
-                message = checkout.get("message", "Payment failed") if isinstance(checkout, dict) else str(checkout)
-                return {"success": False, "message": message}
-
+        except ProviderUnavailable:
+            # the gateway is down, not the request: the view answers 503
+            raise
         except Exception as e:
             # Consider logging the full exception here
             return {"success": False, "message": f"Payment error: {str(e)}"}
+
+    async def ainitiate_payment(self, phone_number, amount, booking, client):
+        """initiate_payment for async views, sent with the `httpx.AsyncClient` given"""
+        try:
+            response = await self.gateway.arequest(
+                client,
+                "POST",
+                f"{self.client.BASE_URL}/azampay/mno/checkout",
+                json=self._checkout_payload(phone_number, amount, booking),
+                headers=self.client.headers,
+                retry_on=(httpx.ConnectTimeout,),
+            )
+            return self._checkout_result(response.json())
+
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            return {"success": False, "message": f"Payment error: {str(e)}"}
+
+    def _checkout_payload(self, phone_number, amount, booking):
+        return {
+            "accountNumber": self.client.clean_mobile_number(phone_number),
+            "amount": self.client.clean_amount(amount),
+            "currency": "TZS",
+            "externalId": str(booking),  # Ensure string conversion
+            "provider": self.provider,
+            "additionalProperties": None,
+        }
+
+    @staticmethod
+    def _checkout_result(checkout):
+        if isinstance(checkout, dict) and checkout.get("success"):
+            transaction_id = checkout.get("transactionId")
+            if not transaction_id:
+                # Fallback to a unique ID if not provided by the payment gateway
+                transaction_id = f"FALLBACK_{uuid.uuid4()}"
+            return {
+                "success": True,
+                "transaction_id": transaction_id,
+                "external_id": checkout.get("externalId"),
+                "message": checkout.get("message", "Payment initiated")
+            }
+        message = checkout.get("message", "Payment failed") if isinstance(checkout, dict) else str(checkout)
+        return {"success": False, "message": message}
+
+    def get_payment_status(self, reference):
+        """
+        Looks up the provider's status for a transaction.
+
+        Returns one of 'completed', 'failed' or 'pending'. Anything the
+        provider cannot resolve yet is reported as 'pending' so the caller
+        can retry it on the next run.
+        """
+        response = self.gateway.request(
+            "GET",
+            f"{self.client.BASE_URL}/azampay/gettransactionstatus",
+            params={"pgReferenceId": reference, "bankName": self.provider},
+            headers=self.client.headers,
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        if not data.get("success"):
+            return "pending"
+        outcome = str(data.get("data", "")).lower()
+        if "success" in outcome:
+            return "completed"
+        if "fail" in outcome or "reject" in outcome:
+            return "failed"
+        return "pending"
@@ -1,34 +1,151 @@
-from datetime import time
+from datetime import date, time, timedelta
+from itertools import chain
 from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied
-from .serializers import ParkingLotSerializer, ParkingSpotSerializer, BookingSerializer, VehicleSerializer, \
-    QuickBookingSerializer, PaymentSerializer
+from .serializers import ParkingLotSerializer, BookingSerializer, VehicleSerializer, \
+    QuickBookingSerializer, PaymentSerializer, SpotProvisionSerializer, SpotBulkUpdateSerializer
 from rest_framework import viewsets,  mixins, status
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import ParkingLot,  Booking, Vehicle, Payment
+from . import exports, lot_cache, provisioning, rollups, sync
+from .archive import newest_first, user_history
 from .permissions import IsOperatorOrReadOnly
 from rest_framework import permissions
 from .utils import haversine_distance
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from .utils import PaymentService
+from .utils import PaymentService, payment_retry_after
 from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from config.metrics import BOOKINGS_CREATED, PAYMENT_INITIATIONS, WEBHOOKS_PROCESSED
+from config.resilience import ProviderUnavailable
+from users.roles import get_motorist, get_operator
+
+
+class SearchError(ValueError):
+    """invalid search parameters, reported to the client as a 400"""
+
+
+def search_lots(queryset, params):
+    """
+    Applies the text and opening hours filters of the lot search and parses
+    its location. Returns the filtered queryset and (lat, lon, radius).
+    """
+    query = params.get("q")
+    lat_str = params.get("lat")
+    lon_str = params.get("lon")
+    radius_str = params.get("radius", "5000")  # Default radius 5km
+
+    if not all([lat_str, lon_str, radius_str]):
+        raise SearchError("Missing required parameters: lat, lon, radius")
+
+    try:
+        lat, lon, radius = float(lat_str), float(lon_str), float(radius_str)
+    except (ValueError, TypeError):
+        raise SearchError("Invalid location or radius parameters.")
+
+    if query:
+        queryset = queryset.filter(name__icontains=query) | queryset.filter(address__icontains=query)
+
+    available_at = params.get("available_at")
+    if available_at:
+        try:
+            check_time = time.fromisoformat(available_at)
+        except ValueError:
+            raise SearchError("Invalid time format for available_at. Use HH:MM.")
+        queryset = queryset.filter(opening_hours__lte=check_time, closing_hours__gte=check_time)
+
+    return queryset, (lat, lon, radius)
+
+
+class StatsError(ValueError):
+    """invalid dashboard parameters, reported to the client as a 400"""
+
+
+def stats_range(params, granularity):
+    """the (first, last) day of a dashboard request; by default the last 7 days of hours or 30 days"""
+    if granularity not in rollups.GRANULARITIES:
+        raise StatsError(f"Invalid granularity, use one of: {', '.join(rollups.GRANULARITIES)}.")
+    longest = rollups.GRANULARITIES[granularity][3]
+    try:
+        last = date.fromisoformat(params["end"]) if params.get("end") else timezone.localdate()
+        first = date.fromisoformat(params["start"]) if params.get("start") else \
+            last - timedelta(days=6 if granularity == "hour" else 29)
+    except ValueError:
+        raise StatsError("Invalid start or end, use YYYY-MM-DD.")
+    if first > last:
+        raise StatsError("start must not be after end.")
+    if (last - first).days >= longest:
+        raise StatsError(f"At most {longest} days can be requested at {granularity} granularity.")
+    return first, last
+
+
+def within_radius(lots, lat, lon, radius):
+    return [
+        lot for lot in lots
+        if haversine_distance(lat, lon, float(lot.latitude), float(lot.longitude)) <= radius
+    ]
+
+
+def user_bookings(user):
+    """the user's bookings, with everything BookingSerializer reads loaded up front"""
+    return (
+        Booking.objects.filter(user_id=user.pk)
+        .select_related('vehicle', 'parking_spot__lot__operator')
+        .prefetch_related('parking_spot__lot__spots')
+        .order_by('-booking_time')
+    )
+
+
+def record_payment(booking, phone_number, payment_response):
+    """stores a successful checkout and activates the booking"""
+    payment = Payment.objects.create(
+        amount=booking.cost,
+        phone_number=phone_number,
+        transaction_id=payment_response['transaction_id'],
+        external_id=payment_response['external_id'],
+        status="completed"  # Mark as completed directly
+    )
+
+    # Associate payment with booking and update booking status
+    booking.payment = payment
+    booking.status = 'active'
+    booking.save()
+    rollups.booking_paid(booking, payment)
+    return payment
+
 
 class ParkingLotViewSet(viewsets.ModelViewSet):
     serializer_class = ParkingLotSerializer
-    queryset = ParkingLot.objects.filter(is_active=True)
+    queryset = ParkingLot.objects.filter(is_active=True).select_related('operator').prefetch_related('spots')
     filter_backends = [DjangoFilterBackend]
+    query_budget = {"list": 2, "retrieve": 2, "search": 2, "available_spots": 2,
+                    # updates check whether the lot is being reactivated (signals.lot_saving)
+                    "create": 4, "update": 7, "partial_update": 7, "destroy": 6,
+                    # SQLite inserts at most 199 spots per statement
+                    "spots": 16, "changes": 3}
+    # not changes: a lagging replica would let the sync token pass changes it hasn't replayed yet
+    replica_reads = {"list": True, "retrieve": True, "search": True, "available_spots": True}
 
     def get_permissions(self):
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'spots']:
             self.permission_classes = [IsOperatorOrReadOnly]
         else:
             self.permission_classes = [permissions.AllowAny]
         return super().get_permissions()
 
     def perform_create(self, serializer):
-        if not hasattr(self.request.user, 'parkingoperator'):
+        operator = get_operator(self.request.user)
+        if operator is None:
             raise PermissionDenied("Only parking operators can create parking lots.")
-        serializer.save(operator=self.request.user.parkingoperator)
+        serializer.save(operator=operator)
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(lot_cache.lot_detail(kwargs['pk']))
 
     @action(detail=False, methods=['get'], url_path='search')
     def search(self, request):
@@ -36,47 +153,26 @@ class ParkingLotViewSet(viewsets.ModelViewSet):
         Searches for parking lots based on a query, location, and radius.
         e.g., /api/parking/lots/search/?q=Kariakoo&lat=-6.76178824157151&lon=39.24324779774923&radius=5000
         """
-        query = request.query_params.get("q")
-        lat_str = request.query_params.get("lat")
-        lon_str = request.query_params.get("lon")
-        radius_str = request.query_params.get("radius", "5000")  # Default radius 5km
+        try:
+            queryset, (lat, lon, radius) = search_lots(self.get_queryset(), request.query_params)
+        except SearchError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not all([lat_str, lon_str, radius_str]):
-            return Response(
-                {"error": "Missing required parameters: lat, lon, radius"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        serializer = self.get_serializer(within_radius(queryset, lat, lon, radius), many=True)
+        return Response(serializer.data)
 
+    @action(detail=False, methods=['get'], url_path='changes')
+    def changes(self, request):
+        """
+        The lots and spots changed after the `since` token, see sync.py.
+        e.g., /api/parking/lots/changes/?since=<next of the previous page>
+        """
         try:
-            lat, lon, radius = float(lat_str), float(lon_str), float(radius_str)
-        except (ValueError, TypeError):
-            return Response(
-                {"error": "Invalid location or radius parameters."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        queryset = self.get_queryset()
-
-        if query:
-            queryset = queryset.filter(name__icontains=query) | queryset.filter(address__icontains=query)
-
-
-        available_at = request.query_params.get("available_at")
-        if available_at:
-            try:
-                check_time = time.fromisoformat(available_at)
-                queryset = queryset.filter(opening_hours__lte=check_time, closing_hours__gte=check_time)
-            except ValueError:
-                return Response({"error": "Invalid time format for available_at. Use HH:MM."},
-                                status=status.HTTP_400_BAD_REQUEST)
-
-        nearby_lots = [
-            lot for lot in queryset
-            if haversine_distance(lat, lon, float(lot.latitude), float(lot.longitude)) <= radius
-        ]
-
-        serializer = self.get_serializer(nearby_lots, many=True)
-        return Response(serializer.data)
+            return Response(sync.changes(*sync.parse_params(request.query_params)))
+        except sync.TokenExpired as e:
+            return Response({"error": str(e)}, status=status.HTTP_410_GONE)
+        except sync.SyncError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['get'], url_path='available-spots')
     def available_spots(self, request, pk=None):
@@ -84,15 +180,31 @@ class ParkingLotViewSet(viewsets.ModelViewSet):
         Returns a list of available parking spots for a given parking lot.
         e.g., /api/parking/lots/{id}/available-spots/?spot_type=standard
         """
-        parking_lot = self.get_object()
-        spots = parking_lot.spots.filter(is_available=True)
+        return Response(lot_cache.free_spots(pk, request.query_params.get('spot_type')))
 
-        spot_type = request.query_params.get('spot_type')
-        if spot_type:
-            spots = spots.filter(spot_type=spot_type)
+    @action(detail=True, methods=['post', 'patch'], url_path='spots')
+    def spots(self, request, pk=None):
+        """
+        POST creates spots in bulk from ranges or an uploaded CSV, PATCH changes
+        the rate and/or type of many spots at once (see provisioning.py).
+        e.g., {"ranges": [{"prefix": "A", "first": 1, "last": 200, "spot_type": "standard", "hourly_rate": 1000}]}
+        or {"changes": [{"range": {"prefix": "A", "first": 1, "last": 50}, "hourly_rate": 1500}]}
+        """
+        lot = get_object_or_404(ParkingLot.objects.select_related('operator'), pk=pk)
+        self.check_object_permissions(request, lot)
 
-        serializer = ParkingSpotSerializer(spots, many=True)
-        return Response(serializer.data)
+        if request.method == 'PATCH':
+            serializer = SpotBulkUpdateSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            return Response({"updated": provisioning.update_spots(lot, serializer.validated_data['changes'])})
+
+        serializer = SpotProvisionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            created = provisioning.provision(lot, serializer.validated_data['spots'])
+        except provisioning.SpotConflict as e:
+            return Response({"error": str(e), "spot_numbers": e.spot_numbers[:50]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"created": created}, status=status.HTTP_201_CREATED)
 
 
 class BookingViewSet(mixins.CreateModelMixin,
@@ -101,23 +213,41 @@ class BookingViewSet(mixins.CreateModelMixin,
                    viewsets.GenericViewSet):
     serializer_class = BookingSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {"list": 5, "retrieve": 4, "create": 14, "quick_book": 18}
+    replica_reads = {"list": True}
 
     def get_queryset(self):
         """
         This view should return a list of all the bookings
         for the currently authenticated user.
         """
-        return Booking.objects.filter(user=self.request.user).order_by('-booking_time')
+        return user_bookings(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        # the history spans live and archived bookings
+        bookings = newest_first(chain(*user_history(request.user)))
+        return Response(self.get_serializer(bookings, many=True).data)
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve':
+                raise
+            return get_object_or_404(user_history(self.request.user)[1], pk=self.kwargs['pk'])
 
     def perform_create(self, serializer):
         """
         Associate the booking with the logged-in user (Motorist).
         """
-        if not hasattr(self.request.user, 'motorist'):
+        motorist = get_motorist(self.request.user)
+        if motorist is None:
             raise PermissionDenied("Only motorists can make bookings.")
 
         # The serializer's validate method already checks if the vehicle belongs to the user
-        serializer.save(user=self.request.user)
+        booking = serializer.save(user=motorist)
+        rollups.booking_created(booking)
+        BOOKINGS_CREATED.labels("booking").inc()
 
     def get_serializer_context(self):
         """
@@ -130,6 +260,10 @@ class BookingViewSet(mixins.CreateModelMixin,
         serializer = QuickBookingSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             booking = serializer.save()
+            rollups.booking_created(booking)
+            BOOKINGS_CREATED.labels("quick_book").inc()
+            # the lot's spot list and free spot count share one query
+            prefetch_related_objects([booking.parking_spot.lot], 'spots')
             return Response(BookingSerializer(booking).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -137,6 +271,8 @@ class PaymentViewSet(viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {"list": 2, "retrieve": 2, "create": 16, "webhook": 14}
+    replica_reads = {"list": True}
 
     def create(self, request, *args, **kwargs):
         """handle payment initialization for booking"""
@@ -162,26 +298,20 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 )
 
                 if payment_response['success']:
-                    # Create the payment record
-                    payment = Payment.objects.create(
-                        amount=booking.cost,
-                        phone_number=phone_number,
-                        transaction_id=payment_response['transaction_id'],
-                        external_id=payment_response['external_id'],
-                        status="completed"  # Mark as completed directly
-                    )
-
-                    # Associate payment with booking and update booking status
-                    booking.payment = payment
-                    booking.status = 'active'
-                    booking.save()
-
+                    PAYMENT_INITIATIONS.labels("success").inc()
+                    payment = record_payment(booking, phone_number, payment_response)
                     return Response(PaymentSerializer(payment).data, status=status.HTTP_201_CREATED)
 
                 # If payment initiation failed, return the error message from the service
+                PAYMENT_INITIATIONS.labels("failed").inc()
                 return Response({"error": payment_response.get('message', "Payment initiation failed.")}, status=status.HTTP_400_BAD_REQUEST)
         except Booking.DoesNotExist:
             return Response({"error": "Booking not found."}, status=status.HTTP_404_NOT_FOUND)
+        except ProviderUnavailable:
+            PAYMENT_INITIATIONS.labels("unavailable").inc()
+            return Response({"error": "Payment provider is unavailable, please try again shortly."},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={"Retry-After": payment_retry_after()})
 
 
 
@@ -194,32 +324,134 @@ class PaymentViewSet(viewsets.ModelViewSet):
         transaction_status = request.data.get('transactionStatus')
 
         if not external_id or not transaction_status:
+            WEBHOOKS_PROCESSED.labels("invalid").inc()
             return Response({'status': 'error', 'message': 'Missing required fields'}, status=400)
 
         try:
             payment = Payment.objects.get(external_id=external_id)
             payment.webhook_data = request.data
-            payment.save()
-
-            if transaction_status.lower() == 'success' and payment.status != 'completed':
+            completed = transaction_status.lower() == 'success' and payment.status != 'completed'
+            if completed:
                 payment.status = 'completed'
-                payment.save()
+            payment.save()
 
+            if completed:
                 booking = payment.booking
                 booking.status = 'active'
                 booking.save()
+                rollups.booking_paid(booking, payment)
+                WEBHOOKS_PROCESSED.labels("completed").inc()
+            else:
+                WEBHOOKS_PROCESSED.labels("recorded").inc()
 
             return Response({'status': 'success'})
 
         except Payment.DoesNotExist:
+            WEBHOOKS_PROCESSED.labels("not_found").inc()
             return Response({'status': 'error', 'message': 'Payment not found'}, status=404)
 
 
 
 
+class LotStatsViewSet(viewsets.ViewSet):
+    """
+    Operator dashboard, answered from the rollup tables alone (see rollups.py).
+    e.g., /api/parking/stats/?start=2025-01-01&end=2025-01-31 for totals per lot,
+    /api/parking/stats/{lot_id}/?granularity=hour&start=2025-01-01 for one lot over time
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    lookup_value_regex = r'\d+'
+    query_budget = {"list": 4, "retrieve": 4}
+    replica_reads = True
+
+    def get_operator(self):
+        operator = get_operator(self.request.user)
+        if operator is None:
+            raise PermissionDenied("Only parking operators can view lot statistics.")
+        return operator
+
+    def list(self, request):
+        operator = self.get_operator()
+        try:
+            first, last = stats_range(request.query_params, "day")
+        except StatsError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        lots = ParkingLot.objects.filter(operator=operator).order_by('id')
+        return Response({"start": first, "end": last, "results": rollups.lot_totals(lots, first, last)})
+
+    def retrieve(self, request, pk=None):
+        lot = get_object_or_404(ParkingLot, pk=pk, operator=self.get_operator())
+        granularity = request.query_params.get('granularity', 'day')
+        try:
+            first, last = stats_range(request.query_params, granularity)
+        except StatsError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "lot": lot.pk, "granularity": granularity, "start": first, "end": last,
+            "results": rollups.series(lot, granularity, first, last),
+        })
+
+
+class ExportViewSet(viewsets.ViewSet):
+    """
+    Streams the bookings or payments of the operator's lots for accounting (see exports.py).
+    e.g., /api/parking/exports/bookings/?format=csv&start=2025-01-01&end=2025-03-31&lot=4&gzip=1
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [exports.CSVRenderer, exports.NDJSONRenderer]
+    query_budget = 3
+    replica_reads = True
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if isinstance(response, Response):
+            # errors are reported as JSON whatever format was asked for
+            request.accepted_renderer, request.accepted_media_type = JSONRenderer(), JSONRenderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def export(self, request, name, rows, columns):
+        operator = get_operator(request.user)
+        if operator is None:
+            raise PermissionDenied("Only parking operators can export bookings and payments.")
+        try:
+            lot_ids, start, end = exports.parse_filters(request.query_params)
+        except exports.ExportError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        lots = ParkingLot.objects.filter(operator=operator)
+        if lot_ids is not None:
+            lots = lots.filter(pk__in=lot_ids)
+        # the rows are read after the view returns, outside the routing of this request
+        querysets = [queryset.using(queryset.db) for queryset in rows(list(lots.values_list('pk', flat=True)),
+                                                                     start, end)]
+
+        kind = request.accepted_renderer.format
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        encoder = exports.Encoder(kind, columns, compress)
+        asgi = isinstance(request._request, ASGIRequest)
+        content = (exports.astream if asgi else exports.stream)(querysets, encoder)
+
+        filename = f"{name}-{start or 'all'}-{end or timezone.localdate()}.{kind}" + (".gz" if compress else "")
+        content_type = "application/gzip" if compress else f"{request.accepted_media_type}; charset=utf-8"
+        return StreamingHttpResponse(content, content_type=content_type, headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+        })
+
+    @action(detail=False, methods=['get'])
+    def bookings(self, request):
+        return self.export(request, 'bookings', exports.bookings, exports.BOOKING_COLUMNS)
+
+    @action(detail=False, methods=['get'])
+    def payments(self, request):
+        return self.export(request, 'payments', exports.payments, exports.PAYMENT_COLUMNS)
+
+
 class VehicleViewSet(viewsets.ModelViewSet):
     serializer_class = VehicleSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {"list": 2, "retrieve": 2, "create": 2, "update": 3, "partial_update": 3, "destroy": 3}
+    replica_reads = {"list": True}
 
     def get_queryset(self):
         """
@@ -232,6 +464,7 @@ class VehicleViewSet(viewsets.ModelViewSet):
         """
         Associate the vehicle with the logged-in user (Motorist).
         """
-        if not hasattr(self.request.user, 'motorist'):
+        motorist = get_motorist(self.request.user)
+        if motorist is None:
             raise PermissionDenied("Only motorists can add vehicles.")
-        serializer.save(user=self.request.user)
+        serializer.save(user=motorist)
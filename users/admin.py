@@ -2,9 +2,10 @@
 
 from django.contrib import admin
 
-from .models import Person, Motorist, OTP, ParkingOperator
+from .models import Person, Motorist, OTP, ParkingOperator, SMSJob
 
 admin.site.register(Person)
 admin.site.register(Motorist)
 admin.site.register(OTP)
-admin.site.register(ParkingOperator)
\ No newline at end of file
+admin.site.register(ParkingOperator)
+admin.site.register(SMSJob)
\ No newline at end of file
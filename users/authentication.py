@@ -0,0 +1,72 @@
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import Person
+from .roles import ROLE_MODELS
+from .signals import USER_CACHE_TTL, user_cache_key
+
+
+class RoleJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that loads the concrete Motorist/ParkingOperator named
+    by the token's role claim in one query, and keeps what authentication
+    needs of it in the cache for a minute so back-to-back requests need no
+    user query at all.
+
+    Only the id, role, active flag and password digest are cached, never the
+    user row itself. The user of a cache hit carries just those; its other
+    fields are deferred and `load_user` fetches them in one query.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        key = user_cache_key(user_id)
+        entry = cache.get(key)
+        if entry is None:
+            role = validated_token.get("role")
+            model = ROLE_MODELS.get(role, Person)
+            try:
+                user = model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except model.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+            entry = {
+                "id": user.pk, "role": role, "is_active": user.is_active,
+                "password": get_md5_hash_password(user.password),
+            }
+            cache.set(key, entry, USER_CACHE_TTL)
+        else:
+            user = _cached_user(entry)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not entry["is_active"]:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != entry["password"]:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+
+def _cached_user(entry):
+    """a user of the entry's role with only its cached fields loaded"""
+    model = ROLE_MODELS.get(entry["role"], Person)
+    loaded = {"id": entry["id"], model._meta.pk.attname: entry["id"], "is_active": entry["is_active"]}
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in loaded]
+    return model.from_db(router.db_for_read(model), names, [loaded[name] for name in names])
+
+
+def load_user(user):
+    """fetches the fields a cached authenticated user doesn't carry, in one query"""
+    deferred = user.get_deferred_fields()
+    if deferred:
+        user.refresh_from_db(fields=deferred)
+    return user
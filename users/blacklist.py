@@ -0,0 +1,130 @@
+"""
+Refresh token blacklist backed by the shared cache.
+
+Every blacklisted jti is mirrored into the cache under its own key that
+expires together with the token, so the set only ever holds tokens that
+could still be presented. A jti found not to be blacklisted is cached too,
+for NEGATIVE_TTL seconds. A refresh then mostly costs a single cache `get`
+instead of a join across the blacklist tables. The database rows are kept
+as the durable copy and are used to (re)seed the cache.
+
+A miss can be a cold cache (fresh Redis) or an entry Redis evicted under
+memory pressure, so it is always answered from the database; the cache can
+never let a blacklisted token through.
+
+Blacklisting overwrites a cached negative in the shared cache, so every
+worker sees a revoked token at once. A per-process cache (DEBUG only, see
+config/checks.py) keeps the other workers' negatives instead: there a
+revoked token can still be refreshed elsewhere for up to NEGATIVE_TTL
+seconds, which is why that is kept short.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+NEGATIVE_TTL = 10
+LOCAL_LIMIT = 10000
+
+# jtis this process has already seen blacklisted; a token never leaves the blacklist
+_local = set()
+
+
+def _key(jti):
+    return f"jwt:blacklist:{jti}"
+
+
+def _remember(jti):
+    if len(_local) >= LOCAL_LIMIT:
+        _local.clear()
+    _local.add(jti)
+
+
+def is_blacklisted(jti):
+    if jti in _local:
+        return True
+    cached = cache.get(_key(jti))
+    if cached is None:
+        expires_at = BlacklistedToken.objects.filter(token__jti=jti).values_list("token__expires_at", flat=True).first()
+        if expires_at is None:
+            # `add` so this can't overwrite the 1 of a token blacklisted meanwhile
+            cache.add(_key(jti), 0, NEGATIVE_TTL)
+            return False
+        _cache_blacklisted(jti, expires_at)
+        cached = 1
+    if cached:
+        _remember(jti)
+    return bool(cached)
+
+
+def _cache_blacklisted(jti, expires_at):
+    ttl = (expires_at - timezone.now()).total_seconds()
+    if ttl > 0:
+        cache.set(_key(jti), 1, int(ttl) + 1)
+
+
+def add(jti, expires_at, user_id=None, token=""):
+    """blacklists a token in the database and the cache"""
+    with transaction.atomic():
+        outstanding, _ = OutstandingToken.objects.get_or_create(
+            jti=jti,
+            defaults={"user_id": user_id, "token": token, "created_at": timezone.now(), "expires_at": expires_at},
+        )
+        BlacklistedToken.objects.get_or_create(token=outstanding)
+    _cache_blacklisted(jti, expires_at)
+    _remember(jti)
+
+
+def seed_cache(chunk_size=5000):
+    """copies every blacklisted, unexpired jti into the cache"""
+    now = timezone.now()
+    rows = (
+        BlacklistedToken.objects.filter(token__expires_at__gt=now)
+        .values_list("token__jti", "token__expires_at")
+        .iterator(chunk_size=chunk_size)
+    )
+    count = 0
+    batch = {}
+    for jti, expires_at in rows:
+        batch[_key(jti)] = expires_at
+        if len(batch) >= chunk_size:
+            count += _flush(batch, now)
+    count += _flush(batch, now)
+    return count
+
+
+def _flush(batch, now):
+    # set_many only takes one timeout, so group keys by remaining lifetime (in minutes)
+    by_ttl = {}
+    for key, expires_at in batch.items():
+        ttl = int((expires_at - now).total_seconds() // 60 + 1) * 60
+        by_ttl.setdefault(ttl, {})[key] = 1
+    for ttl, keys in by_ttl.items():
+        cache.set_many(keys, ttl)
+    flushed = len(batch)
+    batch.clear()
+    return flushed
+
+
+def compact(batch_size=5000, pause=0.05):
+    """
+    Deletes expired outstanding tokens (and their blacklist rows) in batches
+    of `batch_size`, oldest ids first, sleeping `pause` seconds between
+    batches so the tables are never locked for long.
+    """
+    now = timezone.now()
+    deleted = 0
+    while True:
+        ids = list(OutstandingToken.objects.filter(expires_at__lt=now).order_by("id")
+                   .values_list("id", flat=True)[:batch_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            BlacklistedToken.objects.filter(token_id__in=ids).delete()
+            deleted += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+    return deleted
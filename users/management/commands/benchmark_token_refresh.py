@@ -0,0 +1,69 @@
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from users.blacklist import seed_cache
+from users.models import Motorist
+from users.serializers import RoleTokenRefreshSerializer
+from users.tokens import RoleRefreshToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Time refresh token rotation against a blacklist with a large history. "
+        "Inserts --history expired, blacklisted tokens first; run it against a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--history", type=int, default=10_000_000,
+                            help="expired blacklisted tokens to insert before measuring")
+        parser.add_argument("--refreshes", type=int, default=1000,
+                            help="refreshes to time")
+        parser.add_argument("--chunk-size", type=int, default=10000)
+        parser.add_argument("--no-seed", action="store_true",
+                            help="measure without seeding the blacklist cache (database fallback)")
+
+    def handle(self, *args, **options):
+        user, _ = Motorist.objects.get_or_create(
+            phone_number="255799999999", defaults={"first_name": "Bench", "last_name": "Mark"},
+        )
+        self.insert_history(user, options["history"], options["chunk_size"])
+        if not options["no_seed"]:
+            seed_cache(chunk_size=options["chunk_size"])
+
+        refresh = str(RoleRefreshToken.for_user(user))
+        timings = []
+        for _ in range(options["refreshes"]):
+            started = time.perf_counter()
+            serializer = RoleTokenRefreshSerializer(data={"refresh": refresh})
+            serializer.is_valid(raise_exception=True)
+            timings.append((time.perf_counter() - started) * 1000)
+            refresh = serializer.validated_data["refresh"]
+
+        quantiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(
+            f"{len(timings)} refreshes: p50 {quantiles[49]:.2f}ms, p95 {quantiles[94]:.2f}ms, "
+            f"p99 {quantiles[98]:.2f}ms"
+        )
+
+    def insert_history(self, user, total, chunk_size):
+        expired = timezone.now() - timedelta(days=1)
+        inserted = 0
+        while inserted < total:
+            size = min(chunk_size, total - inserted)
+            jtis = [uuid.uuid4().hex for _ in range(size)]
+            OutstandingToken.objects.bulk_create(
+                OutstandingToken(user=user, jti=jti, token="", created_at=expired, expires_at=expired)
+                for jti in jtis
+            )
+            ids = OutstandingToken.objects.filter(jti__in=jtis).values_list("id", flat=True)
+            BlacklistedToken.objects.bulk_create(BlacklistedToken(token_id=pk) for pk in ids)
+            inserted += size
+            self.stdout.write(f"\rinserted {inserted}/{total} historical tokens", ending="")
+        if total:
+            self.stdout.write("")
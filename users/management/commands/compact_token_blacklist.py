@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from users.blacklist import compact, seed_cache
+
+
+class Command(BaseCommand):
+    help = "Delete expired refresh tokens from the blacklist tables and reseed the blacklist cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="token ids deleted per transaction")
+        parser.add_argument("--pause", type=float, default=0.05,
+                            help="seconds to sleep between batches")
+
+    def handle(self, *args, **options):
+        deleted = compact(batch_size=options["batch_size"], pause=options["pause"])
+        seeded = seed_cache()
+        self.stdout.write(self.style.SUCCESS(
+            f"deleted {deleted} expired tokens, {seeded} blacklisted tokens cached"
+        ))
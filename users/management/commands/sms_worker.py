@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from users.sms import SMSWorker
+
+
+class Command(BaseCommand):
+    help = "Deliver queued SMS jobs (OTPs, notifications) through the SMS gateway."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="jobs claimed per sweep, coalesced into multi-recipient requests")
+        parser.add_argument("--poll-interval", type=float, default=1.0,
+                            help="seconds to sleep when the queue is empty")
+        parser.add_argument("--window", type=float, default=0.5,
+                            help="seconds to let messages accumulate after a partial batch")
+        parser.add_argument("--once", action="store_true",
+                            help="process a single batch and exit")
+
+    def handle(self, *args, **options):
+        worker = SMSWorker(batch_size=options["batch_size"])
+        if options["once"]:
+            processed = worker.run_once()
+            self.stdout.write(self.style.SUCCESS(f"processed {processed} SMS jobs"))
+            return
+        self.stdout.write("SMS worker started")
+        worker.run_forever(poll_interval=options["poll_interval"], window=options["window"])
@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-19 12:13
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_rename_otp_value_otp_otp_remove_otp_person_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SMSJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number', models.CharField(max_length=15)),
+                ('message', models.TextField(max_length=480)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('dead', 'Dead')], default='queued', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'SMS Job',
+                'verbose_name_plural': 'SMS Jobs',
+                'indexes': [models.Index(fields=['status', 'available_at'], name='users_smsjo_status_1a678c_idx')],
+            },
+        ),
+    ]
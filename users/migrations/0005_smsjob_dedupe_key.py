@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 12:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_smsjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='smsjob',
+            name='dedupe_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_smsjob_dedupe_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='otp',
+            name='code_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='otp',
+            name='otp',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_otp_code_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(fields=['expires_at'], name='users_otp_expires_8f43b7_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_otp_expires_at_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(fields=['phone_number', 'code_hash', 'is_used'], name='otp_lookup_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def clear_finished_sms_text(apps, schema_editor):
+    # OTP messages carry the code in clear, the worker now blanks them once they are sent
+    SMSJob = apps.get_model('users', 'SMSJob')
+    SMSJob.objects.filter(status__in=['sent', 'dead']).exclude(message='').update(message='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_otp_lookup_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_finished_sms_text, migrations.RunPython.noop),
+    ]
@@ -47,16 +47,54 @@ class ParkingOperator(Person):
         return f"{self.first_name} operator for {self.company_name}"
 
 class OTP(models.Model):
+    """audit record of an issued OTP, the live codes are kept in the cache (see users/otp.py)"""
     phone_number = models.CharField(max_length=15, null=True, blank=True)
-    otp = models.IntegerField()
+    otp = models.IntegerField(null=True, blank=True)
+    code_hash = models.CharField(max_length=64, blank=True)
     is_used = models.BooleanField(default=False)
     expires_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at']),
+            models.Index(fields=['phone_number', 'code_hash', 'is_used'], name='otp_lookup_idx'),
+        ]
+
     def is_expired(self):
-        expiry_time = self.created_at + timedelta(minutes=15)
+        expiry_time = self.expires_at or self.created_at + timedelta(minutes=15)
         return timezone.now() > expiry_time
 
     def __str__(self):
-        return f"{self.phone_number} - {self.otp}"
+        return f"{self.phone_number} - {self.created_at:%Y-%m-%d %H:%M}"
+
+
+
+class SMSJob(models.Model):
+    """outbound SMS waiting to be delivered by the `sms_worker` command"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead'),
+    ]
+
+    phone_number = models.CharField(max_length=15)
+    message = models.TextField(max_length=480)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # stops a notification sweep from queueing the same message twice
+    dedupe_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
 
+    class Meta:
+        indexes = [ models.Index(fields=['status', 'available_at']), ]
+        verbose_name = 'SMS Job'
+        verbose_name_plural = 'SMS Jobs'
+
+    def __str__(self):
+        return f"SMS to {self.phone_number} ({self.status})"
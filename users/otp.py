@@ -0,0 +1,118 @@
+"""
+OTP store on the Django cache.
+
+Codes never reach the cache in clear: the only trace of an issued code is a
+key containing an HMAC of (phone number, code), created with the OTP's TTL.
+Verifying is a single atomic `cache.delete` of that key, which also makes a
+code single use, and failed guesses are counted with an atomic `cache.incr`.
+The SMS carrying the code is the one other copy; the SMS worker blanks its
+text once it is sent (see sms.py).
+
+The `OTP` table is no longer read. When ``settings.OTP_AUDIT_TRAIL`` is on,
+issue/verify events are written to it from a background thread so that the
+request never waits on those inserts.
+"""
+import hashlib
+import hmac
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import OTP
+from .utils import generate_otp
+
+logger = logging.getLogger(__name__)
+
+OTP_TTL = timedelta(minutes=15)
+MAX_ATTEMPTS = 5
+
+VALID, INVALID, LOCKED = "valid", "invalid", "locked"
+
+_audit_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="otp-audit")
+
+
+def hash_code(phone_number, code):
+    message = f"{phone_number}:{code}".encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+
+def _code_key(phone_number, code_hash):
+    return f"otp:code:{phone_number}:{code_hash}"
+
+
+def _current_key(phone_number):
+    return f"otp:current:{phone_number}"
+
+
+def _attempts_key(phone_number):
+    return f"otp:attempts:{phone_number}"
+
+
+def issue_otp(phone_number):
+    """creates a fresh code for `phone_number`, replacing any earlier one, and returns it"""
+    code = generate_otp()
+    code_hash = hash_code(phone_number, code)
+    ttl = int(OTP_TTL.total_seconds())
+
+    previous = cache.get(_current_key(phone_number))
+    if previous:
+        cache.delete(_code_key(phone_number, previous))
+    cache.set_many({
+        _code_key(phone_number, code_hash): 1,
+        _current_key(phone_number): code_hash,
+        _attempts_key(phone_number): 0,
+    }, ttl)
+
+    _audit(_record_issued, phone_number, code_hash, timezone.now() + OTP_TTL)
+    return code
+
+
+def verify_otp(phone_number, code):
+    """
+    Returns VALID (and consumes the code), INVALID, or LOCKED once the phone
+    number has used up its guesses for the current code.
+    """
+    try:
+        attempts = cache.incr(_attempts_key(phone_number))
+    except ValueError:
+        # no code was issued for this number, or it expired
+        return INVALID
+    if attempts > MAX_ATTEMPTS:
+        return LOCKED
+
+    code_hash = hash_code(phone_number, code)
+    if not cache.delete(_code_key(phone_number, code_hash)):
+        return INVALID
+
+    cache.delete_many([_current_key(phone_number), _attempts_key(phone_number)])
+    _audit(_record_used, phone_number, code_hash)
+    return VALID
+
+
+def _audit(func, *args):
+    if not getattr(settings, "OTP_AUDIT_TRAIL", False):
+        return
+    transaction.on_commit(lambda: _audit_executor.submit(_run_audit, func, *args))
+
+
+def _run_audit(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("failed to write OTP audit record")
+    finally:
+        # this thread owns its own connection, don't leave it open
+        connection.close()
+
+
+def _record_issued(phone_number, code_hash, expires_at):
+    OTP.objects.create(phone_number=phone_number, code_hash=code_hash, expires_at=expires_at)
+
+
+def _record_used(phone_number, code_hash):
+    OTP.objects.filter(phone_number=phone_number, code_hash=code_hash, is_used=False).update(is_used=True)
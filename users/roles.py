@@ -0,0 +1,48 @@
+"""
+Role lookups that avoid the extra multi-table-inheritance query.
+
+Authenticated users are loaded as their concrete `Motorist`/`ParkingOperator`
+class (see users/authentication.py), so a plain isinstance check answers most
+role questions. Anything else, e.g. a bare `Person` from the admin or the
+login backend, falls back to the reverse one-to-one lookup.
+"""
+from .models import Person, Motorist, ParkingOperator
+
+MOTORIST, OPERATOR, USER = "motorist", "operator", "user"
+
+ROLE_MODELS = {
+    MOTORIST: Motorist,
+    OPERATOR: ParkingOperator,
+}
+
+
+def get_motorist(user):
+    """the Motorist behind `user`, or None"""
+    if isinstance(user, Motorist):
+        return user
+    if isinstance(user, Person) and not isinstance(user, ParkingOperator):
+        try:
+            return user.motorist
+        except Motorist.DoesNotExist:
+            return None
+    return None
+
+
+def get_operator(user):
+    """the ParkingOperator behind `user`, or None"""
+    if isinstance(user, ParkingOperator):
+        return user
+    if isinstance(user, Person) and not isinstance(user, Motorist):
+        try:
+            return user.parkingoperator
+        except ParkingOperator.DoesNotExist:
+            return None
+    return None
+
+
+def role_of(user):
+    if get_motorist(user) is not None:
+        return MOTORIST
+    if get_operator(user) is not None:
+        return OPERATOR
+    return USER
@@ -1,6 +1,10 @@
 from django.contrib.auth import authenticate
 from rest_framework import serializers
-from .models import Motorist, Person, ParkingOperator, OTP
+from .models import Motorist, Person, ParkingOperator
+from .otp import verify_otp, VALID, LOCKED
+from .roles import get_motorist, get_operator, role_of, OPERATOR
+from .tokens import RoleRefreshToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -57,7 +61,7 @@ class MotoristLoginSerializer(serializers.Serializer):
         except Motorist.DoesNotExist:
             raise serializers.ValidationError("not a registered motorist")
 
-        attrs["user"] = user
+        attrs["user"] = motorist
         return attrs
 
 class OTPSerializer(serializers.ModelSerializer):
@@ -74,16 +78,11 @@ class VerifyRegistrationOTPSerializer(serializers.Serializer):
         phone_number = attrs.get('phone_number')
         otp = attrs.get('otp')
 
-        try:
-            otp_object = OTP.objects.get(phone_number=phone_number, otp=otp, is_used=False)
-        except OTP.DoesNotExist:
-            raise serializers.ValidationError("invalid otp")
-
-        if otp_object.is_expired():
-            raise serializers.ValidationError("OTP has expired")
-
-        otp_object.is_used = True
-        otp_object.save()
+        result = verify_otp(phone_number, otp)
+        if result == LOCKED:
+            raise serializers.ValidationError("too many attempts, please request a new OTP")
+        if result != VALID:
+            raise serializers.ValidationError("invalid or expired otp")
 
         return attrs
 
@@ -158,24 +157,25 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
     # Method to get the user role from person object
     def get_role(self, obj):
-        if hasattr(obj, 'motorist'):
-            return "motorist"
-        if hasattr(obj, 'parkingoperator'):
+        role = role_of(obj)
+        if role == OPERATOR:
             return "parking operator"
-        return "user"
+        return role
 
     # Method to get extra fields for user object
     def get_extra_data(self, obj):
-        if hasattr(obj, 'motorist'):
+        motorist = get_motorist(obj)
+        if motorist is not None:
             return {
-                "id_type": obj.motorist.id_type,
-                "id_number": obj.motorist.id_number
+                "id_type": motorist.id_type,
+                "id_number": motorist.id_number
             }
-        if hasattr(obj, 'parkingoperator'):
+        operator = get_operator(obj)
+        if operator is not None:
             return {
-                "company_name": obj.parkingoperator.company_name,
-                "business_email": obj.parkingoperator.business_email,
-                "city": obj.parkingoperator.city,
+                "company_name": operator.company_name,
+                "business_email": operator.business_email,
+                "city": operator.city,
             }
         return {}
 
@@ -190,22 +190,33 @@ class CurrentUserSerializer(serializers.ModelSerializer):
         read_only_fields=("id", "phone_number")
 
     def get_role(self, obj):
-        if hasattr(obj, 'motorist'):
-            return "motorist"
-        if hasattr(obj, 'parkingoperator'):
+        role = role_of(obj)
+        if role == OPERATOR:
             return "parking operator"
-        return "user"
+        return role
 
     def get_extra_data(self, obj):
-        if hasattr(obj, 'motorist'):
+        motorist = get_motorist(obj)
+        if motorist is not None:
             return {
-                "id_type": obj.motorist.id_type,
-                "id_number": obj.motorist.id_number
+                "id_type": motorist.id_type,
+                "id_number": motorist.id_number
             }
-        if hasattr(obj, 'parkingoperator'):
+        operator = get_operator(obj)
+        if operator is not None:
             return {
-                "company_name": obj.parkingoperator.company_name,
-                "business_email": obj.parkingoperator.business_email,
-                "city": obj.parkingoperator.city,
+                "company_name": operator.company_name,
+                "business_email": operator.business_email,
+                "city": operator.city,
             }
         return {}
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """token pair for /api/token/ with the same role claim the login views issue"""
+    token_class = RoleRefreshToken
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    """refresh for /api/token/refresh/ using the cache-backed blacklist"""
+    token_class = RoleRefreshToken
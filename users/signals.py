@@ -0,0 +1,28 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Person
+
+# how long the authentication fields of a user are reused across requests
+USER_CACHE_TTL = 60
+
+
+def user_cache_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def forget_users(user_ids):
+    """
+    Drops the cached authentication fields of `user_ids`. Saves and deletes
+    do it through the signal below; writes that bypass signals (a queryset
+    `update` or `bulk_update` of users) must call this themselves.
+    """
+    cache.delete_many([user_cache_key(user_id) for user_id in user_ids])
+
+
+@receiver([post_save, post_delete])
+def forget_cached_user(sender, instance, **kwargs):
+    """drop the cached copy as soon as a user (or one of its subclasses) changes"""
+    if isinstance(instance, Person):
+        forget_users([instance.pk])
@@ -0,0 +1,196 @@
+"""
+Durable outbound SMS queue.
+
+Views call `enqueue_sms`/`enqueue_otp`, which only insert an `SMSJob` row, and
+the `sms_worker` management command delivers the jobs in the background.
+Jobs that carry the same text are coalesced into multi-recipient gateway
+requests of up to ``settings.SMS_MAX_RECIPIENTS`` numbers. Failed deliveries
+are retried with exponential backoff and parked as `dead` once they run out
+of attempts.
+
+A job's text is cleared once it is sent or dead, since OTP messages carry
+the code in clear; the rows themselves are deleted by the ``sms_jobs`` purge
+(see parking/purge.py).
+"""
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import islice
+
+import requests
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.constants import OnConflict
+from django.db.models.sql import InsertQuery
+from django.utils import timezone
+
+from config.metrics import OTPS_SENT, SMS_DELIVERIES
+from .models import SMSJob
+from .utils import SMSGatewayUnavailable, otp_message, send_bulk_sms, validate_phone_number
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_BASE = 10  # seconds, doubled on every failed attempt
+LEASE = timedelta(minutes=2)
+
+
+def enqueue_sms(phone_number, message, dedupe_key=None):
+    """validates the number and queues the message; raises ValueError for bad numbers"""
+    validate_phone_number(phone_number)
+    return SMSJob.objects.create(phone_number=phone_number, message=message, dedupe_key=dedupe_key)
+
+
+def enqueue_otp(phone_number, otp):
+    job = enqueue_sms(phone_number, otp_message(otp))
+    OTPS_SENT.inc()
+    return job
+
+
+def enqueue_many(messages, batch_size=1000):
+    """
+    Queues (phone_number, message, dedupe_key) tuples with one INSERT per
+    `batch_size` rows, and returns how many were queued. Messages whose
+    dedupe_key was already queued are skipped, so notification sweeps can
+    safely run again.
+    """
+    queued = 0
+    messages = iter(messages)
+    while batch := list(islice(messages, batch_size)):
+        jobs, keys = [], set()
+        for phone, message, key in batch:
+            if key is None or key not in keys:
+                jobs.append(SMSJob(phone_number=phone, message=message, dedupe_key=key))
+                keys.add(key)
+        queued += _insert_new(jobs)
+    return queued
+
+
+def _insert_new(jobs):
+    """inserts `jobs` but those whose dedupe_key is taken, returns how many rows went in"""
+    # bulk_create(ignore_conflicts=True) can't tell which rows it dropped, the INSERT's row count can
+    connection = connections[router.db_for_write(SMSJob)]
+    fields = [field for field in SMSJob._meta.concrete_fields if not field.primary_key]
+    size = connection.ops.bulk_batch_size(fields, jobs)
+    inserted = 0
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for start in range(0, len(jobs), size):
+            query = InsertQuery(SMSJob, on_conflict=OnConflict.IGNORE)
+            query.insert_values(fields, jobs[start:start + size])
+            for sql, params in query.get_compiler(connection=connection).as_sql():
+                cursor.execute(sql, params)
+                inserted += cursor.rowcount
+    return inserted
+
+
+def claim_jobs(batch_size, now=None):
+    """
+    Leases up to `batch_size` due jobs to this worker. Jobs whose lease ran out
+    (a worker died mid-send) are picked up again.
+    """
+    now = now or timezone.now()
+    due = (
+        Q(status='queued', available_at__lte=now)
+        | Q(status='sending', locked_until__lt=now)
+    )
+    with transaction.atomic():
+        ids = list(
+            SMSJob.objects.select_for_update(skip_locked=True)
+            .filter(due)
+            .order_by('available_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        SMSJob.objects.filter(id__in=ids).update(status='sending', locked_until=now + LEASE)
+    return list(SMSJob.objects.filter(id__in=ids).order_by('available_at'))
+
+
+def coalesce(jobs, max_recipients):
+    """groups jobs with identical text into chunks of at most `max_recipients`"""
+    by_message = defaultdict(list)
+    for job in jobs:
+        by_message[job.message].append(job)
+    for message, group in by_message.items():
+        for start in range(0, len(group), max_recipients):
+            yield message, group[start:start + max_recipients]
+
+
+class SMSWorker:
+    FIELDS = ['status', 'message', 'attempts', 'available_at', 'locked_until', 'last_error', 'sent_at']
+
+    def __init__(self, batch_size=1000, max_attempts=MAX_ATTEMPTS, retry_base=RETRY_BASE):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        # one keep-alive connection pool for every message this worker sends
+        self.session = requests.Session()
+
+    def deliver(self, message, jobs):
+        """sends one multi-recipient request and records the outcome on every job in it"""
+        now = timezone.now()
+        deliverable = []
+        for job in jobs:
+            try:
+                validate_phone_number(job.phone_number)
+            except ValueError as e:
+                self._mark(job, 'dead', error=str(e))
+            else:
+                deliverable.append(job)
+
+        if deliverable:
+            try:
+                send_bulk_sms([job.phone_number for job in deliverable], message, session=self.session)
+            except SMSGatewayUnavailable as e:
+                # the gateway was never tried, so this doesn't use up an attempt
+                for job in deliverable:
+                    self._mark(job, 'queued', error=str(e), retry_at=now + timedelta(seconds=self.retry_base))
+            except Exception as e:
+                for job in deliverable:
+                    job.attempts += 1
+                    if job.attempts >= self.max_attempts:
+                        self._mark(job, 'dead', error=str(e))
+                    else:
+                        delay = self.retry_base * 2 ** (job.attempts - 1)
+                        self._mark(job, 'queued', error=str(e), retry_at=now + timedelta(seconds=delay))
+                if any(job.status == 'dead' for job in deliverable):
+                    logger.error("giving up on %s SMS jobs after %s attempts: %s",
+                                 sum(job.status == 'dead' for job in deliverable), self.max_attempts, e)
+            else:
+                for job in deliverable:
+                    job.attempts += 1
+                    job.sent_at = now
+                    self._mark(job, 'sent')
+
+        SMSJob.objects.bulk_update(jobs, self.FIELDS)
+        for outcome, count in Counter(job.status for job in jobs).items():
+            SMS_DELIVERIES.labels(outcome).inc(count)
+
+    @staticmethod
+    def _mark(job, status, error='', retry_at=None):
+        job.status = status
+        job.last_error = error
+        job.locked_until = None
+        if status in ('sent', 'dead'):
+            job.message = ''
+        if retry_at:
+            job.available_at = retry_at
+
+    def run_once(self):
+        """delivers one batch of due jobs and returns how many were processed"""
+        jobs = claim_jobs(self.batch_size)
+        for message, chunk in coalesce(jobs, settings.SMS_MAX_RECIPIENTS):
+            self.deliver(message, chunk)
+        return len(jobs)
+
+    def run_forever(self, poll_interval=1.0, window=0.5):
+        """
+        Keeps draining the queue. After a partial batch it waits `window`
+        seconds so that messages arriving together can share a request.
+        """
+        while True:
+            processed = self.run_once()
+            if not processed:
+                time.sleep(poll_interval)
+            elif processed < self.batch_size:
+                time.sleep(window)
@@ -1,2 +1,703 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import re
+
+import httpx
+import requests
+from django.contrib.sessions.models import Session
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from config.checks import check_shared_cache
+from config.resilience import BulkheadFull, CircuitOpen, ResilientProvider, reset_providers, get_provider
+from .models import Motorist, OTP, SMSJob
+from .otp import INVALID, LOCKED, MAX_ATTEMPTS, VALID, issue_otp, verify_otp
+from .sms import SMSWorker, enqueue_many, enqueue_sms
+from . import blacklist
+from .authentication import RoleJWTAuthentication
+from .models import ParkingOperator
+from .signals import forget_users, user_cache_key
+from .tokens import PENDING_REGISTRATION_SALT, RoleRefreshToken, read_registration_token
+from .utils import send_otp
+
+
+class FakeGateway:
+    """
+    Local HTTP server standing in for the SMS/payment gateways. Tests can set
+    `delay` (seconds before answering) and `statuses` (status codes handed out
+    in order, the last one repeating) and inspect the `requests` it received.
+    """
+
+    def __init__(self):
+        self.delay = 0
+        self.statuses = [200]
+        self.requests = []
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                gateway.requests.append(json.loads(body or b"{}"))
+                time.sleep(gateway.delay)
+                status = gateway.statuses.pop(0) if len(gateway.statuses) > 1 else gateway.statuses[0]
+                payload = json.dumps({"success": status < 400}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # clients hanging up on a slow answer is the point of most tests
+                pass
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v2/send-sms"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class GatewayTestMixin:
+    def setUp(self):
+        super().setUp()
+        self.gateway = FakeGateway()
+        self.addCleanup(self.gateway.close)
+        reset_providers()
+        self.addCleanup(reset_providers)
+
+
+class ResilientProviderTests(GatewayTestMixin, SimpleTestCase):
+    def make_provider(self, **options):
+        options = {"timeout": (1, 0.2), "backoff_base": 0.01, "reset_timeout": 60, **options}
+        return ResilientProvider("test", **options)
+
+    def test_slow_provider_times_out_within_budget(self):
+        self.gateway.delay = 1
+        provider = self.make_provider(max_attempts=2)
+
+        started = time.monotonic()
+        with self.assertRaises(requests.Timeout):
+            provider.request("POST", self.gateway.url, json={})
+
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(provider.metrics()["retries"], 1)
+
+    def test_retries_server_errors_then_succeeds(self):
+        self.gateway.statuses = [503, 200]
+        provider = self.make_provider(max_attempts=3)
+
+        response = provider.request("POST", self.gateway.url, json={})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.gateway.requests), 2)
+
+    def test_circuit_opens_and_fails_fast(self):
+        self.gateway.statuses = [500]
+        provider = self.make_provider(max_attempts=1, failure_threshold=2)
+
+        with self.assertLogs("config.resilience", "WARNING"):
+            for _ in range(2):
+                with self.assertRaises(Exception):
+                    provider.request("POST", self.gateway.url, json={})
+        with self.assertRaises(CircuitOpen):
+            provider.request("POST", self.gateway.url, json={})
+
+        self.assertEqual(len(self.gateway.requests), 2)
+        self.assertEqual(provider.metrics()["state"], "open")
+        self.assertEqual(provider.metrics()["short_circuited"], 1)
+
+    def test_half_open_probe_closes_the_circuit(self):
+        self.gateway.statuses = [500, 200]
+        provider = self.make_provider(max_attempts=1, failure_threshold=1, reset_timeout=0.05)
+
+        with self.assertLogs("config.resilience", "WARNING"), self.assertRaises(Exception):
+            provider.request("POST", self.gateway.url, json={})
+        time.sleep(0.06)
+        provider.request("POST", self.gateway.url, json={})
+
+        self.assertEqual(provider.metrics()["state"], "closed")
+
+    def test_full_bulkhead_does_not_use_up_the_probe(self):
+        self.gateway.statuses = [500, 200]
+        provider = self.make_provider(max_attempts=1, failure_threshold=1, reset_timeout=0.05,
+                                      max_concurrent=1, acquire_timeout=0)
+        with self.assertLogs("config.resilience", "WARNING"), self.assertRaises(Exception):
+            provider.request("POST", self.gateway.url, json={})
+        time.sleep(0.06)
+
+        provider.bulkhead.acquire()
+        with self.assertRaises(BulkheadFull):
+            provider.request("POST", self.gateway.url, json={})
+        provider.bulkhead.release()
+
+        self.assertEqual(provider.request("POST", self.gateway.url, json={}).status_code, 200)
+        self.assertEqual(provider.metrics()["state"], "closed")
+
+    def test_bulkhead_rejects_calls_beyond_the_limit(self):
+        self.gateway.delay = 0.3
+        provider = self.make_provider(timeout=(1, 1), max_concurrent=1, acquire_timeout=0)
+        slow = threading.Thread(target=provider.request, args=("POST", self.gateway.url), kwargs={"json": {}})
+        slow.start()
+        time.sleep(0.1)
+
+        with self.assertRaises(BulkheadFull):
+            provider.request("POST", self.gateway.url, json={})
+        slow.join()
+
+        self.assertEqual(provider.metrics()["rejected"], 1)
+        self.assertEqual(provider.metrics()["in_flight"], 0)
+
+    def test_async_requests_share_the_policies(self):
+        self.gateway.statuses = [503, 200]
+        self.gateway.delay = 0.2
+        provider = self.make_provider(timeout=(1, 1), max_attempts=3, max_concurrent=1)
+
+        async def run():
+            async with httpx.AsyncClient() as client:
+                first = asyncio.create_task(provider.arequest(client, "POST", self.gateway.url, json={}))
+                await asyncio.sleep(0.05)
+                with self.assertRaises(BulkheadFull):
+                    await provider.arequest(client, "POST", self.gateway.url, json={})
+                return await first
+
+        self.assertEqual(asyncio.run(run()).status_code, 200)
+        self.assertEqual(len(self.gateway.requests), 2)
+        self.assertEqual((provider.metrics()["retries"], provider.metrics()["rejected"]), (1, 1))
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    def test_production_needs_a_shared_cache(self):
+        local = {"CACHES": {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+                 "LIVE_BROKER": {"BACKEND": "parking.live.LocalBroker"}}
+        shared = {"CACHES": {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache"}},
+                  "LIVE_BROKER": {"BACKEND": "parking.live.RedisBroker"}}
+
+        with override_settings(DEBUG=False, **local):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ["config.E001", "config.E002"])
+        with override_settings(DEBUG=False, **shared):
+            self.assertEqual(check_shared_cache(None), [])
+        with override_settings(DEBUG=True, **local):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+@mock.patch.dict(os.environ, {"SMS_APIKEY": "test-key"})
+class SendOTPTests(GatewayTestMixin, SimpleTestCase):
+    def test_sends_through_the_gateway(self):
+        with override_settings(SMS_API_URL=self.gateway.url):
+            self.assertTrue(send_otp("0712345678", 123456))
+
+        self.assertEqual(self.gateway.requests[0]["recipients"], [{"number": "255712345678"}])
+
+    def test_stalled_gateway_does_not_block_the_caller(self):
+        self.gateway.delay = 1
+        with override_settings(SMS_API_URL=self.gateway.url, EXTERNAL_PROVIDERS={
+            "notify_africa": {"timeout": (1, 0.1), "max_attempts": 1, "failure_threshold": 1},
+        }):
+            with self.assertLogs("config.resilience", "WARNING"), self.assertRaises(Exception):
+                send_otp("0712345678", 123456)
+            started = time.monotonic()
+            with self.assertRaisesMessage(Exception, "SMS gateway unavailable"):
+                send_otp("0712345678", 123456)
+
+        self.assertLess(time.monotonic() - started, 0.05)
+        self.assertEqual(get_provider("notify_africa").metrics()["state"], "open")
+
+
+@mock.patch.dict(os.environ, {"SMS_APIKEY": "test-key"})
+class SMSQueueTests(GatewayTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(SMS_API_URL=self.gateway.url, EXTERNAL_PROVIDERS={
+            "notify_africa": {"timeout": (1, 0.5), "max_attempts": 1, "failure_threshold": 100},
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.worker = SMSWorker(max_attempts=2, retry_base=0)
+
+    def test_registration_queues_the_otp_without_calling_the_gateway(self):
+        response = self.client.post("/api/auth/register/", {
+            "first_name": "Juma", "last_name": "Ali", "phone_number": "0712345678", "password": "s3cret-pass",
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.gateway.requests, [])
+        job = SMSJob.objects.get()
+        self.assertEqual(job.status, "queued")
+        self.assertIn("egesha OTP", job.message)
+
+    def test_a_delivered_otp_leaves_no_copy_of_the_code(self):
+        cache.clear()
+        self.client.post("/api/auth/register/", {
+            "first_name": "Juma", "last_name": "Ali", "phone_number": "0712345678", "password": "s3cret-pass",
+        })
+
+        self.worker.run_once()
+
+        code = re.search(r"\d{6}", self.gateway.requests[0]["sms"]).group()
+        self.assertFalse(SMSJob.objects.filter(message__contains=code).exists())
+        self.assertFalse(any(code in key for key in cache._cache))
+
+    def test_enqueue_many_counts_only_the_jobs_it_inserted(self):
+        # queued by a sweep that got there first
+        SMSJob.objects.create(phone_number="255712345678", message="hello", dedupe_key="taken")
+
+        queued = enqueue_many([
+            ("255712345678", "hello", "taken"),
+            ("255712345678", "hello", "new"),
+            ("255712345678", "hello", "new"),
+            ("255712345679", "hello", None),
+        ], batch_size=2)
+
+        self.assertEqual(queued, 2)
+        self.assertEqual(SMSJob.objects.count(), 3)
+
+    def test_worker_delivers_queued_jobs(self):
+        enqueue_sms("0712345678", "hello")
+
+        self.assertEqual(self.worker.run_once(), 1)
+
+        job = SMSJob.objects.get()
+        self.assertEqual((job.status, job.attempts, job.message), ("sent", 1, ""))
+        self.assertIsNotNone(job.sent_at)
+        self.assertEqual(self.gateway.requests[0]["sms"], "hello")
+
+    def test_failed_jobs_are_retried_then_dead_lettered(self):
+        self.gateway.statuses = [500]
+        enqueue_sms("0712345678", "hello")
+
+        self.worker.run_once()
+        job = SMSJob.objects.get()
+        self.assertEqual((job.status, job.attempts), ("queued", 1))
+
+        with self.assertLogs("users.sms", "ERROR"):
+            self.worker.run_once()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.message), ("dead", 2, ""))
+        self.assertIn("500", job.last_error)
+
+    def test_expired_leases_are_reclaimed(self):
+        job = enqueue_sms("0712345678", "hello")
+        SMSJob.objects.filter(pk=job.pk).update(status="sending", locked_until=timezone.now())
+
+        self.assertEqual(self.worker.run_once(), 1)
+        self.assertEqual(SMSJob.objects.get().status, "sent")
+
+    def test_jobs_with_the_same_text_share_a_request(self):
+        for number in ("0712000001", "0712000002", "0712000003"):
+            enqueue_sms(number, "lot closing soon")
+        enqueue_sms("0712000004", "hello")
+
+        with override_settings(SMS_MAX_RECIPIENTS=2):
+            self.assertEqual(self.worker.run_once(), 4)
+
+        self.assertEqual(sorted(len(r["recipients"]) for r in self.gateway.requests), [1, 1, 2])
+        self.assertEqual(SMSJob.objects.filter(status="sent").count(), 4)
+
+    def test_invalid_numbers_are_dead_lettered_without_failing_the_batch(self):
+        enqueue_sms("0712000001", "hello")
+        SMSJob.objects.create(phone_number="not-a-number", message="hello")
+
+        self.worker.run_once()
+
+        self.assertEqual(self.gateway.requests[0]["recipients"], [{"number": "255712000001"}])
+        self.assertEqual(SMSJob.objects.get(phone_number="not-a-number").status, "dead")
+
+
+class OTPStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_code_is_single_use(self):
+        code = issue_otp("255712345678")
+
+        self.assertEqual(verify_otp("255712345678", code), VALID)
+        self.assertEqual(verify_otp("255712345678", code), INVALID)
+
+    def test_concurrent_verifications_consume_the_code_once(self):
+        code = issue_otp("255712345678")
+        start = threading.Barrier(MAX_ATTEMPTS)
+        results = []
+
+        def verify():
+            start.wait()
+            results.append(verify_otp("255712345678", code))
+
+        threads = [threading.Thread(target=verify) for _ in range(MAX_ATTEMPTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), [INVALID] * (MAX_ATTEMPTS - 1) + [VALID])
+
+    def test_plain_code_never_reaches_the_cache(self):
+        code = issue_otp("255712345678")
+
+        self.assertFalse(any(str(code) in key for key in cache._cache))
+        self.assertFalse(OTP.objects.exists())
+
+    def test_reissuing_invalidates_the_previous_code(self):
+        old = issue_otp("255712345678")
+        new = issue_otp("255712345678")
+
+        if old != new:
+            self.assertEqual(verify_otp("255712345678", old), INVALID)
+        self.assertEqual(verify_otp("255712345678", new), VALID)
+
+    def test_guessing_locks_the_code(self):
+        code = issue_otp("255712345678")
+        wrong = 100000 if code != 100000 else 100001
+        for _ in range(MAX_ATTEMPTS):
+            self.assertEqual(verify_otp("255712345678", wrong), INVALID)
+
+        self.assertEqual(verify_otp("255712345678", code), LOCKED)
+
+    def test_unknown_number_is_invalid(self):
+        self.assertEqual(verify_otp("255700000000", 123456), INVALID)
+
+
+@mock.patch.dict(os.environ, {"SMS_APIKEY": "test-key"})
+class RegistrationFlowTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def register(self):
+        response = self.client.post("/api/auth/register/", {
+            "first_name": "Juma", "last_name": "Ali", "phone_number": "0712345678", "password": "s3cret-pass",
+        })
+        self.assertEqual(response.status_code, 200)
+        code = int(re.search(r"\d{6}", SMSJob.objects.latest("id").message).group())
+        return code, response.json()["registration_token"]
+
+    def verify(self, code, token, phone_number="0712345678"):
+        return self.client.post("/api/auth/verify-otp/", {
+            "phone_number": phone_number, "otp": code, "registration_token": token,
+        })
+
+    def test_verified_registration_creates_the_motorist(self):
+        code, token = self.register()
+
+        response = self.verify(code, token)
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertIn("access", response.json()["tokens"])
+        motorist = Motorist.objects.get(phone_number="0712345678")
+        self.assertTrue(motorist.check_password("s3cret-pass"))
+        self.assertFalse(Session.objects.exists())
+
+    def test_token_only_names_the_pending_registration(self):
+        _, token = self.register()
+
+        pending_id = signing.loads(token, salt=PENDING_REGISTRATION_SALT)
+        self.assertIsInstance(pending_id, str)
+        self.assertNotIn("pbkdf2", token)
+        self.assertEqual(read_registration_token(token)["phone_number"], "0712345678")
+
+    def test_token_is_single_use(self):
+        code, token = self.register()
+
+        self.assertEqual(self.verify(code, token).status_code, 201)
+        self.assertIsNone(read_registration_token(token))
+
+    def test_forged_token_is_rejected_before_the_otp_is_used(self):
+        code, token = self.register()
+
+        response = self.verify(code, token[:-2] + "xx")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.verify(code, token).status_code, 201)
+
+    def test_token_for_another_number_is_rejected(self):
+        code, token = self.register()
+
+        self.assertEqual(self.verify(code, token, phone_number="0799999999").status_code, 400)
+
+    def test_wrong_code_is_rejected(self):
+        code, token = self.register()
+        wrong = 100000 if code != 100000 else 100001
+
+        response = self.verify(wrong, token)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Motorist.objects.exists())
+
+
+@override_settings(TOKEN_BUCKET_THROTTLES={
+    "otp": {"capacity": 1, "per_minute": 1},
+    "login": {"capacity": 2, "per_minute": 1},
+})
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def login(self, phone_number="0712345678", ip="10.0.0.1"):
+        return self.client.post("/api/auth/login/", {"phone_number": phone_number, "password": "wrong"},
+                                REMOTE_ADDR=ip)
+
+    def test_burst_beyond_capacity_is_rejected_without_queries(self):
+        self.assertEqual(self.login().status_code, 400)
+        self.assertEqual(self.login().status_code, 400)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.login()
+
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        self.assertEqual(len(queries), 0)
+
+    def test_phone_number_bucket_is_shared_across_ips(self):
+        self.login(ip="10.0.0.1")
+        self.login(ip="10.0.0.2")
+
+        self.assertEqual(self.login(ip="10.0.0.3").status_code, 429)
+        self.assertEqual(self.login(phone_number="0799999999", ip="10.0.0.4").status_code, 400)
+
+    def test_a_rejected_request_leaves_the_phone_number_bucket_alone(self):
+        self.login(phone_number="0799999999")
+        self.login(phone_number="0799999999")
+        # the same client, out of tokens, goes after another number
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, 429)
+
+        self.assertEqual(self.login(ip="10.0.0.2").status_code, 400)
+        self.assertEqual(self.login(ip="10.0.0.3").status_code, 400)
+
+    def test_a_request_finding_the_bucket_locked_is_turned_away(self):
+        cache.add("throttle:login:ip:10.0.0.1:lock", 1)
+
+        with mock.patch("time.sleep") as sleep:
+            response = self.login()
+
+        self.assertEqual(response.status_code, 429)
+        sleep.assert_not_called()
+        self.assertIsNone(cache.get("throttle:login:phone:255712345678"))
+
+    def test_tokens_refill_continuously(self):
+        now = time.time()
+        with mock.patch("time.time", return_value=now):
+            self.login()
+            self.login()
+        with mock.patch("time.time", return_value=now + 30):
+            response = self.login()
+            self.assertEqual((response.status_code, response["Retry-After"]), (429, "30"))
+        with mock.patch("time.time", return_value=now + 60):
+            self.assertEqual(self.login().status_code, 400)
+            self.assertEqual(self.login().status_code, 429)
+
+    def test_an_expired_bucket_starts_full(self):
+        now = time.time()
+        with mock.patch("time.time", return_value=now):
+            self.login()
+            self.login()
+            self.assertEqual(self.login().status_code, 429)
+            self.assertIsNotNone(cache.get("throttle:login:phone:255712345678"))
+        # a full refill period later the key is gone
+        with mock.patch("time.time", return_value=now + 122):
+            self.assertIsNone(cache.get("throttle:login:phone:255712345678"))
+            self.assertEqual(self.login().status_code, 400)
+            self.assertEqual(self.login().status_code, 400)
+            self.assertEqual(self.login().status_code, 429)
+
+    def test_otp_endpoints_have_their_own_bucket(self):
+        self.login()
+        self.login()
+
+        response = self.client.post("/api/auth/resend-otp/", {"phone_number": "0712345678"}, REMOTE_ADDR="10.0.0.9")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/api/auth/resend-otp/", {"phone_number": "0712345678"}, REMOTE_ADDR="10.0.0.9")
+        self.assertEqual(response.status_code, 429)
+
+
+class RoleClaimTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.motorist = Motorist.objects.create_user(phone_number="255712345678", password="pass",
+                                                     first_name="Juma", last_name="Ali")
+
+    def test_login_tokens_carry_the_role(self):
+        response = self.client.post("/api/auth/login/", {"phone_number": "255712345678", "password": "pass"})
+
+        access = RoleJWTAuthentication().get_validated_token(response.json()["access"])
+        self.assertEqual(access["role"], "motorist")
+
+    def test_user_is_loaded_as_its_role_class_then_cached(self):
+        token = RoleRefreshToken.for_user(self.motorist).access_token
+        auth = RoleJWTAuthentication()
+
+        with self.assertNumQueries(1):
+            user = auth.get_user(token)
+        with self.assertNumQueries(0):
+            self.assertEqual(auth.get_user(token), user)
+
+        self.assertIsInstance(user, Motorist)
+
+    def test_saving_the_user_drops_the_cached_copy(self):
+        token = RoleRefreshToken.for_user(self.motorist).access_token
+        auth = RoleJWTAuthentication()
+        auth.get_user(token)
+
+        self.motorist.first_name = "Hamisi"
+        self.motorist.save()
+
+        self.assertEqual(auth.get_user(token).first_name, "Hamisi")
+
+    def test_profile_needs_no_role_queries(self):
+        operator = ParkingOperator.objects.create_user(
+            phone_number="255700000001", password="pass", first_name="Op", company_name="Egesha",
+            business_telephone="255700000001", business_email="ops@example.com", address="Kariakoo", city="Dar",
+        )
+        token = RoleRefreshToken.for_user(operator).access_token
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/auth/profile/me/", HTTP_AUTHORIZATION=f"Bearer {token}")
+
+        self.assertEqual(response.json()["role"], "parking operator")
+        self.assertEqual(response.json()["extra_data"]["company_name"], "Egesha")
+
+        # the cache only gave authentication its fields, the profile is one query
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/auth/profile/me/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(response.json()["extra_data"]["company_name"], "Egesha")
+
+    def test_the_cache_holds_no_password_hash(self):
+        token = RoleRefreshToken.for_user(self.motorist).access_token
+        RoleJWTAuthentication().get_user(token)
+
+        entry = cache.get(user_cache_key(self.motorist.pk))
+        self.assertEqual(set(entry), {"id", "role", "is_active", "password"})
+        self.assertNotIn(self.motorist.password, str(entry))
+
+    def test_bulk_updates_drop_the_cached_copies(self):
+        token = RoleRefreshToken.for_user(self.motorist).access_token
+        auth = RoleJWTAuthentication()
+        auth.get_user(token)
+
+        Motorist.objects.filter(pk=self.motorist.pk).update(is_active=False)
+        forget_users([self.motorist.pk])
+
+        with self.assertRaises(AuthenticationFailed):
+            auth.get_user(token)
+
+
+class TokenBlacklistTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        blacklist._local.clear()
+        self.motorist = Motorist.objects.create_user(phone_number="255712345678", password="pass",
+                                                     first_name="Juma", last_name="Ali")
+
+    def refresh(self, token):
+        return self.client.post("/api/token/refresh/", {"refresh": str(token)})
+
+    def test_login_does_not_write_outstanding_tokens(self):
+        self.client.post("/api/auth/login/", {"phone_number": "255712345678", "password": "pass"})
+
+        self.assertFalse(OutstandingToken.objects.exists())
+
+    def test_rotated_token_cannot_be_reused(self):
+        token = RoleRefreshToken.for_user(self.motorist)
+
+        first = self.refresh(token)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("role", RoleRefreshToken(first.json()["refresh"]).payload)
+        blacklist._local.clear()
+
+        self.assertEqual(self.refresh(token).status_code, 401)
+        self.assertEqual(self.refresh(first.json()["refresh"]).status_code, 200)
+
+    def test_seeded_cache_answers_without_queries(self):
+        used = RoleRefreshToken.for_user(self.motorist)
+        used.blacklist()
+        blacklist._local.clear()
+        blacklist.seed_cache()
+
+        with self.assertNumQueries(0):
+            self.assertTrue(blacklist.is_blacklisted(used["jti"]))
+        with self.assertNumQueries(1):
+            self.assertFalse(blacklist.is_blacklisted("unknown"))
+        with self.assertNumQueries(0):
+            self.assertFalse(blacklist.is_blacklisted("unknown"))
+
+    def test_evicted_entries_fall_back_to_the_database(self):
+        used = RoleRefreshToken.for_user(self.motorist)
+        used.blacklist()
+        blacklist._local.clear()
+        blacklist.seed_cache()
+        cache.delete(f"jwt:blacklist:{used['jti']}")
+
+        self.assertTrue(blacklist.is_blacklisted(used["jti"]))
+        blacklist._local.clear()
+        with self.assertNumQueries(0):
+            self.assertTrue(blacklist.is_blacklisted(used["jti"]))
+
+    def test_blacklisting_replaces_a_cached_negative(self):
+        token = RoleRefreshToken.for_user(self.motorist)
+        self.assertFalse(blacklist.is_blacklisted(token["jti"]))
+
+        token.blacklist()
+        blacklist._local.clear()
+
+        with self.assertNumQueries(0):
+            self.assertTrue(blacklist.is_blacklisted(token["jti"]))
+
+    def test_a_negative_cached_elsewhere_is_trusted_for_seconds_only(self):
+        token = RoleRefreshToken.for_user(self.motorist)
+        now = time.time()
+        with mock.patch("time.time", return_value=now):
+            self.assertFalse(blacklist.is_blacklisted(token["jti"]))
+        # blacklisted by a worker whose per-process cache doesn't hold this negative
+        outstanding = OutstandingToken.objects.create(
+            user=self.motorist, jti=token["jti"], token="", created_at=timezone.now(),
+            expires_at=timezone.now() + timezone.timedelta(days=1),
+        )
+        BlacklistedToken.objects.create(token=outstanding)
+
+        with mock.patch("time.time", return_value=now + blacklist.NEGATIVE_TTL + 1):
+            self.assertTrue(blacklist.is_blacklisted(token["jti"]))
+
+    def test_cold_cache_falls_back_to_the_database(self):
+        used = RoleRefreshToken.for_user(self.motorist)
+        used.blacklist()
+        blacklist._local.clear()
+        cache.clear()
+
+        self.assertTrue(blacklist.is_blacklisted(used["jti"]))
+        self.assertFalse(blacklist.is_blacklisted("unknown"))
+
+    def test_compaction_only_deletes_expired_tokens(self):
+        now = timezone.now()
+        # ids don't follow expiry: lifetimes differ and tokens are blacklisted out of order
+        for i in range(7):
+            expires_at = now + timezone.timedelta(days=1) if i in (0, 1, 4) else now - timezone.timedelta(days=1)
+            outstanding = OutstandingToken.objects.create(
+                user=self.motorist, jti=f"jti-{i}", token="", created_at=now, expires_at=expires_at,
+            )
+            BlacklistedToken.objects.create(token=outstanding)
+
+        call_command("compact_token_blacklist", batch_size=2, pause=0, stdout=open(os.devnull, "w"))
+
+        self.assertEqual(set(OutstandingToken.objects.values_list("jti", flat=True)), {"jti-0", "jti-1", "jti-4"})
+        self.assertEqual(BlacklistedToken.objects.count(), 3)
+        with self.assertNumQueries(0):
+            self.assertTrue(blacklist.is_blacklisted("jti-4"))
@@ -0,0 +1,94 @@
+"""
+Token bucket throttles for the unauthenticated auth/OTP endpoints.
+
+Buckets live in the shared cache so every worker draws from the same tokens.
+Each bucket is one key holding (tokens, refilled_at): on every request the
+bucket is refilled at `rate` for the time since `refilled_at`, up to
+`capacity`, then one token is taken if there is a whole one. Every write
+sets the key to expire one full refill period later, by which time the
+bucket would be full again, so an expired bucket and a full one are the
+same thing.
+
+The buckets are taken from in order, client IP first, and a request stops
+at the first one that turns it away: a client out of tokens can't keep
+draining the bucket of a phone number it targets.
+
+The read and write of a bucket happen under a short `cache.add` lock so
+concurrent requests can't spend the same token. The lock is tried once, a
+request finding it held is turned away rather than made to wait for it, so
+a check never sleeps in the worker. A check costs a few cache round trips
+and no database queries whether it is allowed or not.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+from .utils import validate_phone_number
+
+LOCK_TIMEOUT = 1
+
+
+class TokenBucketThrottle(BaseThrottle):
+    scope = None
+
+    def __init__(self):
+        config = settings.TOKEN_BUCKET_THROTTLES[self.scope]
+        self.capacity = config["capacity"]
+        self.rate = config["per_minute"] / 60.0
+        self.period = self.capacity / self.rate
+        self.retry_after = None
+
+    def get_idents(self, request):
+        """every bucket the request draws from: its client IP and, if given, its phone number"""
+        idents = [f"ip:{self.get_ident(request)}"]
+        phone_number = request.data.get("phone_number") if hasattr(request.data, "get") else None
+        if phone_number:
+            try:
+                phone_number = validate_phone_number(str(phone_number))
+            except ValueError:
+                pass
+            idents.append(f"phone:{phone_number}")
+        return idents
+
+    def take(self, ident):
+        """takes one token from the bucket for `ident`, returns seconds to wait if it was empty"""
+        key = f"throttle:{self.scope}:{ident}"
+        if not cache.add(f"{key}:lock", 1, LOCK_TIMEOUT):
+            # another request of the same client is being counted, turn this one away rather than queue it
+            return LOCK_TIMEOUT
+        try:
+            now = time.time()
+            tokens, refilled_at = cache.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + max(now - refilled_at, 0) * self.rate)
+            wait = None
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            cache.set(key, (tokens, now), int(self.period) + 1)
+            return wait
+        finally:
+            cache.delete(f"{key}:lock")
+
+    def allow_request(self, request, view):
+        for ident in self.get_idents(request):
+            wait = self.take(ident)
+            if wait is not None:
+                self.retry_after = wait
+                return False
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+
+class OTPThrottle(TokenBucketThrottle):
+    """limits how often an OTP SMS can be triggered"""
+    scope = "otp"
+
+
+class LoginThrottle(TokenBucketThrottle):
+    """limits password attempts, each of which costs a password hash"""
+    scope = "login"
@@ -0,0 +1,99 @@
+import secrets
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core import signing
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from config.replicas import pin_credentials
+from . import blacklist as jti_blacklist
+from .roles import role_of
+
+PENDING_REGISTRATION_SALT = "users.pending-registration"
+PENDING_REGISTRATION_MAX_AGE = timedelta(minutes=30)
+
+
+def _pending_key(pending_id):
+    return f"users:pending-registration:{pending_id}"
+
+
+def make_registration_token(validated_data):
+    """
+    Keeps a validated sign-up in the cache under a random id, with the
+    password hashed, and returns a signed, timestamped token carrying only
+    that id, which the client hands back when verifying its OTP.
+    """
+    data = dict(validated_data)
+    data["password"] = make_password(data["password"])
+    pending_id = secrets.token_urlsafe(32)
+    cache.set(_pending_key(pending_id), data, int(PENDING_REGISTRATION_MAX_AGE.total_seconds()))
+    return signing.dumps(pending_id, salt=PENDING_REGISTRATION_SALT)
+
+
+def _pending_id(token):
+    try:
+        return signing.loads(token, salt=PENDING_REGISTRATION_SALT,
+                             max_age=PENDING_REGISTRATION_MAX_AGE)
+    except signing.BadSignature:
+        return None
+
+
+def read_registration_token(token):
+    """returns the pending sign-up, or None if the token is forged, expired or used"""
+    pending_id = _pending_id(token)
+    return cache.get(_pending_key(pending_id)) if pending_id else None
+
+
+def drop_registration_token(token):
+    """forgets the pending sign-up of a completed registration"""
+    pending_id = _pending_id(token)
+    if pending_id:
+        cache.delete(_pending_key(pending_id))
+
+
+class RoleRefreshToken(RefreshToken):
+    """
+    Refresh token (and the access tokens made from it) carrying the user's
+    role. Blacklist checks go through the cache-backed set in
+    users/blacklist.py, and tokens are only written to the outstanding token
+    table once they are blacklisted, instead of on every login and refresh.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        # skip BlacklistMixin.for_user, which inserts an OutstandingToken row
+        token = super(BlacklistMixin, cls).for_user(user)
+        token["role"] = role_of(user)
+        return token
+
+    def check_blacklist(self):
+        if jti_blacklist.is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        jti_blacklist.add(
+            self.payload[api_settings.JTI_CLAIM],
+            datetime_from_epoch(self.payload["exp"]),
+            user_id=self.payload.get(api_settings.USER_ID_CLAIM),
+            token=str(self),
+        )
+
+    def outstand(self):
+        return None
+
+
+def token_pair(user):
+    """
+    a new access and refresh token for `user`, with the first reads made
+    with them pinned to the primary: a user who just registered may not be
+    on the replicas yet
+    """
+    refresh = RoleRefreshToken.for_user(user)
+    access = str(refresh.access_token)
+    pin_credentials(f"{api_settings.AUTH_HEADER_TYPES[0]} {access}")
+    return {"access": access, "refresh": str(refresh)}
@@ -1,14 +1,16 @@
-import random
+import secrets
 import requests
 import os
 from dotenv import load_dotenv
 import re
+from django.conf import settings
+from config.resilience import get_provider, ProviderUnavailable, RetryableResponse
 load_dotenv()
 
 
 def generate_otp():
     """generate a random 6-digit OTP"""
-    return random.randint(100000, 999999)
+    return 100000 + secrets.randbelow(900000)
 
 def validate_phone_number(phone_number: str) -> str:
     """
@@ -31,22 +33,42 @@ def validate_phone_number(phone_number: str) -> str:
     return phone_number
 
 
-def send_otp(phone_number, otp):
-    """sending an OTP to a phone number through SMS service"""
+class SMSDeliveryError(Exception):
+    """the SMS gateway did not accept a message"""
+
+
+class SMSGatewayUnavailable(SMSDeliveryError):
+    """the SMS gateway is failing fast, the message was never sent"""
+
+
+def otp_message(otp):
+    return f"Your egesha OTP is {otp}. It is valid for 15 minutes."
+
+
+def send_sms(phone_number, message, session=None):
+    """sending a text message to a phone number through SMS service"""
+    return send_bulk_sms([phone_number], message, session=session)
+
+
+def send_bulk_sms(phone_numbers, message, session=None):
+    """sending the same text message to many phone numbers in one gateway request"""
     sms_token = os.getenv("SMS_APIKEY")
 
     if not sms_token:
         raise ValueError("SMS credentials not found in environment variables")
 
-    #validate and format the phone number
-    validated_number = validate_phone_number(phone_number)
+    if len(phone_numbers) > settings.SMS_MAX_RECIPIENTS:
+        raise ValueError(f"At most {settings.SMS_MAX_RECIPIENTS} recipients per request")
 
-    url = "https://api.notify.africa/v2/send-sms"
+    #validate and format the phone numbers
+    validated_numbers = [validate_phone_number(number) for number in phone_numbers]
+
+    url = settings.SMS_API_URL
     payload = {
         "sender_id": "55",
         "schedule":"none",
-        "recipients":  [{"number": validated_number}],
-        "sms": f"Your egesha OTP is {otp}. It is valid for 15 minutes."
+        "recipients":  [{"number": number} for number in validated_numbers],
+        "sms": message
     }
     headers = {
         "Content-Type": "application/json",
@@ -55,10 +77,17 @@ def send_otp(phone_number, otp):
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = get_provider("notify_africa").request("POST", url, session=session, json=payload, headers=headers)
         response.raise_for_status()
         return True
-    except requests.exceptions.RequestException as e:
+    except ProviderUnavailable as e:
+        raise SMSGatewayUnavailable(f"Error sending SMS: SMS gateway unavailable ({e})")
+    except (requests.exceptions.RequestException, RetryableResponse) as e:
         status = getattr(e.response, "status_code", "N/A")
         text = getattr(e.response, "text", "No response body")
-        raise Exception(f"Error sending OTP: {e}, Status: {status}, Response: {text}")
+        raise SMSDeliveryError(f"Error sending SMS: {e}, Status: {status}, Response: {text}")
+
+
+def send_otp(phone_number, otp):
+    """sending an OTP to a phone number through SMS service"""
+    return send_sms(phone_number, otp_message(otp))
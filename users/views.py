@@ -1,8 +1,5 @@
 from django.db import transaction
-from django.utils import timezone
-from datetime import timedelta
-from rest_framework_simplejwt.tokens import RefreshToken
-from .models import  OTP, Motorist
+from .models import Motorist
 from rest_framework.response import Response
 from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_201_CREATED, HTTP_200_OK
 from .serializers import MotoristRegistrationSerializer,  MotoristLoginSerializer, \
@@ -10,52 +7,45 @@ from .serializers import MotoristRegistrationSerializer,  MotoristLoginSerialize
 from rest_framework.generics import GenericAPIView
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny,  IsAuthenticated
-from .utils import generate_otp, send_otp
+from .authentication import load_user
+from .otp import issue_otp
+from .throttles import OTPThrottle, LoginThrottle
+from .tokens import drop_registration_token, make_registration_token, read_registration_token, token_pair
+from .roles import get_motorist, get_operator
+from .sms import enqueue_otp
 
 
 class CurrentUserView(APIView):
     permission_classes = [IsAuthenticated]
+    query_budget = 1
 
     def get(self, request):
-        serializer = CurrentUserSerializer(request.user)
+        serializer = CurrentUserSerializer(load_user(request.user))
         return Response(serializer.data)
 
 class MotoristRegistrationView(GenericAPIView):
     """endpoint for the client to create the new user"""
     permission_classes = [AllowAny]
+    query_budget = 3
+    throttle_classes = [OTPThrottle]
     serializer_class = MotoristRegistrationSerializer
 
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            # Store registration data temporarily (you might want to use cache/session)
             phone_number = serializer.validated_data["phone_number"]
 
-            # Generate and send OTP
+            # Generate the OTP and queue it for the SMS worker
             try:
-                otp_value = generate_otp()
-                if send_otp(phone_number, otp_value):
-                    # Clear any existing OTPs for this phone number
-                    OTP.objects.filter(phone_number=phone_number).delete()
+                enqueue_otp(phone_number, issue_otp(phone_number))
 
-                    # Save OTP to database
-                    OTP.objects.create(
-                        phone_number=phone_number,
-                        otp=otp_value,
-                        expires_at=timezone.now() + timedelta(minutes=15)
-                    )
-
-                    # Store registration data in session for later use
-                    request.session['pending_registration'] = serializer.validated_data
-
-                    return Response({
-                        "message": "OTP sent successfully, please verify your phone number"
-                    }, status=HTTP_200_OK)
-                else:
-                    return Response({
-                        "message": "Failed to send OTP, please try again."
-                    }, status=HTTP_400_BAD_REQUEST)
-            except Exception as e:
+                # The registration data waits in the cache, the client only gets
+                # a signed token naming it and sends that back with the OTP
+                return Response({
+                    "message": "OTP sent successfully, please verify your phone number",
+                    "registration_token": make_registration_token(serializer.validated_data)
+                }, status=HTTP_200_OK)
+            except ValueError as e:
                 return Response({
                     "message": f"Error sending OTP: {str(e)}"
                 }, status=HTTP_400_BAD_REQUEST)
@@ -66,42 +56,33 @@ class MotoristRegistrationView(GenericAPIView):
 class OTPVerificationView(GenericAPIView):
     """endpoint to verify the otp sent to the user and create the user record"""
     permission_classes = [AllowAny]
+    query_budget = 4
     serializer_class = VerifyRegistrationOTPSerializer
 
     def post(self, request, *args, **kwargs):
+        # Get pending registration data (checked before the OTP is used up)
+        registration_token = request.data.get('registration_token', '')
+        pending_data = read_registration_token(registration_token)
+        if not pending_data or pending_data['phone_number'] != request.data.get('phone_number'):
+            return Response({
+                "message": "No pending registration found for this phone number"
+            }, status=HTTP_400_BAD_REQUEST)
+
         serializer = self.get_serializer(data=request.data)
 
         if serializer.is_valid():
-            phone_number = serializer.validated_data['phone_number']
-
-            # Get pending registration data
-            pending_data = request.session.get('pending_registration')
-            if not pending_data or pending_data['phone_number'] != phone_number:
-                return Response({
-                    "message": "No pending registration found for this phone number"
-                }, status=HTTP_400_BAD_REQUEST)
-
             try:
                 with transaction.atomic():
-                    # Create the motorist
+                    # Create the motorist, the password was hashed when it was put aside
                     password = pending_data.pop('password')
                     motorist = Motorist(**pending_data)
-                    motorist.set_password(password)
+                    motorist.password = password
                     motorist.save()
-
-                    # Clear session data
-                    if 'pending_registration' in request.session:
-                        del request.session['pending_registration']
-
-                    # Generate tokens
-                    refresh = RefreshToken.for_user(motorist)
+                    drop_registration_token(registration_token)
 
                     return Response({
                         "message": "Motorist registered successfully",
-                        "tokens": {
-                            "access": str(refresh.access_token),
-                            "refresh": str(refresh)
-                        }
+                        "tokens": token_pair(motorist)
                     }, status=HTTP_201_CREATED)
 
             except Exception:
@@ -114,24 +95,21 @@ class OTPVerificationView(GenericAPIView):
 class MotoristLoginView(APIView):
     """view to handle motorist login"""
     permission_classes = [AllowAny]
+    query_budget = 3
+    throttle_classes = [LoginThrottle]
 
     def post(self,request):
         serializer = MotoristLoginSerializer(data=request.data)
 
         if serializer.is_valid():
             user = serializer.validated_data["user"]
-            #refresh jwt tokens
-            refresh = RefreshToken.for_user(user)
-            return Response({
-                "access":str(refresh.access_token),
-                "refresh": str(refresh)
-            }
-            ,status = HTTP_200_OK)
+            return Response(token_pair(user), status=HTTP_200_OK)
         return Response(serializer.errors, status=HTTP_400_BAD_REQUEST)
 
 class OperatorRegisterView(GenericAPIView):
     """view for registering an operator associated with parking"""
     permission_classes = [AllowAny]
+    query_budget = 3
     serializer_class = OperatorRegisterSerializer
 
     def post(self,request):
@@ -139,15 +117,11 @@ class OperatorRegisterView(GenericAPIView):
 
         if serializer.is_valid():
             operator = serializer.save()
-            refresh = RefreshToken.for_user(operator)
 
             return Response(
                 {
                     "message": "operator is registered successfully",
-                    "tokens": {
-                        "access": str(refresh.access_token),
-                        "refresh":str(refresh)
-                    },
+                    "tokens": token_pair(operator),
                     "user": {
                         "id": operator.id,
                         "first_name": operator.first_name,
@@ -160,6 +134,8 @@ class OperatorRegisterView(GenericAPIView):
 
 class OperatorLoginView(APIView):
     permission_classes = [AllowAny]
+    query_budget = 3
+    throttle_classes = [LoginThrottle]
 
     def post(self,request):
         serializer = OperatorLoginSerializer(data=request.data)
@@ -167,14 +143,10 @@ class OperatorLoginView(APIView):
         if serializer.is_valid():
             operator = serializer.validated_data["user"]
 
-
-            refresh = RefreshToken.for_user(operator)
             return Response({
                 "message": "operator authenticated successfully",
-                "tokens": {
-                    "access": str(refresh.access_token),
-                    "refresh": str(refresh)
-                }, "user": {
+                "tokens": token_pair(operator),
+                "user": {
                     "id": operator.id,
                     "first_name": operator.first_name,
                     "company_name": operator.company_name
@@ -184,29 +156,30 @@ class OperatorLoginView(APIView):
 
 class UserProfileView(APIView):
     permission_classes = [IsAuthenticated]
+    query_budget = {"get": 1, "put": 5}
 
     def get(self,request):
-        serializer = UserProfileSerializer(request.user)
+        serializer = UserProfileSerializer(load_user(request.user))
         return Response(serializer.data)
 
     def put(self, request):
-        user = request.user
+        user = load_user(request.user)
         serializer = UserProfileSerializer(user, data=request.data, partial=True)
 
         if serializer.is_valid():
             serializer.save()
 
             # Update role-specific fields if needed
-            if hasattr(user, 'motorist'):
-                motorist = user.motorist
+            motorist = get_motorist(user)
+            operator = get_operator(user)
+            if motorist is not None:
                 allowed_fields = ['phone_number']
                 for field in allowed_fields:
                     if field in request.data:
                         setattr(motorist, field, request.data[field])
                 motorist.save()
 
-            elif hasattr(user, 'parkingoperator'):
-                operator = user.parkingoperator
+            elif operator is not None:
                 allowed_fields = ['business_email', 'phone_number', 'city']
                 for field in allowed_fields:
                     if field in request.data:
@@ -221,6 +194,8 @@ class UserProfileView(APIView):
 class ResendOTPView(APIView):
     """view to resend OTP for phone verification"""
     permission_classes = [AllowAny]
+    query_budget = 2
+    throttle_classes = [OTPThrottle]
 
     def post(self, request):
         phone_number = request.data.get('phone_number')
@@ -231,27 +206,20 @@ class ResendOTPView(APIView):
             }, status=HTTP_400_BAD_REQUEST)
 
         # Check if there's pending registration
-        pending_data = request.session.get('pending_registration')
+        pending_data = read_registration_token(request.data.get('registration_token', ''))
         if not pending_data or pending_data['phone_number'] != phone_number:
             return Response({
                 "message": "No pending registration found for this phone number"
             }, status=HTTP_400_BAD_REQUEST)
 
-        # Generate and send new OTP
-        otp_value = generate_otp()
-        if send_otp(phone_number, otp_value):
-            # Clear existing OTPs and create new one
-            OTP.objects.filter(phone_number=phone_number).delete()
-            OTP.objects.create(
-                phone_number=phone_number,
-                otp=otp_value,
-                expires_at=timezone.now() + timedelta(minutes=15)
-            )
-
-            return Response({
-                "message": "OTP resent successfully"
-            }, status=HTTP_200_OK)
-        else:
+        # Generate a new OTP (replacing the old one) and queue it for the SMS worker
+        try:
+            enqueue_otp(phone_number, issue_otp(phone_number))
+        except ValueError:
             return Response({
                 "message": "Failed to send OTP, please try again"
-            }, status=HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            }, status=HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "message": "OTP resent successfully"
+        }, status=HTTP_200_OK)
\ No newline at end of file